@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Benchmark: reading WisecondorX results from bins.bed and aberrations.bed
+against reading them from a .npz archive, stored and compressed.
+
+The same synthetic results are written in the three forms, each is converted
+--repeat times and the read and total times are reported. The CGH files must
+be identical.
+
+    python benchmarks/bench_npz.py [--bin-size 5000] [--events 500] [--repeat 3]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import synthetic
+from wcx2cytosure.constants import AUTOSOMES
+from wcx2cytosure.metrics import Metrics
+from wcx2cytosure.npz import write_npz
+from wcx2cytosure.wcx2cytosure import default_args, run
+
+
+def write_results(workdir, genome, bin_size, n_events):
+	"""Write synthetic results as bins.bed and aberrations.bed, and as .npz (stored and compressed)"""
+	rng = np.random.default_rng(0)
+	ratios = []
+	for length in synthetic.CONTIG_LENGTHS[genome].values():
+		r = rng.normal(0, 0.15, -(-length // bin_size)).round(5)
+		r[rng.random(len(r)) < 0.05] = 0
+		ratios.append(r)
+	for name in ('bed', 'stored', 'compressed'):
+		os.mkdir(os.path.join(workdir, name))
+	aberrations_path = os.path.join(workdir, 'bed', 'sample.aberrations.bed')
+	synthetic.write_aberrations(aberrations_path, genome, n_events)
+	aberrations = pd.read_csv(aberrations_path, sep='\t', dtype={'chr': str})
+
+	# bins.bed as WisecondorX writes it from the same ratios
+	names = AUTOSOMES + ['X', 'Y']
+	chroms = np.concatenate([np.full(len(r), name, dtype=object) for name, r in zip(names, ratios)])
+	starts = np.concatenate([np.arange(len(r), dtype=np.int64) * bin_size + 1 for r in ratios])
+	ratio = np.concatenate(ratios)
+	bins = pd.DataFrame({'chr': chroms, 'start': starts, 'end': starts + bin_size - 1, 'id': 'bin',
+		'ratio': np.where(ratio == 0, np.nan, ratio), 'zscore': 0.0})
+	bins.to_csv(os.path.join(workdir, 'bed', 'sample.bins.bed'), sep='\t', index=False, na_rep='nan')
+	write_npz(os.path.join(workdir, 'stored', 'sample.npz'), bin_size, ratios, aberrations)
+	write_npz(os.path.join(workdir, 'compressed', 'sample.npz'), bin_size, ratios, aberrations, compress=True)
+	return len(ratio)
+
+
+def inputs(workdir, name):
+	if name == 'bed':
+		return os.path.join(workdir, name, 'sample.aberrations.bed'), os.path.join(workdir, name, 'sample.bins.bed')
+	return os.path.join(workdir, name, 'sample.npz'), os.path.join(workdir, name, 'sample.npz')
+
+
+def convert(workdir, name, genome):
+	aberrations, bins = inputs(workdir, name)
+	metrics = Metrics()
+	run(default_args(genome=genome, wisecondorx_aberrations=aberrations, wisecondorx_cov=bins,
+		out=os.path.join(workdir, name, 'sample.cgh'), no_cache=True), metrics)
+	return {stage: metrics.stages[stage].wall for stage in ('read_aberrations', 'read_bins', 'total')}
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument('--genome', type=int, default=37)
+	parser.add_argument('--bin-size', type=int, default=5000)
+	parser.add_argument('--events', type=int, default=500)
+	parser.add_argument('--repeat', type=int, default=3)
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as workdir:
+		n = write_results(workdir, args.genome, args.bin_size, args.events)
+		print(f'{n:,} bins, {args.events} aberrations')
+		for name in ('bed', 'stored', 'compressed'):
+			path = inputs(workdir, name)[1]
+			times = [convert(workdir, name, args.genome) for _ in range(args.repeat)]
+			best = {stage: min(t[stage] for t in times) for stage in times[0]}
+			print(f'{name:>10}: {os.path.getsize(path) / 1e6:7.1f} MB, read bins {best["read_bins"]:.3f} s, '
+				f'read aberrations {best["read_aberrations"]:.3f} s, total {best["total"]:.2f} s')
+		with open(os.path.join(workdir, 'bed', 'sample.cgh'), 'rb') as f:
+			expected = f.read()
+		for name in ('stored', 'compressed'):
+			with open(os.path.join(workdir, name, 'sample.cgh'), 'rb') as f:
+				assert f.read() == expected, f'{name}.npz gives another CGH file than the BED files'
+
+
+if __name__ == '__main__':
+	main()
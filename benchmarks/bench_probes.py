@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: probes/second for make_probe() + etree.tostring() against the
+bulk format_probes() emitter.
+
+    python benchmarks/bench_probes.py [--probes N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from lxml import etree
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wcx2cytosure.cgh import format_probes
+from wcx2cytosure.wcx2cytosure import coverage_heights, make_probe
+
+
+def per_probe(starts, ends, heights, ratios):
+	return b''.join(
+		etree.tostring(make_probe(None, '1', start, end, height, 'coverage', ratio), pretty_print=True)
+		for start, end, height, ratio in zip(starts.tolist(), ends.tolist(), heights.tolist(), ratios.tolist()))
+
+
+def bulk(starts, ends, heights, ratios):
+	return format_probes('1', starts, ends, heights, 'coverage', ratios)
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument('--probes', type=int, default=200000)
+	args = parser.parse_args()
+
+	rng = np.random.default_rng(0)
+	starts = np.arange(args.probes, dtype=np.int64) * 5000
+	ends = starts + 5000
+	ratios = rng.normal(0, 0.2, args.probes)
+	heights = coverage_heights(ratios)
+
+	results = {}
+	for name, emit in (('make_probe', per_probe), ('format_probes', bulk)):
+		started = time.perf_counter()
+		results[name] = emit(starts, ends, heights, ratios)
+		seconds = time.perf_counter() - started
+		print(f'{name:>14}: {args.probes / seconds:12,.0f} probes/s ({seconds:.2f} s)')
+	assert results['make_probe'] == results['format_probes']
+
+
+if __name__ == '__main__':
+	main()
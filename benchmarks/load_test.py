@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Throughput of the conversion service against one command line run per sample.
+
+The same synthetic sample is converted --jobs times, --concurrency at a time:
+first by starting `python -m wcx2cytosure` for every sample, then by sending
+the jobs to a `wcx2cytosure serve` service on a Unix socket.
+
+    python benchmarks/load_test.py --jobs 50 --concurrency 4 --bin-size 100000
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import synthetic
+from wcx2cytosure.serve import request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_inputs(workdir, genome, bin_size, n_events):
+	inputs = {
+		'wisecondorx_cov': os.path.join(workdir, 'sample.bins.bed'),
+		'wisecondorx_aberrations': os.path.join(workdir, 'sample.aberrations.bed'),
+		'tiddit_cov': os.path.join(workdir, 'sample.tiddit.tab'),
+	}
+	synthetic.write_bins(inputs['wisecondorx_cov'], genome, bin_size)
+	synthetic.write_aberrations(inputs['wisecondorx_aberrations'], genome, n_events)
+	synthetic.write_tiddit(inputs['tiddit_cov'], genome, 100000)
+	return inputs
+
+
+def run_cli(job):
+	command = [sys.executable, '-m', 'wcx2cytosure']
+	for option, value in job.items():
+		command += [f'--{option}', str(value)]
+	subprocess.run(command, check=True, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def run_service(address, job):
+	status, response = request(address, 'POST', '/convert', job)
+	if status != 200:
+		raise RuntimeError(response.get('error'))
+
+
+def wait_for(address, timeout=30):
+	deadline = time.monotonic() + timeout
+	while time.monotonic() < deadline:
+		try:
+			request(address, 'GET', '/health', timeout=1)
+			return
+		except OSError:
+			time.sleep(0.1)
+	raise RuntimeError(f'The service at {address} did not start')
+
+
+def timed(function, jobs, concurrency):
+	started = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=concurrency) as executor:
+		list(executor.map(function, jobs))
+	return time.perf_counter() - started
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument('--jobs', type=int, default=50)
+	parser.add_argument('--concurrency', type=int, default=os.cpu_count())
+	parser.add_argument('--genome', type=int, default=37, choices=[37, 38])
+	parser.add_argument('--bin-size', type=int, default=100000)
+	parser.add_argument('--events', type=int, default=100)
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as workdir:
+		inputs = make_inputs(workdir, args.genome, args.bin_size, args.events)
+		jobs = [dict(inputs, genome=args.genome, out=os.path.join(workdir, f'sample{i}.cgh')) for i in range(args.jobs)]
+
+		cli_seconds = timed(run_cli, jobs, args.concurrency)
+
+		address = os.path.join(workdir, 'service.sock')
+		service = subprocess.Popen([sys.executable, '-m', 'wcx2cytosure', 'serve', '--socket', address,
+			'--workers', str(args.concurrency)], cwd=ROOT, stderr=subprocess.DEVNULL)
+		try:
+			wait_for(address)
+			service_seconds = timed(lambda job: run_service(address, job), jobs, args.concurrency)
+			_, metrics = request(address, 'GET', '/metrics')
+		finally:
+			service.terminate()
+			service.wait()
+
+	print(f'{args.jobs} jobs, {args.concurrency} at a time, {args.bin_size} bp bins:')
+	print(f'  command line: {cli_seconds:.2f} s ({args.jobs / cli_seconds:.1f} jobs/s)')
+	print(f'  service:      {service_seconds:.2f} s ({args.jobs / service_seconds:.1f} jobs/s)')
+	print(f'  speed-up:     {cli_seconds / service_seconds:.1f}x')
+	print(f'  service metrics: {metrics}')
+
+
+if __name__ == '__main__':
+	main()
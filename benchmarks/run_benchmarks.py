@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Genome-scale benchmark of wcx2cytosure on synthetic inputs.
+
+Every combination of genome build, bins.bed bin size, number of aberrations,
+TIDDIT bin size and number of --workers is converted in a fresh process,
+timing each stage and recording the peak RSS. Results are written as JSON;
+pass --compare with an earlier results file to see the change per case and
+stage. With more than one --workers value, the speed-up of the probes and of
+the whole conversion over the first value is reported, together with the
+size of the pickled chromosome jobs that go to the worker processes.
+
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --bin-sizes 5000 --events 5000 --compare results.json
+    python benchmarks/run_benchmarks.py --bin-sizes 5000 --workers 1 2 4
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import os
+import pickle
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from io import BytesIO
+from multiprocessing import get_context
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import synthetic
+from wcx2cytosure import wcx2cytosure
+from wcx2cytosure.cgh import CGHWriter
+from wcx2cytosure.metrics import Metrics, peak_rss_mb
+
+
+def make_inputs(workdir, genome, bin_size, n_events, tiddit_bin_size):
+	"""Write the synthetic inputs for one case (reused if they exist)"""
+	prefix = os.path.join(workdir, f'GRCh{genome}')
+	paths = {
+		'wisecondorx_cov': f'{prefix}.{bin_size}.bins.bed',
+		'wisecondorx_aberrations': f'{prefix}.{n_events}.aberrations.bed',
+		'tiddit_cov': f'{prefix}.{tiddit_bin_size}.tiddit.tab',
+	}
+	if not os.path.exists(paths['wisecondorx_cov']):
+		synthetic.write_bins(paths['wisecondorx_cov'], genome, bin_size)
+	if not os.path.exists(paths['wisecondorx_aberrations']):
+		synthetic.write_aberrations(paths['wisecondorx_aberrations'], genome, n_events)
+	if not os.path.exists(paths['tiddit_cov']):
+		synthetic.write_tiddit(paths['tiddit_cov'], genome, tiddit_bin_size)
+	return paths
+
+
+def run_case(case):
+	"""
+	Time the stages of one conversion. Runs in a fresh process.
+
+	The probes of each chromosome are made by chromosome_fragments(), as in a
+	conversion; event_probes and coverage_probes are the times it records for
+	add_event_probes() and add_coverage_probes() (with add_y_probes()).
+	"""
+	stages = {}
+
+	@contextmanager
+	def stage(name):
+		started = time.perf_counter()
+		yield
+		stages[name] = round(time.perf_counter() - started, 4)
+
+	args = wcx2cytosure.default_args(genome=case['genome'], out=case['out'], workers=case['workers'], **case['inputs'])
+	CGH_TEMPLATE, CONTIG_LENGTHS = wcx2cytosure.genome_build(case['genome'])
+
+	with stage('ingest_aberrations'):
+		events = list(wcx2cytosure.wisecondorx_events(args, CONTIG_LENGTHS))
+	with stage('ingest_bins'):
+		bins = wcx2cytosure.parse_wisecondorx_coverages(args, CONTIG_LENGTHS)
+	with stage('ingest_tiddit'):
+		tiddit_coverage = wcx2cytosure.parse_tiddit_coverage(args)
+
+	events.sort(key=lambda event: CONTIG_LENGTHS.code(event.chrom))
+	probe_metrics = Metrics()
+	jobs = list(wcx2cytosure.chromosome_jobs(args, CONTIG_LENGTHS, events, bins, tiddit_coverage))
+	# what each chromosome job costs to send to a worker process
+	job_bytes = sum(len(pickle.dumps(job, pickle.HIGHEST_PROTOCOL)) for job in jobs) if args.workers > 1 else 0
+	with stage('probes'), wcx2cytosure.worker_map(args.workers) as map_jobs:
+		fragments = []
+		for fragment in map_jobs(wcx2cytosure.chromosome_fragments, jobs):
+			probe_metrics.merge(fragment[-1])
+			fragments.append(fragment)
+	for name in ('event_probes', 'coverage_probes', 'y_probes'):
+		if name in probe_metrics.stages:
+			stages[name] = round(probe_metrics.stages[name].wall, 4)
+	with stage('serialization'):
+		with CGHWriter(BytesIO(), CGH_TEMPLATE, 'sample') as writer:
+			writer.open_section('submission')
+			for e in events:
+				writer.write(wcx2cytosure.make_aberration(None, e.chrom, e.start, e.end, e.zscore, confirmation=e.type,
+					comment=str(e.zscore)))
+			writer.open_section('probes')
+			for _, probes, coverage, _, _ in fragments:
+				writer.write_serialized(probes.getvalue(), probes.n)
+				writer.write_serialized(coverage.getvalue(), coverage.n)
+			writer.open_section('segmentation')
+			for _, _, _, segments, _ in fragments:
+				writer.write_serialized(segments.getvalue(), segments.n)
+
+	metrics = Metrics()
+	with stage('end_to_end'):
+		result = wcx2cytosure.run(args, metrics)
+
+	return {
+		'stages': stages,
+		'peak_rss_mb': round(peak_rss_mb(), 1),
+		'bins': len(bins),
+		'events_kept': len(events),
+		'y_bins': len(tiddit_coverage.y_coverage),
+		'probes': result['probes'],
+		'bytes': result['bytes'],
+		'job_bytes': job_bytes,
+		'run_stages': metrics.to_dict(),
+	}
+
+
+def case_key(case, workers=True):
+	key = 'GRCh{genome}/bins={bin_size}/events={events}/tiddit={tiddit_bin_size}'.format(**case)
+	return key + f"/workers={case['workers']}" if workers and case['workers'] > 1 else key
+
+
+def git_commit():
+	try:
+		return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+			cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def compare(results, baseline):
+	previous = {case['key']: case for case in baseline['cases']}
+	print(f"\nChange against {baseline.get('commit')} (new / old):")
+	for case in results['cases']:
+		old = previous.get(case['key'])
+		if old is None:
+			continue
+		ratios = ' '.join(
+			f'{stage}={seconds / old["stages"][stage]:.2f}x'
+			for stage, seconds in case['stages'].items() if old['stages'].get(stage))
+		print(f"{case['key']}: {ratios} rss={case['peak_rss_mb'] / old['peak_rss_mb']:.2f}x")
+
+
+def report_speedup(cases):
+	"""Print the speed-up of each case over the same case with the fewest workers"""
+	baseline = {}
+	for case in cases:
+		base = baseline.setdefault(case_key(case, workers=False), case)
+		if case is base:
+			continue
+		speedups = ' '.join(f'{stage}={base["stages"][stage] / case["stages"][stage]:.2f}x'
+			for stage in ('probes', 'end_to_end') if case['stages'].get(stage))
+		print(f"{case['key']}: speed-up over {base['workers']} worker(s) {speedups}, "
+			f"jobs pickled {case['job_bytes'] / 1e6:.1f} MB")
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument('--genomes', type=int, nargs='+', default=[37, 38], choices=[37, 38])
+	parser.add_argument('--bin-sizes', type=int, nargs='+', default=[5000, 50000, 100000, 1000000])
+	parser.add_argument('--events', type=int, nargs='+', default=[0, 5000])
+	parser.add_argument('--tiddit-bin-sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+	parser.add_argument('--workers', type=int, nargs='+', default=[1],
+		help='numbers of worker processes for the probes (default: %(default)s)')
+	parser.add_argument('--workdir', default='benchmark_data', help='directory for the synthetic inputs (default: %(default)s)')
+	parser.add_argument('--output', default='benchmark_results.json')
+	parser.add_argument('--compare', help='earlier results file to compare against')
+	args = parser.parse_args()
+
+	os.makedirs(args.workdir, exist_ok=True)
+	results = {
+		'commit': git_commit(),
+		'date': datetime.datetime.now().isoformat(timespec='seconds'),
+		'python': platform.python_version(),
+		'machine': platform.machine(),
+		'cases': [],
+	}
+	for genome, bin_size, n_events, tiddit_bin_size, workers in itertools.product(
+			args.genomes, args.bin_sizes, args.events, args.tiddit_bin_sizes, args.workers):
+		case = {'genome': genome, 'bin_size': bin_size, 'events': n_events, 'tiddit_bin_size': tiddit_bin_size,
+			'workers': workers}
+		case['key'] = case_key(case)
+		inputs = make_inputs(args.workdir, genome, bin_size, n_events, tiddit_bin_size)
+		job = {'genome': genome, 'workers': workers, 'inputs': inputs, 'out': os.path.join(args.workdir, 'benchmark.cgh')}
+		# A fresh process per case so that the peak RSS belongs to that case alone
+		with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+			case.update(executor.submit(run_case, job).result())
+		results['cases'].append(case)
+		stages = ' '.join(f'{stage}={seconds:.2f}s' for stage, seconds in case['stages'].items())
+		print(f"{case['key']}: {stages} rss={case['peak_rss_mb']}MB probes={case['probes']}", flush=True)
+
+	if len(args.workers) > 1:
+		print()
+		report_speedup(results['cases'])
+
+	with open(args.output, 'w') as f:
+		json.dump(results, f, indent=1)
+	print(f'Wrote {args.output}')
+
+	if args.compare:
+		with open(args.compare) as f:
+			compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,83 @@
+"""
+Synthetic WisecondorX and TIDDIT inputs for benchmarking
+
+The files follow the layout of the real outputs: bins.bed with 1-based bin
+starts and a ratio column (nan for unmapped bins), aberrations.bed with
+gain/loss calls and a TIDDIT coverage table with a quality column.
+"""
+
+import numpy as np
+import pandas as pd
+
+from wcx2cytosure.constants import CONTIG_LENGTHS_37, CONTIG_LENGTHS_38
+
+CONTIG_LENGTHS = {37: CONTIG_LENGTHS_37, 38: CONTIG_LENGTHS_38}
+
+
+def contig_bins(genome, bin_size):
+	"""Return (chrom, start, end) arrays tiling every contig, 0-based half-open"""
+	chroms, starts, ends = [], [], []
+	for chrom, length in CONTIG_LENGTHS[genome].items():
+		start = np.arange(0, length, bin_size, dtype=np.int64)
+		chroms.append(np.full(len(start), chrom, dtype=object))
+		starts.append(start)
+		ends.append(np.minimum(start + bin_size, length))
+	return np.concatenate(chroms), np.concatenate(starts), np.concatenate(ends)
+
+
+def write_bins(path, genome=37, bin_size=100000, nan_fraction=0.05, seed=0):
+	"""Write a WisecondorX bins.bed file and return the number of bins"""
+	rng = np.random.default_rng(seed)
+	chroms, starts, ends = contig_bins(genome, bin_size)
+	ratio = rng.normal(0, 0.15, len(starts))
+	ratio[rng.random(len(starts)) < nan_fraction] = np.nan
+	df = pd.DataFrame({
+		'chr': chroms,
+		'start': starts + 1,
+		'end': ends,
+		'id': [f'{c}:{s + 1}-{e}' for c, s, e in zip(chroms, starts.tolist(), ends.tolist())],
+		'ratio': ratio,
+		'zscore': rng.normal(0, 1, len(starts)),
+	})
+	df.to_csv(path, sep='\t', index=False, float_format='%.5f', na_rep='nan')
+	return len(df)
+
+
+def write_aberrations(path, genome=37, n_events=100, seed=0):
+	"""Write a WisecondorX aberrations.bed file with n_events calls"""
+	rng = np.random.default_rng(seed)
+	lengths = CONTIG_LENGTHS[genome]
+	names = list(lengths)
+	chroms = rng.choice(names, n_events)
+	sizes = np.exp(rng.uniform(np.log(5e4), np.log(2e7), n_events)).astype(np.int64)
+	starts = np.array([rng.integers(0, max(lengths[c] - s, 1)) for c, s in zip(chroms, sizes)], dtype=np.int64)
+	gain = rng.random(n_events) < 0.5
+	df = pd.DataFrame({
+		'chr': chroms,
+		'start': starts + 1,
+		'end': starts + sizes,
+		'ratio': np.where(gain, 0.58, -1.0) + rng.normal(0, 0.05, n_events),
+		'zscore': np.where(gain, 1, -1) * rng.uniform(5, 50, n_events),
+		'type': np.where(gain, 'gain', 'loss'),
+	})
+	df = df.sort_values(['chr', 'start'], key=lambda column: column.map(names.index) if column.name == 'chr' else column)
+	df.to_csv(path, sep='\t', index=False, float_format='%.3f')
+	return n_events
+
+
+def write_tiddit(path, genome=37, bin_size=1000, male=True, seed=0):
+	"""Write a TIDDIT coverage table and return the number of bins"""
+	rng = np.random.default_rng(seed)
+	chroms, starts, ends = contig_bins(genome, bin_size)
+	expected = np.full(len(starts), 30.0)
+	expected[chroms == 'X'] = 15.0 if male else 30.0
+	expected[chroms == 'Y'] = 15.0 if male else 0.5
+	df = pd.DataFrame({
+		'#CHR': chroms,
+		'start': starts,
+		'end': ends,
+		'coverage': np.maximum(rng.normal(expected, 3), 0),
+		'quality': np.where(rng.random(len(starts)) < 0.1, 0, 60),
+	})
+	df.to_csv(path, sep='\t', index=False, float_format='%.2f')
+	return len(df)
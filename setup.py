@@ -11,7 +11,9 @@ setup(
 	description='Convert WCX output with structural variations to CytoSure format',
 	license='MIT',
 	packages=find_packages(exclude=["tests/", "dist/", "build/"]),
-	install_requires=['lxml','pandas', 'cyvcf2'],
+	python_requires='>=3.8',
+	install_requires=['lxml', 'numpy>=1.20', 'pandas>=1.5', 'cyvcf2'],
+	extras_require={'tabix': ['pysam']},
 	entry_points={'console_scripts': ['wcx2cytosure=wcx2cytosure.wcx2cytosure:main']},
 	classifiers=[
 		"Development Status :: 3 - Alpha",
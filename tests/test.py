@@ -2,10 +2,688 @@ import pytest
 
 from unittest.mock import patch
 
-import vcf2cytosure
+from io import BytesIO
+from lxml import etree
+
+from wcx2cytosure import wcx2cytosure
+from wcx2cytosure.cgh import CGHWriter, format_probes
+from wcx2cytosure.constants import CGH_TEMPLATE_37, CONTIG_LENGTHS_37
+
+BINS_BED = """chr\tstart\tend\tid\tratio\tzscore
+1\t1\t1000\t1:1-1000\t0.05\t0.1
+1\t1001\t2000\t1:1001-2000\tnan\tnan
+1\t2001\t3000\t1:2001-3000\t0.0\t0.0
+2\t1\t1000\t2:1-1000\t-0.9\t-2.0
+GL000192.1\t1\t1000\tGL000192.1:1-1000\t0.1\t0.1
+X\t1\t1000\tX:1-1000\t0.6\t3.0
+"""
+
+ABERRATIONS_BED = """chr\tstart\tend\tratio\tzscore\ttype
+1\t1000\t900000\t-0.5\t-6.0\tloss
+"""
+
 
 def test_version_argument():
-    with patch('sys.argv', ['vcf2cytosure.py','--version']):
+    with patch('sys.argv', ['wcx2cytosure.py','--version']):
         with pytest.raises(SystemExit) as excinfo:
-            vcf2cytosure.main()
+            wcx2cytosure.main()
         assert excinfo.value.code == 0
+
+
+def test_parse_wisecondorx_coverages(tmp_path):
+    path = tmp_path / 'sample.bins.bed'
+    path.write_text(BINS_BED)
+    df = wcx2cytosure.parse_wisecondorx_coverages(wcx2cytosure.default_args(wisecondorx_cov=str(path)), CONTIG_LENGTHS_37)
+    assert df["chr"].tolist() == ['1', '1', '2', 'X']
+    assert df["start"].tolist() == [1, 2001, 1, 1]
+    assert [chrom for chrom, _ in wcx2cytosure.group_by_chromosome(df)] == ['1', '2', 'X']
+
+
+def test_coverage_heights():
+    heights = wcx2cytosure.coverage_heights([0.05, 0.0, -0.9, 0.6, -0.0])
+    assert heights.tolist() == [0.5, 0.01, -4, 4, 0.01]
+
+
+def test_cgh_writer_streams_sections():
+    stream = BytesIO()
+    with CGHWriter(stream, CGH_TEMPLATE_37, 'sample') as writer:
+        writer.open_section('submission')
+        writer.write(wcx2cytosure.make_aberration(None, 'X', 0, 100, 2.0, confirmation='DUP'))
+        writer.open_section('probes')
+        writer.write(wcx2cytosure.make_probe(None, '1', 0, 60, 1.0, 'DUP'))
+        writer.write(wcx2cytosure.make_probe(None, 'Y', 100, 160, -1.0, 'DEL'))
+        with pytest.raises(ValueError):
+            writer.open_section('submission')
+    tree = etree.fromstring(stream.getvalue())
+    assert [a.get('chr') for a in tree.xpath('/data/cgh/submission/aberration')] == ['23']
+    assert [p.get('chromosome') for p in tree.xpath('/data/cgh/probes/probe')] == ['1', '24']
+    assert len(tree.xpath('/data/cgh/segmentation')) == 1
+
+
+def test_cgh_skeleton_escapes_sample_id():
+    stream = BytesIO()
+    with CGHWriter(stream, CGH_TEMPLATE_37, 'a"b&<c>', 'true', 'Male'):
+        pass
+    tree = etree.fromstring(stream.getvalue())
+    assert tree.xpath('/data/cgh/submission/sample/@sampleId') == ['a"b&<c>']
+    assert tree.xpath('/data/cgh/submission/sample/@male') == ['true']
+    assert tree.xpath('/data/cgh/submission/reference/@sampleId') == ['Promega Male']
+
+
+def test_batch_discover_and_report_failures(tmp_path):
+    from wcx2cytosure import batch
+    (tmp_path / 'S1.aberrations.bed').write_text(ABERRATIONS_BED)
+    (tmp_path / 'S1.bins.bed').write_text(BINS_BED)
+    (tmp_path / 'S2.aberrations.bed').write_text('not a table\n')
+    jobs = list(batch.discover_samples(str(tmp_path)))
+    assert [(job['sample'], job['wisecondorx_cov'] is not None) for job in jobs] == [('S1', True), ('S2', False)]
+
+    jobs[1]['out'] = str(tmp_path / 'S2.cgh')
+    (tmp_path / 'S2.aberrations.bed').unlink()
+    row = batch.convert_sample(jobs[1])
+    assert row['status'] == 'failed' and row['error']
+
+
+def test_serve_converts_over_unix_socket(tmp_path):
+    import threading
+    from wcx2cytosure import serve
+    (tmp_path / 'S1.aberrations.bed').write_text(ABERRATIONS_BED)
+    (tmp_path / 'S1.bins.bed').write_text(BINS_BED)
+    service = serve.ConversionService(workers=1, max_queue=2, timeout=60)
+    address = str(tmp_path / 'service.sock')
+    server = serve.make_server(service, address)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        job = {'wisecondorx_aberrations': str(tmp_path / 'S1.aberrations.bed'),
+            'wisecondorx_cov': str(tmp_path / 'S1.bins.bed'), 'out': str(tmp_path / 'S1.cgh')}
+        status, response = serve.request(address, 'POST', '/convert', job)
+        assert status == 200 and response['probes'] == 13 and response['metrics']['total']['bytes_written'] > 0
+        assert serve.request(address, 'POST', '/convert', dict(job, bogus=1))[0] == 400
+        assert serve.request(address, 'POST', '/convert', dict(job, workers=2))[0] == 400
+        written = (tmp_path / 'S1.cgh').read_bytes()
+        status, response = serve.request(address, 'POST', '/convert', dict(job, wisecondorx_aberrations='missing.bed'))
+        assert status == 500 and response['status'] == 'failed'
+        assert (tmp_path / 'S1.cgh').read_bytes() == written
+        status, metrics = serve.request(address, 'GET', '/metrics')
+        assert (metrics['ok'], metrics['failed'], metrics['queue_depth']) == (1, 1, 0)
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.shutdown()
+
+
+def test_serve_recovers_from_a_dead_worker(tmp_path):
+    import os
+    import signal
+    from wcx2cytosure import serve
+    (tmp_path / 'S1.aberrations.bed').write_text(ABERRATIONS_BED)
+    (tmp_path / 'S1.bins.bed').write_text(BINS_BED)
+    job = {'wisecondorx_aberrations': str(tmp_path / 'S1.aberrations.bed'),
+        'wisecondorx_cov': str(tmp_path / 'S1.bins.bed'), 'out': str(tmp_path / 'S1.cgh')}
+    service = serve.ConversionService(workers=1, timeout=60)
+    try:
+        assert service.submit(job)['status'] == 'ok'
+        for pid in list(service.executor._processes):
+            os.kill(pid, signal.SIGKILL)
+        response = service.submit(job)
+        assert response['status'] == 'failed' and 'BrokenProcessPool' in response['error']
+        assert service.submit(job)['status'] == 'ok'
+        assert (service.metrics()['ok'], service.metrics()['failed']) == (2, 1)
+    finally:
+        service.shutdown()
+
+
+def test_serve_job_timeout(tmp_path):
+    from wcx2cytosure import serve
+    (tmp_path / 'S1.aberrations.bed').write_text(ABERRATIONS_BED)
+    (tmp_path / 'S1.bins.bed').write_text(BINS_BED)
+    (tmp_path / 'S1.cgh').write_text('earlier output')
+    response = serve.convert_job({'wisecondorx_aberrations': str(tmp_path / 'S1.aberrations.bed'),
+        'wisecondorx_cov': str(tmp_path / 'S1.bins.bed'), 'out': str(tmp_path / 'S1.cgh')}, timeout=1e-6)
+    assert response['status'] == 'timeout'
+    assert (tmp_path / 'S1.cgh').read_text() == 'earlier output'
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['S1.aberrations.bed', 'S1.bins.bed', 'S1.cgh']
+
+
+def test_parse_tiddit_coverage_in_chunks(tmp_path):
+    path = tmp_path / 'sample.tab'
+    rows = ['#CHR\tstart\tend\tcoverage\tquality']
+    rows += [f'1\t{i * 100}\t{i * 100 + 100}\t30.0\t60' for i in range(5)]
+    rows += ['2\t0\t100\t1000.0\t5', 'X\t0\t100\t15.0\t60', 'Y\t0\t100\t15.0\t60', 'Y\t100\t200\t12.0\t60']
+    path.write_text('\n'.join(rows) + '\n')
+    coverage = wcx2cytosure.parse_tiddit_coverage(wcx2cytosure.default_args(tiddit_cov=str(path)), chunksize=3)
+    assert coverage.counts == {'1': 5, 'X': 1, 'Y': 2}
+    assert coverage.autosomes_mean == 30.0
+    assert coverage.y_start.tolist() == [0, 100]
+    assert coverage.y_coverage.tolist() == [0.5, 0.4]
+    assert coverage.is_male()
+
+
+def test_tiddit_regions_keep_the_autosome_mean(tmp_path):
+    from wcx2cytosure.intervals import IntervalIndex
+    path = tmp_path / 'sample.tab'
+    rows = ['#CHR\tstart\tend\tcoverage\tquality', '1\t0\t100\t20.0\t60', '2\t0\t100\t40.0\t60']
+    rows += [f'Y\t{i * 100}\t{i * 100 + 100}\t{10 + i}.0\t60' for i in range(4)]
+    path.write_text('\n'.join(rows) + '\n')
+    full = wcx2cytosure.parse_tiddit_coverage(wcx2cytosure.default_args(tiddit_cov=str(path)))
+    for regions in ('Y', '2:1-100,Y:101-300'):
+        coverage = wcx2cytosure.parse_tiddit_coverage(wcx2cytosure.default_args(tiddit_cov=str(path), regions=regions))
+        keep = IntervalIndex.from_regions(wcx2cytosure.parse_regions(regions)).mask('Y', full.y_start, full.y_end)
+        assert coverage.autosomes_mean == full.autosomes_mean == 30.0
+        assert coverage.is_male() is full.is_male() is True
+        assert coverage.y_log2_ratios().tolist() == full.y_log2_ratios()[keep].tolist()
+
+
+def test_y_probe_heights_are_log2_ratios_to_male_dosage(tmp_path):
+    from wcx2cytosure.cgh import Fragment
+    path = tmp_path / 'sample.tab'
+    rows = ['#CHR\tstart\tend\tcoverage\tquality', '1\t0\t100\t30.0\t60', 'Y\t0\t100\t15.0\t60', 'Y\t100\t200\t0.0\t60']
+    path.write_text('\n'.join(rows) + '\n')
+    coverage = wcx2cytosure.parse_tiddit_coverage(wcx2cytosure.default_args(tiddit_cov=str(path)))
+    assert coverage.y_log2_ratios().tolist() == [0.0, float('-inf')]
+    fragment = Fragment()
+    wcx2cytosure.add_y_probes(fragment, coverage)
+    probes = etree.fromstring(b'<probes>' + fragment.getvalue() + b'</probes>')
+    # a normal male Y sits at 0 (drawn at 0.01), no coverage at the bottom
+    assert [probe.get('normalized') for probe in probes] == ['-0.010', '4.000']
+    assert [probe.get('original_coverage') for probe in probes] == ['0.500', '0.000']
+
+    path.write_text('\n'.join(rows[:1] + rows[2:]) + '\n')
+    coverage = wcx2cytosure.parse_tiddit_coverage(wcx2cytosure.default_args(tiddit_cov=str(path)))
+    assert coverage.is_male() is None and len(coverage.y_coverage) == 0
+
+
+def test_tagged_coverage_probes_without_y_bins(tmp_path):
+    (tmp_path / 'S1.aberrations.bed').write_text(ABERRATIONS_BED)
+    (tmp_path / 'S1.bins.bed').write_text(BINS_BED)
+    # the only Y bin fails the quality filter
+    (tmp_path / 'S1.tab').write_text('#CHR\tstart\tend\tcoverage\tquality\n1\t0\t100\t30.0\t60\nY\t0\t100\t0.0\t0\n')
+    wcx2cytosure.run(wcx2cytosure.default_args(wisecondorx_aberrations=str(tmp_path / 'S1.aberrations.bed'),
+        wisecondorx_cov=str(tmp_path / 'S1.bins.bed'), tiddit_cov=str(tmp_path / 'S1.tab'), out=str(tmp_path / 'S1.cgh'),
+        tag_coverage_probes=True))
+    tree = etree.parse(str(tmp_path / 'S1.cgh'))
+    assert tree.xpath('//probe[@chromosome="24"]') == []
+    assert tree.xpath('//probe[@name="coverage"][@chromosome="1"]/@event_type') == ['DEL']
+
+
+def test_aggregate_bins_respects_breakpoints():
+    import pandas as pd
+    block = pd.DataFrame({
+        'chr': ['1'] * 6,
+        'start': [0, 1000, 2000, 3000, 4000, 5000],
+        'end': [1000, 2000, 3000, 4000, 5000, 5500],
+        'ratio': [0.1, 0.2, 0.6, 1.0, 2.0, 4.0],
+    })
+    merged = wcx2cytosure.aggregate_bins(block, 3000, 'mean', breakpoints=[4000])
+    assert merged['start'].tolist() == [0, 3000, 4000]
+    assert merged['end'].tolist() == [3000, 4000, 5500]
+    assert merged['ratio'].round(6).tolist() == [0.3, 1.0, 3.0]
+
+    median = wcx2cytosure.aggregate_bins(block, 3000, 'median', breakpoints=[4000])
+    assert median['ratio'].round(6).tolist() == [0.2, 1.0, 3.0]
+    weighted = wcx2cytosure.aggregate_bins(block, 3000, 'weighted', breakpoints=[4000])
+    assert weighted['ratio'].round(6).tolist() == [0.3, 1.0, round((2.0 * 1000 + 4.0 * 500) / 1500, 6)]
+
+
+def test_format_probes_matches_make_probe():
+    starts, ends, heights, ratios = [0, 1000, 5000], [1000, 2000, 6000], [0.01, -4.0, 2.345], [0.0, -0.75, 0.2345]
+    for chromosome, name, original in (('X', 'coverage', ratios), ('5', 'between "events" & more', None)):
+        expected = b''.join(
+            etree.tostring(wcx2cytosure.make_probe(None, chromosome, start, end, height, name,
+                None if original is None else original[i]), pretty_print=True)
+            for i, (start, end, height) in enumerate(zip(starts, ends, heights)))
+        assert format_probes(chromosome, starts, ends, heights, name, original) == expected
+
+
+def reference_spaced_probes(start, end, probe_spacing):
+    # The generator that event probes were placed with before the intervals module
+    l = end - start
+    n = l // probe_spacing
+    spacing = l / max(n, 2)
+    i = 0
+    pos = start
+    while pos <= end:
+        yield pos
+        i += 1
+        pos = start + int(i * spacing)
+
+
+def reference_merge_intervals(intervals):
+    events = [(coord[0], 'START') for coord in intervals]
+    events.extend((coord[1], 'STOP') for coord in intervals)
+    events.sort()
+    active = 0
+    start = 0
+    for pos, what in events:
+        if what == 'START':
+            if active == 0:
+                start = pos
+            active += 1
+        else:
+            active -= 1
+            if active == 0:
+                yield (start, pos)
+
+
+def test_spaced_positions_match_generator():
+    import random
+    from wcx2cytosure.intervals import spaced_positions
+    rng = random.Random(7)
+    starts, ends, spacings = [], [], [1000, 100000, 200000]
+    for _ in range(500):
+        start = rng.randrange(0, 10**8)
+        starts.append(start)
+        ends.append(start + rng.choice([1, 2, 3, 59, 1000, rng.randrange(1, 5 * 10**6)]))
+    for spacing in spacings:
+        positions, index = spaced_positions(starts, ends, spacing)
+        for i, (start, end) in enumerate(zip(starts, ends)):
+            expected = list(reference_spaced_probes(start, end, spacing))
+            assert positions[index == i].tolist() == expected
+            # The end can be missed by one base from float rounding of the spacing
+            assert expected[0] == start and end - expected[-1] <= 1 and len(expected) >= 3
+
+
+def test_merge_and_complement_intervals():
+    import random
+    from wcx2cytosure.intervals import complement_intervals, merge_intervals
+    rng = random.Random(11)
+    for _ in range(200):
+        intervals = []
+        for _ in range(rng.randrange(0, 20)):
+            start = rng.randrange(0, 10**6)
+            intervals.append((start, start + rng.randrange(1, 10**5)))
+        starts = [s for s, _ in intervals]
+        ends = [e for _, e in intervals]
+        merged = list(zip(*(a.tolist() for a in merge_intervals(starts, ends))))
+        assert merged == list(reference_merge_intervals(intervals))
+
+        gap_starts, gap_ends = complement_intervals(starts, ends, 2 * 10**6)
+        covered = sum(e - s for s, e in merged) + int((gap_ends - gap_starts).sum())
+        assert covered == 2 * 10**6
+    assert merge_intervals([0, 10], [10, 20])[1].tolist() == [20]
+
+
+def test_interval_index_matches_scan():
+    import random
+    import numpy as np
+    from wcx2cytosure.intervals import IntervalIndex
+    rng = random.Random(5)
+    bin_starts = np.arange(0, 10**6, 1000)
+    bin_ends = bin_starts + 1000
+    for _ in range(100):
+        windows = [('1', s, s + rng.randrange(1, 50000)) for s in (rng.randrange(0, 10**6) for _ in range(rng.randrange(0, 8)))]
+        index = IntervalIndex(windows)
+        expected = [i for i, (s, e) in enumerate(zip(bin_starts, bin_ends)) if any(e > ws and s < we for _, ws, we in windows)]
+        assert index.select('1', bin_starts, bin_ends).tolist() == expected
+        assert np.flatnonzero(index.mask('1', bin_starts, bin_ends)).tolist() == expected
+    assert index.select('2', bin_starts, bin_ends).tolist() == []
+
+
+def test_around_events_export(tmp_path):
+    from wcx2cytosure import convert
+    bins = {'chr': ['1'] * 50 + ['2'] * 50, 'start': list(range(0, 5 * 10**6, 10**5)) * 2,
+        'end': list(range(10**5, 5 * 10**6 + 1, 10**5)) * 2, 'ratio': [0.1] * 100}
+    events = {'chr': ['1'], 'start': [2000000], 'end': [2500000], 'type': ['loss'], 'zscore': [-6.0]}
+    tree = etree.fromstring(convert(events, bins=bins, around_events=200000))
+    coverage = tree.xpath('//probe[@name="coverage"]')
+    assert {probe.get('chromosome') for probe in coverage} == {'1'}
+    assert [int(coverage[0].get('start')), int(coverage[-1].get('stop'))] == [1800001, 2700000]
+    assert len(tree.xpath('//segment')) == 1
+    between = etree.fromstring(convert(events, around_events=200000)).xpath('//probe[@name="between events"]/@start')
+    assert between and all(1800000 <= int(start) <= 2700000 for start in between)
+
+
+def test_event_index_tags_and_deduplicates_probes():
+    import random
+    import numpy as np
+    from wcx2cytosure import convert
+    from wcx2cytosure.intervals import EventIndex
+    rng = random.Random(7)
+    starts = np.array(sorted(rng.sample(range(10**6), 300)))
+    ends = starts + np.array([rng.randrange(1, 20000) for _ in starts])
+    for _ in range(50):
+        events = [wcx2cytosure.Event('1', s, s + rng.randrange(1, 100000), 'DUP', 1.0, {})
+            for s in (rng.randrange(0, 10**6) for _ in range(rng.randrange(0, 6)))]
+        index = EventIndex(events)
+        found = index.overlapping('1', starts, ends)
+        for s, e, i in zip(starts, ends, found):
+            overlapping = [event for event in index['1'] if event.start < e and s < event.end]
+            assert (i >= 0) == bool(overlapping)
+            if i >= 0:
+                assert index['1'][i] in overlapping
+
+    bins = {'chr': ['1'] * 20, 'start': list(range(0, 2 * 10**6, 10**5)), 'end': list(range(10**5, 2 * 10**6 + 1, 10**5)),
+        'ratio': [0.1] * 20}
+    events = {'chr': ['1', '2'], 'start': [500000, 500000], 'end': [900000, 900000], 'type': ['gain'] * 2,
+        'zscore': [6.5, 5.0]}
+    plain = etree.fromstring(convert(events, bins=bins))
+    tree = etree.fromstring(convert(events, bins=bins, tag_coverage_probes=True, drop_covered_event_probes=True))
+    tagged = tree.xpath('//probe[@event_type]')
+    assert [int(probe.get('start')) for probe in tagged] == list(range(500001, 900000, 10**5))
+    assert {(probe.get('event_type'), probe.get('event_zscore')) for probe in tagged} == {('DUP', '6.5')}
+    assert tree.xpath('//probe[@name="DUP"]/@chromosome') == ['2'] * len(plain.xpath('//probe[@name="DUP"][@chromosome="2"]'))
+    assert len(tree.xpath('//probe[@name="coverage"]')) == len(plain.xpath('//probe[@name="coverage"]'))
+
+
+def test_wisecondorx_events_filters(tmp_path, caplog):
+    path = tmp_path / 'S1.aberrations.bed'
+    path.write_text(ABERRATIONS_BED +
+        '2\t1\t5000\t0.5\t6.5\tgain\nGL1\t1\t900000\t0.5\t6.0\tgain\nX\t10\t20\t0.5\t6.0\tgain\n')
+    args = wcx2cytosure.default_args(wisecondorx_aberrations=str(path), wcx_size=10000)
+    with caplog.at_level('INFO'):
+        events = list(wcx2cytosure.wisecondorx_events(args, CONTIG_LENGTHS_37))
+    assert [(e.chrom, e.start, e.end, e.type, e.zscore) for e in events] == [('1', 1000, 900000, 'DEL', -6.0)]
+    assert [r.getMessage() for r in caplog.records] == ['skipped 2 variants for being too short']
+
+
+def test_run_records_stage_metrics(tmp_path):
+    from wcx2cytosure.metrics import Metrics
+    (tmp_path / 'S1.aberrations.bed').write_text(ABERRATIONS_BED + 'GL1\t1\t900000\t0.5\t6.0\tgain\n')
+    (tmp_path / 'S1.bins.bed').write_text(BINS_BED)
+    args = wcx2cytosure.default_args(wisecondorx_aberrations=str(tmp_path / 'S1.aberrations.bed'),
+        wisecondorx_cov=str(tmp_path / 'S1.bins.bed'), out=str(tmp_path / 'S1.cgh'))
+    metrics = Metrics()
+    result = wcx2cytosure.run(args, metrics)
+    stages = metrics.to_dict()
+    assert stages['read_aberrations']['rows_filtered_contig'] == 1
+    assert stages['read_bins']['rows_read'] == 6
+    assert stages['coverage_probes']['per_chromosome'] == {'1': 2, '2': 1, 'X': 1}
+    assert stages['total']['bytes_written'] == result['bytes'] == (tmp_path / 'S1.cgh').stat().st_size
+
+
+def test_bounded_map_limits_jobs_in_flight():
+    from concurrent.futures import ThreadPoolExecutor
+    submitted = []
+
+    def jobs():
+        for i in range(10):
+            submitted.append(i)
+            yield i
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = wcx2cytosure.bounded_map(executor, 3, lambda x: x * x, jobs())
+        assert next(results) == 0
+        assert len(submitted) == 4
+        assert list(results) == [i * i for i in range(1, 10)]
+
+
+def test_peak_rss_without_resource_module():
+    from wcx2cytosure.metrics import Metrics, peak_rss_mb
+    assert peak_rss_mb() > 0
+    with patch.dict('sys.modules', {'resource': None}):
+        assert peak_rss_mb() == 0.0
+        metrics = Metrics()
+        with metrics.stage('total'):
+            pass
+    assert metrics.to_dict()['total']['peak_rss_mb'] == 0.0
+
+
+def test_run_with_workers_is_identical(tmp_path):
+    (tmp_path / 'S1.aberrations.bed').write_text(ABERRATIONS_BED + 'X\t1\t500000\t0.5\t6.0\tgain\n')
+    (tmp_path / 'S1.bins.bed').write_text(BINS_BED)
+    outputs = []
+    for workers in (1, 2):
+        out = tmp_path / f'S1.{workers}.cgh'
+        wcx2cytosure.run(wcx2cytosure.default_args(wisecondorx_aberrations=str(tmp_path / 'S1.aberrations.bed'),
+            wisecondorx_cov=str(tmp_path / 'S1.bins.bed'), out=str(out), workers=workers))
+        outputs.append(out.read_bytes())
+    assert outputs[0] == outputs[1]
+    tree = etree.fromstring(outputs[0])
+    assert tree.xpath('/data/cgh/segmentation/segment/@chrId') == ['1', '23']
+    assert tree.xpath('/data/cgh/probes/probe/@chromosome')[-1] == '23'
+
+
+def test_pipeline_is_identical(tmp_path):
+    from wcx2cytosure.metrics import Metrics
+    (tmp_path / 'S1.aberrations.bed').write_text(ABERRATIONS_BED + 'X\t1\t500000\t0.5\t6.0\tgain\n')
+    (tmp_path / 'S1.bins.bed').write_text(BINS_BED)
+    outputs = []
+    for pipeline in (False, True):
+        out = tmp_path / f'S1.{pipeline}.cgh'
+        metrics = Metrics()
+        wcx2cytosure.run(wcx2cytosure.default_args(wisecondorx_aberrations=str(tmp_path / 'S1.aberrations.bed'),
+            wisecondorx_cov=str(tmp_path / 'S1.bins.bed'), out=str(out), pipeline=pipeline), metrics)
+        outputs.append(out.read_bytes())
+    assert outputs[0] == outputs[1]
+    stages = metrics.to_dict()
+    assert {'read_seconds_saved', 'generate_seconds_saved'} <= set(stages['pipeline'])
+    assert stages['read_bins']['rows_read'] == 6
+
+    def failing():
+        yield 1
+        raise ValueError('broken')
+    with pytest.raises(ValueError):
+        list(wcx2cytosure.prefetch(failing(), 1))
+
+
+def test_incremental_reuses_coverage_probes(tmp_path):
+    from wcx2cytosure.metrics import Metrics
+    (tmp_path / 'S1.aberrations.bed').write_text(ABERRATIONS_BED + '2\t1\t50000\t0.5\t6.0\tgain\n')
+    (tmp_path / 'S1.bins.bed').write_text(BINS_BED)
+    options = dict(wisecondorx_aberrations=str(tmp_path / 'S1.aberrations.bed'),
+        wisecondorx_cov=str(tmp_path / 'S1.bins.bed'))
+    outputs = []
+    for wcx_size in (None, 100000):
+        metrics = Metrics()
+        wcx2cytosure.run(wcx2cytosure.default_args(out=str(tmp_path / 'S1.cgh'), incremental=True, wcx_size=wcx_size,
+            drop_covered_event_probes=True, **options), metrics)
+        wcx2cytosure.run(wcx2cytosure.default_args(out=str(tmp_path / 'plain.cgh'), wcx_size=wcx_size,
+            drop_covered_event_probes=True, **options))
+        assert (tmp_path / 'S1.cgh').read_bytes() == (tmp_path / 'plain.cgh').read_bytes()
+        outputs.append(metrics.to_dict())
+    assert outputs[0]['coverage_sidecar']['misses'] == 1 and 'read_bins' in outputs[0]
+    assert outputs[1]['coverage_sidecar']['hits'] == 1 and 'read_bins' not in outputs[1]
+
+
+def test_convert_from_dataframes(tmp_path):
+    import pandas as pd
+    from wcx2cytosure import convert
+    (tmp_path / 'S1.aberrations.bed').write_text(ABERRATIONS_BED)
+    (tmp_path / 'S1.bins.bed').write_text(BINS_BED)
+    wcx2cytosure.run(wcx2cytosure.default_args(wisecondorx_aberrations=str(tmp_path / 'S1.aberrations.bed'),
+        wisecondorx_cov=str(tmp_path / 'S1.bins.bed'), out=str(tmp_path / 'S1.cgh')))
+
+    bins = pd.read_csv(tmp_path / 'S1.bins.bed', sep='\t')
+    events = {'chr': ['1'], 'start': [1000], 'end': [900000], 'type': ['loss'], 'zscore': [-6.0]}
+    assert convert(events, bins=bins, sample_id='S1') == (tmp_path / 'S1.cgh').read_bytes()
+    stream = BytesIO()
+    counts = convert(tmp_path / 'S1.aberrations.bed', bins=bins, out=stream)
+    assert stream.getvalue() == (tmp_path / 'S1.cgh').read_bytes()
+    assert counts == {'aberrations': 1, 'probes': 13, 'segments': 1}
+    with pytest.raises(TypeError, match='wcx_sise'):
+        convert(events, bins=bins, wcx_sise=100000)
+    with pytest.raises(TypeError, match='wisecondorx_cov'):
+        convert(events, wisecondorx_cov=str(tmp_path / 'S1.bins.bed'))
+
+
+def test_contig_registry_naming_and_files(tmp_path):
+    from wcx2cytosure.contigs import BUILDS, ContigRegistry
+    from wcx2cytosure.constants import CONTIG_LENGTHS_38
+    contigs = BUILDS[37]
+    assert contigs.encode(['chr1', '1', 'chrX', '23', 'Y', 'chrM', 'GL000192.1']).tolist() == [0, 0, 22, 22, 23, -1, -1]
+    assert BUILDS[38]['X'] == 156040895
+
+    (tmp_path / 'ref.fa.fai').write_text(''.join(f'chr{name}\t{length}\t0\t60\t61\n'
+        for name, length in CONTIG_LENGTHS_38.items()) + 'chrM\t16569\t0\t60\t61\n')
+    (tmp_path / 'ref.dict').write_text('@HD\tVN:1.6\n' + ''.join(f'@SQ\tSN:{name}\tLN:{length}\n'
+        for name, length in CONTIG_LENGTHS_38.items()))
+    assert ContigRegistry.from_file(str(tmp_path / 'ref.fa.fai')) == BUILDS[38]
+    assert ContigRegistry.from_file(str(tmp_path / 'ref.dict')) == BUILDS[38]
+
+    prefixed = ''.join('chr' + line + '\n' if i else line + '\n' for i, line in enumerate(BINS_BED.splitlines()))
+    (tmp_path / 'chr.bins.bed').write_text(prefixed)
+    args = wcx2cytosure.default_args(wisecondorx_cov=str(tmp_path / 'chr.bins.bed'), regions='chr1,X')
+    coverages = wcx2cytosure.parse_wisecondorx_coverages(args, contigs)
+    assert coverages['chr'].tolist() == ['1', '1', 'X']
+    columns = {'chr': ['chr1', 'chr23', 'chrUn'], 'start': ['0', '0', '0'], 'end': ['10', '10', '10'],
+        'type': ['gain', 'loss', 'loss'], 'zscore': ['1', '1', '1']}
+    assert [event.chrom for event in wcx2cytosure.aberration_events(columns, contigs)] == ['1', 'X']
+
+
+def test_cohort_profile_normalizes_ratios(tmp_path):
+    import numpy as np
+    from wcx2cytosure import cohort
+    lines = BINS_BED.splitlines()
+    paths = []
+    for k in range(3):
+        path = tmp_path / f's{k}.bins.bed'
+        rows = [line.split('\t') for line in lines[1:]]
+        rows = [row[:4] + [str(float(row[4]) + 0.1 * k)] + row[5:] for row in rows if k != 1 or row[0] != '2']
+        path.write_text('\n'.join([lines[0]] + ['\t'.join(row) for row in rows]) + '\n')
+        paths.append(str(path))
+    profile = tmp_path / 'profile.tsv'
+    assert cohort.build_profile(paths, str(profile), matrix_path=str(tmp_path / 'm.npy'), block_rows=2,
+        block_samples=2) == 5
+    assert np.load(tmp_path / 'm.npy', mmap_mode='r').shape == (5, 3)
+
+    args = wcx2cytosure.default_args(wisecondorx_cov=paths[2], normalization_profile=str(profile))
+    coverages = wcx2cytosure.parse_wisecondorx_coverages(args, CONTIG_LENGTHS_37)
+    coverages = wcx2cytosure.normalize_coverages(coverages, args, CONTIG_LENGTHS_37)
+    assert coverages['chr'].tolist() == ['1', '1', '2', 'X']
+    assert np.allclose(coverages['ratio'], 0.1)
+
+
+def test_read_cgh_and_diff(tmp_path):
+    from wcx2cytosure import convert, diff
+    from wcx2cytosure.reader import read_cgh, read_probes
+    (tmp_path / 'S1.bins.bed').write_text(BINS_BED)
+    events = {'chr': ['1'], 'start': [1000], 'end': [900000], 'type': ['loss'], 'zscore': [-6.0]}
+    first = tmp_path / 'first.cgh'
+    first.write_bytes(convert(events, bins=str(tmp_path / 'S1.bins.bed'), sample_id='S1'))
+
+    tables = read_cgh(str(first))
+    assert len(tables['probe']['start']) == 13
+    assert tables['aberration']['confirmation'].tolist() == ['DEL']
+    assert tables['segment']['zscore'].tolist() == [-6.0]
+    assert sum(len(chunk['start']) for chunk in read_probes(str(first), chunksize=5)) == 13
+
+    text = first.read_text()
+    second = tmp_path / 'second.cgh'
+    second.write_text(text.replace('zscore="-6.0"', 'zscore="-6.0001"'))
+    assert diff.main([str(first), str(second)]) == 0
+    probe = text.index('normalized="', text.index('<probe '))
+    second.write_text(text[:probe] + 'normalized="9' + text[probe + len('normalized="'):])
+    differences = list(diff.diff_cgh(str(first), str(second)))
+    assert len(differences) == 1 and differences[0][1].startswith('probe normalized')
+    assert diff.main([str(first), str(second)]) == 1
+
+    second.write_text(text.replace('male="false"', 'male="true"'))
+    assert list(diff.diff_cgh(str(first), str(second)))[0] == ('data/cgh/submission/sample', 'male false != true')
+    assert diff.main([str(first), str(second)]) == 1
+    # probes not in chromosome order, as older versions wrote them, are compared whole
+    head, rest = text.split('<probes>')
+    probes, tail = rest.split('</probes>')
+    probes = [probe + '</probe>\n' for probe in probes.split('</probe>\n')[:-1]]
+    second.write_text(head + '<probes>' + ''.join(probes[::-1]) + '</probes>' + tail)
+    assert diff.in_chromosome_order(str(first)) and not diff.in_chromosome_order(str(second))
+    assert list(diff.diff_cgh(str(first), str(second))) == []
+
+
+def test_npz_results_match_bed(tmp_path):
+    import numpy as np
+    from wcx2cytosure.npz import load_arrays, write_npz
+    (tmp_path / 'bed').mkdir()
+    (tmp_path / 'bed' / 'S1.aberrations.bed').write_text(
+        'chr\tstart\tend\tratio\tzscore\ttype\n1\t1001\t3000\t-0.5\t-6.0\tloss\nX\t1\t2000\t0.5\t6.0\tgain\n')
+    (tmp_path / 'bed' / 'S1.bins.bed').write_text('chr\tstart\tend\tid\tratio\tzscore\n' + ''.join(
+        f'{chrom}\t{i * 1000 + 1}\t{(i + 1) * 1000}\tbin\t{ratio}\t0\n'
+        for chrom, ratios in (('1', [0.05, 'nan', -0.9]), ('2', [0.1]), ('X', [0.6, 0.2])) for i, ratio in enumerate(ratios)))
+    ratios = [[0.05, 0, -0.9], [0.1]] + [[]] * 20 + [[0.6, 0.2]]
+    aberrations = {'chr': ['1', '23'], 'start': [1001, 1], 'end': [3000, 2000], 'ratio': [-0.5, 0.5],
+        'zscore': [-6.0, 6.0], 'type': ['loss', 'gain']}
+    for compress in (False, True):
+        path = tmp_path / 'S1.npz'
+        write_npz(path, 1000, ratios, aberrations, compress=compress)
+        assert isinstance(load_arrays(path)['results_r'], np.memmap) != compress
+        for regions in (None, '1:2001-3000,X'):
+            outputs = []
+            for aberrations_path, bins_path in ((tmp_path / 'bed' / 'S1.aberrations.bed', tmp_path / 'bed' / 'S1.bins.bed'),
+                    (path, path)):
+                wcx2cytosure.run(wcx2cytosure.default_args(wisecondorx_aberrations=str(aberrations_path),
+                    wisecondorx_cov=str(bins_path), out=str(tmp_path / 'S1.cgh'), regions=regions))
+                outputs.append((tmp_path / 'S1.cgh').read_bytes())
+            assert outputs[0] == outputs[1]
+    assert len(etree.fromstring(outputs[1]).xpath('//probe[@name="coverage"]')) == 3
+
+
+def test_read_table_gzip_and_regions(tmp_path):
+    import gzip
+    from wcx2cytosure.inputs import parse_regions, read_table
+    path = tmp_path / 'sample.bins.bed.bgz'
+    with gzip.open(path, 'wt') as f:
+        f.write(BINS_BED)
+    assert parse_regions('1:1001-2500, X') == [('1', 1000, 2500), ('X', None, None)]
+    df = read_table(str(path), regions=parse_regions('1:1001-2500,X'))
+    assert df['start'].tolist() == [1001, 2001, 1]
+
+
+def test_read_columns_gzip_and_regions(tmp_path):
+    import gzip
+    from wcx2cytosure.tsv import parse_regions, read_columns
+    path = tmp_path / 'sample.bins.bed.gz'
+    with gzip.open(path, 'wt') as f:
+        f.write(BINS_BED)
+    columns = read_columns(str(path), regions=parse_regions('1:1001-2500,X'))
+    assert columns['start'] == ['1001', '2001', '1']
+    assert columns['ratio'] == ['nan', '0.0', '0.6']
+
+
+def test_cli_startup_is_light():
+    # python -X importtime reports the cumulative import time in microseconds
+    import os
+    import subprocess
+    import sys
+    code = ('import sys\nfrom wcx2cytosure.wcx2cytosure import main\ntry:\n    main(["--version"])\n'
+        'except SystemExit:\n    pass\nprint(*sorted(m for m in ("numpy", "pandas", "lxml") if m in sys.modules))')
+    done = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert done.stdout.splitlines()[-1] == ''
+    times = {line.split('|')[2].strip(): int(line.split('|')[1]) for line in done.stderr.splitlines()
+        if line.startswith('import time:') and line.split('|')[1].strip().isdigit()}
+    assert times['wcx2cytosure.wcx2cytosure'] < 250000
+
+
+def test_read_table_tabix(tmp_path):
+    pysam = pytest.importorskip('pysam')
+    from wcx2cytosure.inputs import parse_regions, read_table
+    path = tmp_path / 'sample.bins.bed'
+    path.write_text(BINS_BED.replace('GL000192.1\t1\t1000\tGL000192.1:1-1000\t0.1\t0.1\n', ''))
+    indexed = pysam.tabix_index(str(path), seq_col=0, start_col=1, end_col=2, line_skip=1)
+    df = read_table(indexed, dtype={'chr': str}, contigs=['2', 'X'])
+    assert df['chr'].tolist() == ['2', 'X']
+    df = read_table(indexed, dtype={'chr': str}, regions=parse_regions('1:1500-1600'))
+    assert df['start'].tolist() == [1001]
+
+    # overlapping regions, out of order and across contigs, give each bin once and in file order
+    bins = tmp_path / 'plain.bins.bed'
+    bins.write_text(BINS_BED.splitlines(keepends=True)[0] + ''.join(
+        f'{chrom}\t{start}\t{start + 999}\tbin\t0.1\t0.1\n' for chrom in ('1', '2') for start in range(1, 12002, 1000)))
+    path = tmp_path / 'many.bins.bed'
+    path.write_text(bins.read_text())
+    indexed = pysam.tabix_index(str(path), seq_col=0, start_col=1, end_col=2, line_skip=1)
+    for text in ('1,1:2001-3000', '1:10001-12000,1:1-3000', '2:5001-6000,1:1-3000,1:2500-4500,2:1-1'):
+        regions = parse_regions(text)
+        plain = read_table(str(bins), dtype={'chr': str}, regions=regions)
+        fetched = read_table(indexed, dtype={'chr': str}, regions=regions)
+        assert fetched[['chr', 'start']].values.tolist() == plain[['chr', 'start']].values.tolist()
+        chunks = list(read_table(indexed, dtype={'chr': str}, regions=regions, chunksize=2))
+        assert sum(len(chunk) for chunk in chunks) == len(plain)
+
+
+def test_parsed_cache_round_trip_and_eviction(tmp_path):
+    from wcx2cytosure.cache import ParsedCache
+    from wcx2cytosure.inputs import read_table
+    path = tmp_path / 'sample.bins.bed'
+    path.write_text(BINS_BED)
+    cache = ParsedCache(str(tmp_path / 'cache'))
+    parsed = read_table(str(path), dtype={'chr': str}, cache=cache)
+    cached = read_table(str(path), dtype={'chr': str}, cache=cache)
+    assert cached.equals(parsed)
+    assert len(list(cache.entries())) == 1
+
+    path.write_text(BINS_BED.replace('0.05', '0.06'))
+    assert read_table(str(path), dtype={'chr': str}, cache=cache)['ratio'][0] == 0.06
+    assert len(list(cache.entries())) == 2
+
+    ParsedCache(str(tmp_path / 'cache'), max_bytes=0).evict()
+    assert list(cache.entries()) == []
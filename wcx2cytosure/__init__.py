@@ -0,0 +1,9 @@
+"""
+Convert WisecondorX output to the CGH format of CytoSure
+
+	from wcx2cytosure import convert
+	cgh = convert(aberrations_df, bins=bins_df, tiddit='sample.tiddit.tab', genome=38)
+"""
+
+from .__version__ import __version__
+from .wcx2cytosure import convert
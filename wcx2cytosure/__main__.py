@@ -0,0 +1,5 @@
+import sys
+
+from .wcx2cytosure import main
+
+sys.exit(main())
@@ -0,0 +1,129 @@
+"""
+Convert many WisecondorX samples to CGH format in a pool of worker processes
+"""
+
+import argparse
+import csv
+import glob
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from . import wcx2cytosure
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_COLUMNS = ['sample', 'wisecondorx_aberrations', 'wisecondorx_cov', 'tiddit_cov', 'genome', 'wcx_size', 'out']
+SUMMARY_COLUMNS = ['sample', 'status', 'seconds', 'aberrations', 'probes', 'segments', 'bytes', 'out', 'error']
+
+
+def read_manifest(path):
+	"""
+	Read a tab-separated manifest with a header line. The columns are those in
+	MANIFEST_COLUMNS; only sample and wisecondorx_aberrations are required.
+	Yield one dict per sample.
+	"""
+	with open(path, newline='') as f:
+		for row in csv.DictReader(f, delimiter='\t'):
+			job = {column: (row.get(column) or None) for column in MANIFEST_COLUMNS}
+			if not job['sample'] or not job['wisecondorx_aberrations']:
+				raise ValueError(f'{path}: every row needs sample and wisecondorx_aberrations')
+			yield job
+
+
+def discover_samples(pattern):
+	"""
+	Find samples from a glob pattern (or a directory) matching
+	*.aberrations.bed files. The bins.bed and TIDDIT coverage files are
+	picked up if they sit next to them with the same prefix.
+	"""
+	if os.path.isdir(pattern):
+		pattern = os.path.join(pattern, '*.aberrations.bed')
+	for path in sorted(glob.glob(pattern)):
+		prefix = path.rsplit('.aberrations.bed', 1)[0]
+		job = dict.fromkeys(MANIFEST_COLUMNS)
+		job['sample'] = os.path.basename(prefix)
+		job['wisecondorx_aberrations'] = path
+		if os.path.exists(prefix + '.bins.bed'):
+			job['wisecondorx_cov'] = prefix + '.bins.bed'
+		for suffix in ('.tiddit.tab', '.tab'):
+			if os.path.exists(prefix + suffix):
+				job['tiddit_cov'] = prefix + suffix
+				break
+		yield job
+
+
+def convert_sample(job):
+	"""
+	Convert one sample in a worker process. Errors are reported in the
+	returned summary row instead of being raised.
+	"""
+	started = time.perf_counter()
+	row = {'sample': job['sample'], 'out': job['out']}
+	try:
+		args = wcx2cytosure.default_args(**{k: v for k, v in job.items() if k != 'sample' and v is not None})
+		if args.wcx_size is not None:
+			args.wcx_size = int(args.wcx_size)
+		result = wcx2cytosure.run(args)
+	except Exception as e:
+		row.update(status='failed', error=f'{type(e).__name__}: {e}')
+	else:
+		row.update(status='ok', out=result['out'], aberrations=result['aberrations'],
+			probes=result['probes'], segments=result['segments'], bytes=result['bytes'])
+	row['seconds'] = '{:.3f}'.format(time.perf_counter() - started)
+	return row
+
+
+def run_batch(jobs, workers=None):
+	"""
+	Convert all jobs using up to workers processes. Yield a summary row per
+	sample in the order they finish.
+	"""
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		futures = [executor.submit(convert_sample, job) for job in jobs]
+		for future in as_completed(futures):
+			yield future.result()
+
+
+def main(argv=None):
+	logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+	parser = argparse.ArgumentParser("wcx2cytosure batch - convert many WisecondorX samples to cytosure format")
+	source = parser.add_mutually_exclusive_group(required=True)
+	source.add_argument('--manifest', help='tab-separated file with the columns ' + ', '.join(MANIFEST_COLUMNS))
+	source.add_argument('--glob', help='glob pattern or directory with *.aberrations.bed files')
+	parser.add_argument('--outdir', default='.', help='directory for CGH files without an out column (default: .)')
+	parser.add_argument('--genome', default=37, help='genome version for samples without a genome column (default: 37)')
+	parser.add_argument('--wcx_size', type=int, help='size filter for samples without a wcx_size column')
+	parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes (default: all CPUs)')
+	parser.add_argument('--summary', default='wcx2cytosure_summary.tsv', help='summary table (default: %(default)s)')
+	args = parser.parse_args(argv)
+
+	jobs = list(read_manifest(args.manifest) if args.manifest else discover_samples(args.glob))
+	for job in jobs:
+		job['genome'] = job['genome'] or args.genome
+		job['wcx_size'] = job['wcx_size'] or args.wcx_size
+		job['out'] = job['out'] or os.path.join(args.outdir, job['sample'] + '.cgh')
+	os.makedirs(args.outdir, exist_ok=True)
+	logger.info('Converting %d samples with %d workers', len(jobs), args.workers)
+
+	failed = 0
+	with open(args.summary, 'w', newline='') as f:
+		summary = csv.DictWriter(f, SUMMARY_COLUMNS, delimiter='\t', restval='')
+		summary.writeheader()
+		for row in run_batch(jobs, args.workers):
+			if row['status'] == 'ok':
+				logger.info('%s: wrote %s probes to %s in %s s', row['sample'], row['probes'], row['out'], row['seconds'])
+			else:
+				failed += 1
+				logger.error('%s: %s', row['sample'], row['error'])
+			summary.writerow(row)
+			f.flush()
+
+	logger.info('Converted %d of %d samples, summary in %s', len(jobs) - failed, len(jobs), args.summary)
+	return 1 if failed else 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
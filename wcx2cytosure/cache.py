@@ -0,0 +1,166 @@
+"""
+Content-addressed cache of parsed input tables
+
+Each cached table is a directory named after a hash of the input file
+content and the read options. It holds one raw memory-mappable file per
+column and a meta.json with the dtypes, lengths and, for string columns,
+the vocabulary that the stored integer codes index into.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+DEFAULT_MAX_AGE_DAYS = 30
+
+
+def file_digest(path, block_size=1 << 20):
+	"""Hash of the content and size of a file"""
+	digest = hashlib.blake2b(digest_size=20)
+	size = 0
+	with open(path, 'rb') as f:
+		for block in iter(lambda: f.read(block_size), b''):
+			digest.update(block)
+			size += len(block)
+	return f'{digest.hexdigest()}-{size}'
+
+
+class ColumnWriter:
+	"""Append DataFrame chunks to the column files of one cache entry"""
+
+	def __init__(self, directory):
+		self.directory = directory
+		self.files = {}
+		self.meta = {}
+
+	def append(self, df):
+		for column in df.columns:
+			values = df[column].to_numpy()
+			meta = self.meta.get(column)
+			if meta is None:
+				meta = self.meta[column] = {'file': f'{len(self.meta)}.bin', 'length': 0}
+				if values.dtype == object:
+					meta['vocabulary'] = []
+					meta['dtype'] = np.dtype(np.int32).str
+				else:
+					meta['dtype'] = values.dtype.str
+				self.files[column] = open(os.path.join(self.directory, meta['file']), 'wb')
+			if 'vocabulary' in meta:
+				values = self._encode(values, meta['vocabulary'])
+			self.files[column].write(np.ascontiguousarray(values, dtype=meta['dtype']).tobytes())
+			meta['length'] += len(values)
+
+	def _encode(self, values, vocabulary):
+		codes, uniques = pd.factorize(values)
+		index = {value: i for i, value in enumerate(vocabulary)}
+		mapping = np.empty(len(uniques) + 1, dtype=np.int32)
+		for i, value in enumerate(uniques.tolist()):
+			if value not in index:
+				index[value] = len(vocabulary)
+				vocabulary.append(value)
+			mapping[i] = index[value]
+		mapping[-1] = -1  # missing values
+		return mapping[codes]
+
+	def close(self, columns):
+		for f in self.files.values():
+			f.close()
+		with open(os.path.join(self.directory, 'meta.json'), 'w') as f:
+			json.dump({'version': CACHE_VERSION, 'columns': columns, 'meta': self.meta}, f)
+
+
+class ParsedCache:
+	"""
+	Directory of parsed input tables, keyed by input content and read options.
+
+	Entries not used for max_age_days are removed, and the least recently
+	used ones are removed while the cache is larger than max_bytes.
+	"""
+
+	def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, max_age_days=DEFAULT_MAX_AGE_DAYS):
+		self.directory = directory
+		self.max_bytes = max_bytes
+		self.max_age_days = max_age_days
+		os.makedirs(directory, exist_ok=True)
+
+	def key(self, path, **options):
+		text = json.dumps([CACHE_VERSION, file_digest(path), options], sort_keys=True, default=str)
+		return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+	def load(self, key):
+		"""Return the cached table as a DataFrame over memory-mapped columns, or None"""
+		entry = os.path.join(self.directory, key)
+		try:
+			with open(os.path.join(entry, 'meta.json')) as f:
+				stored = json.load(f)
+		except (OSError, ValueError):
+			return None
+		os.utime(os.path.join(entry, 'meta.json'))
+
+		columns = {}
+		for column in stored['columns']:
+			meta = stored['meta'].get(column)
+			if meta is None or meta['length'] == 0:
+				return None
+			values = np.memmap(os.path.join(entry, meta['file']), dtype=meta['dtype'], mode='r', shape=(meta['length'],))
+			if 'vocabulary' in meta:
+				values = np.array(meta['vocabulary'] + [np.nan], dtype=object)[values]
+			columns[column] = values
+		return pd.DataFrame(columns, copy=False)
+
+	def store(self, key, chunks):
+		"""
+		Write the DataFrame chunks to the cache under key, yielding each chunk
+		on as it is written. The entry only becomes visible once complete.
+		"""
+		temporary = tempfile.mkdtemp(prefix='.tmp-', dir=self.directory)
+		writer = ColumnWriter(temporary)
+		columns = None
+		try:
+			for chunk in chunks:
+				columns = list(chunk.columns)
+				writer.append(chunk)
+				yield chunk
+			writer.close(columns or [])
+			if columns:
+				os.rename(temporary, os.path.join(self.directory, key))
+		except OSError as e:
+			# another process stored the same entry first, or the disk is full
+			logger.debug('Could not store cache entry %s: %s', key, e)
+		finally:
+			shutil.rmtree(temporary, ignore_errors=True)
+		self.evict()
+
+	def entries(self):
+		for name in os.listdir(self.directory):
+			path = os.path.join(self.directory, name)
+			if name.startswith('.') or not os.path.isdir(path):
+				continue
+			try:
+				used = os.path.getmtime(os.path.join(path, 'meta.json'))
+				size = sum(entry.stat().st_size for entry in os.scandir(path))
+			except OSError:
+				continue
+			yield used, size, path
+
+	def evict(self):
+		entries = sorted(self.entries())
+		cutoff = time.time() - self.max_age_days * 86400
+		total = sum(size for _, size, _ in entries)
+		for used, size, path in entries:
+			if used >= cutoff and total <= self.max_bytes:
+				break
+			shutil.rmtree(path, ignore_errors=True)
+			total -= size
+			logger.debug('Evicted cache entry %s', path)
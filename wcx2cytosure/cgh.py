@@ -0,0 +1,153 @@
+"""
+Incremental writer for CGH (CytoSure) documents
+"""
+
+import functools
+import re
+from collections import Counter
+from xml.sax.saxutils import escape
+from lxml import etree
+import numpy as np
+
+from .constants import CHROM_RENAME
+
+SECTIONS = ('submission', 'probes', 'segmentation')
+
+PROBE_TEMPLATE = (
+	'<probe name="{name}" chromosome="{chromosome}" start="%d" stop="%d" normalized="%.3f" smoothed="0.0" '
+	'smoothed_normalized="0.0" sequence="AACCGGTT"{original_coverage}{attributes}>\n'
+	'  <spot index="1" row="1" column="1" red="1000" green="%.3f" gSNR="100.0" rSNR="100.0" outlier="false"/>\n'
+	'</probe>\n'
+)
+
+
+def quote(value):
+	"""Escape a string for use in a double-quoted XML attribute"""
+	return escape(str(value), {'"': '&quot;', '\n': '&#10;', '\t': '&#9;'})
+
+
+def format_probes(chromosome, starts, ends, heights, name, original_coverage=None, attributes=None):
+	"""
+	Serialize a block of probes on one chromosome.
+
+	starts, ends, heights and original_coverage are arrays with one value per
+	probe; the other attributes are shared by the whole block, including the
+	extra ones in the dict attributes. The result is the same bytes as
+	serializing the make_probe() elements one at a time.
+	"""
+	heights = np.asarray(heights, dtype=np.float64)
+	template = PROBE_TEMPLATE.format(
+		name=quote(name),
+		chromosome=quote(CHROM_RENAME.get(chromosome, chromosome)),
+		original_coverage=' original_coverage="%.3f"' if original_coverage is not None else '',
+		attributes=''.join(f' {key}="{quote(value)}"' for key, value in (attributes or {}).items()).replace('%', '%%'),
+	)
+	columns = [
+		np.asarray(starts, dtype=np.int64) + 1,
+		np.asarray(ends, dtype=np.int64),
+		-heights,
+	]
+	if original_coverage is not None:
+		columns.append(np.asarray(original_coverage, dtype=np.float64))
+	columns.append(1000 * np.power(2.0, heights))
+
+	rows = zip(*(column.tolist() for column in columns))
+	return ''.join(map(template.__mod__, rows)).encode('ascii', 'xmlcharrefreplace')
+
+
+class CGHSkeleton:
+	"""
+	A CGH template compiled into the segments around the insertion points of
+	the aberrations (end of <submission>), the probes and the segments.
+
+	Only the first segment has slots: sample_id, male ("true"/"false") and
+	reference_sex ("Male"/"Female"). The other segments are kept as bytes.
+	"""
+
+	def __init__(self, template):
+		template = template.lstrip()
+		points = [
+			template.index('</submission>'),
+			re.search(r'<probes\b[^>]*>', template).end(),
+			re.search(r'<segmentation\b[^>]*>', template).end(),
+		]
+		bounds = [0] + points + [len(template)]
+		self.header = template[:points[0]]
+		self.segments = [template[a:b].encode('ascii') for a, b in zip(bounds[1:-1], bounds[2:])]
+
+	def chunks(self, sample_id, male, reference_sex):
+		header = self.header.format(sample_id=quote(sample_id), male=male, reference_sex=reference_sex)
+		return [header.encode('ascii', 'xmlcharrefreplace')] + self.segments
+
+
+@functools.lru_cache(maxsize=None)
+def skeleton(template):
+	"""Return the CGHSkeleton of a template, compiling it on first use"""
+	return CGHSkeleton(template)
+
+
+class Fragment:
+	"""
+	Serialized elements of one section, such as the probes of one chromosome,
+	collected to be written later with CGHWriter.write_serialized().
+	"""
+
+	def __init__(self):
+		self.chunks = []
+		self.n = 0
+
+	def write(self, element):
+		self.write_serialized(etree.tostring(element, pretty_print=True), 1)
+
+	def write_serialized(self, data, n):
+		self.chunks.append(data)
+		self.n += n
+
+	def getvalue(self):
+		return b''.join(self.chunks)
+
+
+class CGHWriter:
+	"""
+	Write a CGH document to a binary stream one element at a time.
+
+	Sections must be opened in document order (see SECTIONS). Elements passed
+	to write() become children of the currently open section and are
+	serialized immediately, so memory use does not grow with the number of
+	probes.
+	"""
+
+	def __init__(self, stream, template, sample_id, male='false', reference_sex='Female'):
+		self.stream = stream
+		self.chunks = skeleton(template).chunks(sample_id, male, reference_sex)
+		self.section = -1
+		self.counts = Counter()
+
+	def open_section(self, name):
+		index = SECTIONS.index(name)
+		if index <= self.section:
+			raise ValueError(f'Section {name} must be opened before {SECTIONS[self.section]}')
+		for chunk in self.chunks[self.section + 1:index + 1]:
+			self.stream.write(chunk)
+		self.section = index
+
+	def write(self, element):
+		self.counts[SECTIONS[self.section]] += 1
+		self.stream.write(etree.tostring(element, pretty_print=True))
+
+	def write_serialized(self, data, n):
+		"""Write n already serialized elements, such as from format_probes()"""
+		self.counts[SECTIONS[self.section]] += n
+		self.stream.write(data)
+
+	def close(self):
+		for chunk in self.chunks[self.section + 1:]:
+			self.stream.write(chunk)
+		self.section = len(self.chunks) - 1
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if exc_type is None:
+			self.close()
@@ -0,0 +1,231 @@
+"""
+Normalization profile of a cohort: the median and MAD of the WisecondorX
+ratio of every bin over many samples from the same reference
+
+The ratios are gathered into a bins × samples matrix in a memory-mapped .npy
+file, a few samples at a time, and the statistics are computed over blocks
+of bins, so the cohort never has to fit in memory. The profile is a
+tab-separated file with the columns chr, start, end, median, mad and
+samples. With --normalization-profile, a conversion replaces the ratio of
+every bin r by (r - median) / mad * m, where m is the median MAD over all
+bins, before the ratios are scaled to probe heights.
+
+	wcx2cytosure cohort --out cohort.profile.tsv samples/*.bins.bed
+"""
+
+import argparse
+import glob
+import logging
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+from . import wcx2cytosure
+from .contigs import contig_registry
+from .metrics import NULL_METRICS
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DTYPES = {
+	'chr': str,
+	'start': 'int64',
+	'end': 'int64',
+	'median': 'float64',
+	'mad': 'float64',
+	'samples': 'int64',
+}
+# Makes the MAD of normally distributed ratios an estimate of their standard deviation
+MAD_SCALE = 1.4826
+BLOCK_ROWS = 65536
+BLOCK_SAMPLES = 32
+
+
+def bin_keys(chroms, starts, CONTIG_LENGTHS):
+	"""
+	Return an int64 key per bin that sorts bins in the order of
+	CONTIG_LENGTHS and then by start. Bins on other contigs get -1.
+	"""
+	import numpy as np
+
+	codes = contig_registry(CONTIG_LENGTHS).encode(chroms).astype(np.int64)
+	keys = (codes << 32) | np.asarray(starts, dtype=np.int64)
+	keys[codes < 0] = -1
+	return keys
+
+
+def lookup(keys, layout_keys):
+	"""Return the row in layout_keys (sorted) of every key and whether it was found"""
+	import numpy as np
+
+	rows = np.minimum(np.searchsorted(layout_keys, keys), len(layout_keys) - 1)
+	found = (layout_keys[rows] == keys) & (keys >= 0) if len(layout_keys) else np.zeros(len(keys), dtype=bool)
+	return rows, found
+
+
+def read_bins(path):
+	from .inputs import read_table
+	return read_table(path, usecols=list(wcx2cytosure.WISECONDORX_BINS_DTYPES),
+		dtype=wcx2cytosure.WISECONDORX_BINS_DTYPES)
+
+
+def bins_layout(path, CONTIG_LENGTHS):
+	"""Return the bins of a sample on CONTIG_LENGTHS as a DataFrame with chr, start and end, and their keys"""
+	import numpy as np
+
+	bins = read_bins(path)
+	keys = bin_keys(bins['chr'], bins['start'], CONTIG_LENGTHS)
+	order = np.argsort(keys, kind='stable')
+	order = order[keys[order] >= 0]
+	return bins[['chr', 'start', 'end']].iloc[order].reset_index(drop=True), keys[order]
+
+
+def fill_matrix(matrix, paths, layout_keys, CONTIG_LENGTHS, block_samples=BLOCK_SAMPLES):
+	"""
+	Write the ratios of the samples at paths into the columns of matrix
+	(bins × samples), block_samples columns at a time. Bins of a sample that
+	are not in the layout are skipped; bins it lacks stay NaN.
+	"""
+	import numpy as np
+
+	for first in range(0, len(paths), block_samples):
+		block = np.full((len(layout_keys), min(block_samples, len(paths) - first)), np.nan, dtype=matrix.dtype)
+		for column, path in enumerate(paths[first:first + block_samples]):
+			bins = read_bins(path)
+			keys = bin_keys(bins['chr'], bins['start'], CONTIG_LENGTHS)
+			rows, found = lookup(keys, layout_keys)
+			missing = int((~found & (keys >= 0)).sum())
+			if missing:
+				logger.warning('%s: %d bins are not in the layout of the cohort and were skipped', path, missing)
+			block[rows[found], column] = bins['ratio'].to_numpy()[found]
+		matrix[:, first:first + block.shape[1]] = block
+		logger.info('Read %d of %d samples', first + block.shape[1], len(paths))
+
+
+def robust_statistics(matrix, block_rows=BLOCK_ROWS):
+	"""
+	Return the median, the MAD (scaled by MAD_SCALE) and the number of
+	samples with a ratio of every row of matrix, computed block_rows rows at
+	a time. Rows without any ratio get NaN.
+	"""
+	import numpy as np
+
+	n_rows = matrix.shape[0]
+	median = np.empty(n_rows)
+	mad = np.empty(n_rows)
+	samples = np.empty(n_rows, dtype=np.int64)
+	with warnings.catch_warnings():
+		warnings.filterwarnings('ignore', 'All-NaN slice encountered', RuntimeWarning)
+		for first in range(0, n_rows, block_rows):
+			block = np.asarray(matrix[first:first + block_rows], dtype=np.float64)
+			rows = slice(first, first + len(block))
+			median[rows] = np.nanmedian(block, axis=1)
+			mad[rows] = np.nanmedian(np.abs(block - median[rows, None]), axis=1) * MAD_SCALE
+			samples[rows] = np.count_nonzero(~np.isnan(block), axis=1)
+	return median, mad, samples
+
+
+def build_profile(paths, out, genome=37, contigs=None, matrix_path=None, block_rows=BLOCK_ROWS, block_samples=BLOCK_SAMPLES):
+	"""
+	Write the normalization profile of the samples with the bins.bed files at
+	paths to out. The contigs are those of genome, or of a .fai or .dict file
+	contigs. The matrix of ratios is kept at matrix_path if given.
+	Return the number of bins in the profile.
+	"""
+	import numpy as np
+
+	_, CONTIG_LENGTHS = wcx2cytosure.genome_build(genome, contigs)
+	layout, layout_keys = bins_layout(paths[0], CONTIG_LENGTHS)
+	if matrix_path is None:
+		f = tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(out)), prefix='.' + os.path.basename(out),
+			suffix='.npy', delete=False)
+		f.close()
+	path = matrix_path or f.name
+	try:
+		matrix = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(len(layout), len(paths)))
+		fill_matrix(matrix, paths, layout_keys, CONTIG_LENGTHS, block_samples)
+		matrix.flush()
+		median, mad, samples = robust_statistics(matrix, block_rows)
+		del matrix
+	finally:
+		if matrix_path is None:
+			os.unlink(path)
+
+	profile = layout.assign(median=median, mad=mad, samples=samples)
+	profile.to_csv(out, sep='\t', index=False, float_format='%.6g', na_rep='nan')
+	return len(profile)
+
+
+def load_profile(path, CONTIG_LENGTHS, cache=None):
+	"""
+	Read a normalization profile. Return the keys of its bins (sorted, see
+	bin_keys), their median and MAD, and the median MAD over all bins.
+	"""
+	import numpy as np
+	from .inputs import read_table
+
+	profile = read_table(path, usecols=list(PROFILE_DTYPES), dtype=PROFILE_DTYPES, cache=cache)
+	keys = bin_keys(profile['chr'], profile['start'], CONTIG_LENGTHS)
+	order = np.argsort(keys, kind='stable')
+	order = order[keys[order] >= 0]
+	median = profile['median'].to_numpy()[order]
+	mad = profile['mad'].to_numpy()[order]
+	usable = np.isfinite(median) & (mad > 0)
+	mad_scale = float(np.median(mad[usable])) if usable.any() else np.nan
+	return keys[order[usable]], median[usable], mad[usable], mad_scale
+
+
+def normalize_coverages(coverages, path, CONTIG_LENGTHS, cache=None, metrics=NULL_METRICS):
+	"""
+	Express the ratios of bins (as from filter_coverages) relative to the
+	cohort in the profile at path. Bins that are not in the profile, or
+	whose MAD is 0, are dropped.
+	"""
+	keys, median, mad, mad_scale = load_profile(path, CONTIG_LENGTHS, cache)
+	rows, found = lookup(bin_keys(coverages['chr'], coverages['start'], CONTIG_LENGTHS), keys)
+	missing = int((~found).sum())
+	metrics.count('read_bins', 'rows_without_profile', missing)
+	if missing:
+		logger.warning('%d bins are not in the normalization profile %s and were skipped', missing, path)
+	coverages = coverages[found].reset_index(drop=True)
+	rows = rows[found]
+	coverages['ratio'] = (coverages['ratio'].to_numpy() - median[rows]) / mad[rows] * mad_scale
+	return coverages
+
+
+def find_bins(inputs):
+	"""Expand directories (to their *.bins.bed files) and glob patterns"""
+	paths = []
+	for pattern in inputs:
+		if os.path.isdir(pattern):
+			pattern = os.path.join(pattern, '*.bins.bed')
+		paths += sorted(glob.glob(pattern)) or [pattern]
+	return paths
+
+
+def main(argv=None):
+	logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+	parser = argparse.ArgumentParser("wcx2cytosure cohort - make a normalization profile from the bins of many samples")
+	parser.add_argument('bins', nargs='+', help='bins.bed files from WisecondorX, directories or glob patterns')
+	parser.add_argument('--out', required=True, help='normalization profile to write')
+	parser.add_argument('--genome', default=37, help='37 for GRCh37/hg19, 38 for GRCh38 (default: %(default)s)')
+	parser.add_argument('--contigs', metavar='PATH', help='take the chromosomes from this .fai or .dict file')
+	parser.add_argument('--matrix', metavar='PATH',
+		help='keep the bins × samples matrix of ratios in this .npy file (default: a temporary file)')
+	parser.add_argument('--block-rows', type=int, default=BLOCK_ROWS,
+		help='bins per block when computing the statistics (default: %(default)s)')
+	parser.add_argument('--block-samples', type=int, default=BLOCK_SAMPLES,
+		help='samples read before writing them to the matrix (default: %(default)s)')
+	args = parser.parse_args(argv)
+
+	paths = find_bins(args.bins)
+	started = time.perf_counter()
+	n = build_profile(paths, args.out, args.genome, args.contigs, args.matrix, args.block_rows, args.block_samples)
+	logger.info('Wrote the profile of %d bins over %d samples to %s in %.1f s', n, len(paths), args.out,
+		time.perf_counter() - started)
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
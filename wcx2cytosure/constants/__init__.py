@@ -3,6 +3,14 @@
 PROBE_SPACING = 100000
 MAX_HEIGHT = 4
 MIN_HEIGHT = -4
+TIDDIT_MIN_QUALITY = 20
+TIDDIT_CHUNKSIZE = 1000000
+# Chromosomes made ahead of the one being written with --pipeline
+PIPELINE_DEPTH = 2
+# Y coverage relative to the autosomes above which a sample is called male
+MALE_Y_COVERAGE_RATIO = 0.2
+# Y coverage relative to the autosomes expected in a male: one copy against two
+MALE_Y_DOSAGE = 0.5
 ABERRATION_HEIGHTS = {
 	'DEL': -1.0,
 	'DUP': +1.0,
@@ -82,7 +90,7 @@ CONTIG_LENGTHS_38 = {
 	'20':   64444167,
 	'21':   46709983,
 	'22':   50818468,
-	'X':    15604089,
+	'X':    156040895,
 	'Y':    57227415,
 }
 
@@ -95,10 +103,10 @@ CGH_TEMPLATE_37 = u"""
 </noResults>
 <pgd_reagents/>
 <cgh mother="-1" father="-1" genomeBuild="hg19" softwareVersion="4.8.32" batched="false">
-  <submission design="031035" feFile="{}.txt" cghFile="{}.cgh" scanDate="1462520414000" barcode="{}" sampleCy3="true">
+  <submission design="031035" feFile="{sample_id}.txt" cghFile="{sample_id}.cgh" scanDate="1462520414000" barcode="{sample_id}" sampleCy3="true">
   <notes/>
-  <sample sampleId="{}" male="{}"><phenotype/></sample>
-  <reference sampleId="Promega {}" male="{}"><phenotype/></reference>
+  <sample sampleId="{sample_id}" male="{male}"><phenotype/></sample>
+  <reference sampleId="Promega {reference_sex}" male="{male}"><phenotype/></reference>
   <extra>
     <datum category="Nanodrop" type="Sample DNA (ng)" dataType="Float"/>
     <datum category="Sample Extraction" type="Sample Arrival Date" dataType="Date"/>
@@ -167,10 +175,10 @@ CGH_TEMPLATE_38 = u"""
 </noResults>
 <pgd_reagents/>
 <cgh mother="-1" father="-1" genomeBuild="hg38" softwareVersion="4.10.41" batched="false">
-  <submission design="031035" feFile="{}.txt" cghFile="{}.cgh" scanDate="1462520414000" barcode="{}" sampleCy3="true">
+  <submission design="031035" feFile="{sample_id}.txt" cghFile="{sample_id}.cgh" scanDate="1462520414000" barcode="{sample_id}" sampleCy3="true">
   <notes/>
-  <sample sampleId="{}" male="{}"><phenotype/></sample>
-  <reference sampleId="Promega {}" male="{}"><phenotype/></reference>
+  <sample sampleId="{sample_id}" male="{male}"><phenotype/></sample>
+  <reference sampleId="Promega {reference_sex}" male="{male}"><phenotype/></reference>
   <extra>
     <datum category="Nanodrop" type="Sample DNA (ng)" dataType="Float"/>
     <datum category="Sample Extraction" type="Sample Arrival Date" dataType="Date"/>
@@ -0,0 +1,120 @@
+"""
+Contig registry: the chromosomes of a genome build in output order, their
+lengths, and the names they go by in the inputs
+
+Inputs name the chromosomes "1" or "chr1", "X", "chrX" or "23". Every
+spelling maps to one canonical name (1-22, X, Y) and to an integer code, the
+index of the contig in output order. Columns of names are mapped by looking
+up each distinct name once.
+"""
+
+import os
+from functools import lru_cache
+
+from .constants import AUTOSOMES, CHROM_RENAME, CONTIG_LENGTHS_37, CONTIG_LENGTHS_38
+
+PRIMARY_CONTIGS = AUTOSOMES + ['X', 'Y']
+
+
+def spellings(name):
+	"""The names a primary contig may have in the inputs"""
+	names = {name, CHROM_RENAME.get(name, name)}
+	return names | {prefix + n for n in names for prefix in ('chr', 'Chr', 'CHR')}
+
+
+CANONICAL_NAMES = {spelling: name for name in PRIMARY_CONTIGS for spelling in spellings(name)}
+
+
+def canonical_name(name):
+	"""Return the canonical name of a primary contig (see spellings), or None for any other contig"""
+	return CANONICAL_NAMES.get(str(name))
+
+
+def canonical_names(names):
+	"""
+	Return an object array with the canonical name of each of an array of
+	names, or the name itself for contigs other than the primary ones
+	"""
+	import numpy as np
+	import pandas as pd
+
+	factor, uniques = pd.factorize(np.asarray(names, dtype=object), use_na_sentinel=True)
+	lookup = np.array([canonical_name(name) or name for name in uniques] + [None], dtype=object)
+	return lookup[factor]
+
+
+class ContigRegistry(dict):
+	"""
+	Lengths of the contigs of a genome build by canonical name, in output
+	order (1-22, X, Y), together with the integer codes of their spellings
+	"""
+
+	def __init__(self, lengths):
+		super().__init__((canonical_name(name) or name, length) for name, length in lengths.items())
+		self.names = list(self)
+		self.codes = {}
+		for code, name in enumerate(self.names):
+			for spelling in spellings(name):
+				self.codes.setdefault(spelling, code)
+
+	def code(self, name):
+		"""Return the code of a contig name, or -1 if it is not in the build"""
+		return self.codes.get(str(name), -1)
+
+	def encode(self, names):
+		"""Return the int16 codes of an array of contig names, -1 for contigs not in the build"""
+		import numpy as np
+		import pandas as pd
+
+		factor, uniques = pd.factorize(np.asarray(names, dtype=object), use_na_sentinel=True)
+		lookup = np.array([self.code(name) for name in uniques] + [-1], dtype=np.int16)
+		return lookup[factor]
+
+	def decode(self, codes):
+		"""Return an object array with the canonical names of codes (>= 0)"""
+		import numpy as np
+		return np.array(self.names, dtype=object)[codes]
+
+	def __reduce__(self):
+		return type(self), (dict(self),)
+
+	@classmethod
+	def from_file(cls, path):
+		"""
+		Read the primary contigs (see PRIMARY_CONTIGS) of a build from a FASTA
+		index (.fai) or a sequence dictionary (.dict), whatever their naming.
+		"""
+		lengths = {}
+		with open(path) as f:
+			for line in f:
+				fields = line.rstrip('\n').split('\t')
+				if path.endswith('.dict'):
+					if fields[0] != '@SQ':
+						continue
+					tags = dict(field.split(':', 1) for field in fields[1:] if ':' in field)
+					name, length = tags['SN'], tags['LN']
+				else:
+					name, length = fields[0], fields[1]
+				name = canonical_name(name)
+				if name is not None:
+					lengths.setdefault(name, int(length))
+		if not lengths:
+			raise ValueError(f'{path} has none of the chromosomes 1-22, X and Y')
+		return cls({name: lengths[name] for name in PRIMARY_CONTIGS if name in lengths})
+
+
+BUILDS = {
+	37: ContigRegistry(CONTIG_LENGTHS_37),
+	38: ContigRegistry(CONTIG_LENGTHS_38),
+}
+
+
+@lru_cache(maxsize=None)
+def load_contigs(path):
+	"""The ContigRegistry of a .fai or .dict file"""
+	return ContigRegistry.from_file(os.fspath(path))
+
+
+def contig_registry(contigs):
+	"""Return contigs as a ContigRegistry, such as a dict of contig lengths"""
+	return contigs if isinstance(contigs, ContigRegistry) else ContigRegistry(contigs)
@@ -0,0 +1,205 @@
+"""
+Compare two CGH files record by record
+
+The header (the attributes and text of the elements before the probes, such
+as the sex of the sample) is compared first. The probes, segments and
+aberrations are then matched by chromosome and position, and their values
+compared within a tolerance. Files written in chromosome order, as this
+version writes them, are streamed one chromosome at a time (see reader.py),
+so only the records of one chromosome of each file are held. Files whose
+records of one chromosome are not consecutive, as written by older versions,
+are read whole into columns, some 60 bytes per probe.
+"""
+
+import argparse
+import filecmp
+import re
+import sys
+
+import numpy as np
+
+from .reader import RECORDS, read_cgh, read_chromosomes, read_header, to_columns
+
+KEYS = {
+	'probe': ['chromosome', 'start', 'stop', 'name'],
+	'segment': ['chrId', 'start', 'stop'],
+	'aberration': ['chr', 'start', 'stop'],
+}
+VALUES = {
+	'probe': ['normalized', 'green', 'original_coverage'],
+	'segment': ['average', 'zscore'],
+	'aberration': ['zscore'],
+}
+LABELS = {
+	'probe': [],
+	'segment': [],
+	'aberration': ['gain', 'confirmation'],
+}
+# The order of the sections in the document
+TAGS = ('aberration', 'probe', 'segment')
+SCAN_BYTES = 1 << 22
+CHROMOSOME_PATTERN = re.compile(rb'<(probe|segment|aberration) [^>]*?\b(?:chromosome|chrId|chr)="([^"]*)"')
+
+
+def chromosome_order(chromosome):
+	return (len(chromosome), chromosome)
+
+
+def diff_records(tag, a, b, tolerance):
+	"""
+	Compare the columns of one kind of record from two files. Yield a
+	(chromosome, start, stop, description) for every record that is in only
+	one of them or whose values differ by more than tolerance.
+	"""
+	import pandas as pd
+	keys = KEYS[tag]
+	chromosome = keys[0]
+	a, b = pd.DataFrame(a), pd.DataFrame(b)
+	for frame in (a, b):
+		# Tell apart records with the same key by their order
+		frame['occurrence'] = frame.groupby(keys, sort=False).cumcount()
+	a_chromosomes, b_chromosomes = dict(tuple(a.groupby(chromosome))), dict(tuple(b.groupby(chromosome)))
+	empty = a.iloc[:0]
+	for chrom in sorted(set(a_chromosomes) | set(b_chromosomes), key=chromosome_order):
+		merged = a_chromosomes.get(chrom, empty).merge(b_chromosomes.get(chrom, empty), how='outer',
+			on=keys + ['occurrence'], suffixes=('_a', '_b'), indicator='side', sort=True)
+		both = (merged['side'] == 'both').to_numpy()
+		differs = ~both
+		for column in VALUES[tag]:
+			differs |= ~np.isclose(merged[column + '_a'], merged[column + '_b'], rtol=0, atol=tolerance, equal_nan=True) & both
+		for column in LABELS[tag]:
+			differs |= (merged[column + '_a'] != merged[column + '_b']).to_numpy() & both
+		for row in merged[differs].to_dict('records'):
+			if row['side'] == 'left_only':
+				description = f'{tag} only in the first file'
+			elif row['side'] == 'right_only':
+				description = f'{tag} only in the second file'
+			else:
+				description = f'{tag} ' + ', '.join(f'{column} {row[column + "_a"]} != {row[column + "_b"]}'
+					for column in VALUES[tag] + LABELS[tag]
+					if not values_match(row[column + '_a'], row[column + '_b'], tolerance))
+			yield chrom, row['start'], row['stop'], description
+
+
+def values_match(a, b, tolerance):
+	if isinstance(a, str):
+		return a == b
+	return bool(np.isclose(a, b, rtol=0, atol=tolerance, equal_nan=True))
+
+
+def diff_header(first, second):
+	"""
+	Compare the headers of two CGH files (see read_header). Yield a (path,
+	description) for every element that is in only one of them or whose
+	attributes or text differ.
+	"""
+	a, b = read_header(first), read_header(second)
+	for i in range(max(len(a), len(b))):
+		if i >= len(b) or i >= len(a) or a[i][0] != b[i][0]:
+			path = a[i][0] if i < len(a) else b[i][0]
+			yield path, 'the headers have other elements from here on'
+			return
+		path, a_attrib, a_text = a[i]
+		_, b_attrib, b_text = b[i]
+		differences = [f'{name} {a_attrib.get(name)} != {b_attrib.get(name)}'
+			for name in sorted(set(a_attrib) | set(b_attrib)) if a_attrib.get(name) != b_attrib.get(name)]
+		if a_text != b_text:
+			differences.append(f'text {a_text!r} != {b_text!r}')
+		if differences:
+			yield path, ', '.join(differences)
+
+
+def in_chromosome_order(path):
+	"""
+	Whether the records of each kind in a CGH file come in runs of one
+	chromosome each, in increasing chromosome order, as read_chromosomes()
+	needs to stream two files side by side. The file is scanned as bytes,
+	much faster than it is parsed.
+	"""
+	seen = set()
+	last = None
+	rest = b''
+	with open(path, 'rb') as f:
+		while True:
+			data = f.read(SCAN_BYTES)
+			chunk = rest + data
+			cut = chunk.rfind(b'\n') + 1 if data else len(chunk)
+			chunk, rest = chunk[:cut], chunk[cut:]
+			for tag, chromosome in CHROMOSOME_PATTERN.findall(chunk):
+				key = (TAGS.index(tag.decode()), chromosome_order(chromosome.decode()))
+				if key != last:
+					if key in seen or (last is not None and key < last):
+						return False
+					seen.add(key)
+					last = key
+			if not data:
+				return True
+
+
+def chromosome_key(group):
+	tag, chromosome, _ = group
+	return TAGS.index(tag), chromosome_order(chromosome)
+
+
+def diff_streams(first, second, tolerance):
+	"""Diff the records of two files in chromosome order, one chromosome of each at a time"""
+	a, b = read_chromosomes(first), read_chromosomes(second)
+	a_group, b_group = next(a, None), next(b, None)
+	while a_group is not None or b_group is not None:
+		if b_group is None or (a_group is not None and chromosome_key(a_group) < chromosome_key(b_group)):
+			tag, a_columns, b_columns = a_group[0], a_group[2], to_columns([], RECORDS[a_group[0]][1])
+			a_group = next(a, None)
+		elif a_group is None or chromosome_key(b_group) < chromosome_key(a_group):
+			tag, a_columns, b_columns = b_group[0], to_columns([], RECORDS[b_group[0]][1]), b_group[2]
+			b_group = next(b, None)
+		else:
+			tag, a_columns, b_columns = a_group[0], a_group[2], b_group[2]
+			a_group, b_group = next(a, None), next(b, None)
+		yield from diff_records(tag, a_columns, b_columns, tolerance)
+
+
+def diff_cgh(first, second, tolerance=0.001):
+	"""
+	Yield the differences between two CGH files as (location, description):
+	first those of the header (see diff_header), located by element path,
+	then those of the records in document order (see diff_records), located
+	as chromosome:start-stop.
+	"""
+	yield from diff_header(first, second)
+	if in_chromosome_order(first) and in_chromosome_order(second):
+		records = diff_streams(first, second, tolerance)
+	else:
+		a, b = read_cgh(first), read_cgh(second)
+		records = (difference for tag in TAGS for difference in diff_records(tag, a[tag], b[tag], tolerance))
+	for chrom, start, stop, description in records:
+		yield f'{chrom}:{start}-{stop}', description
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser("wcx2cytosure diff - compare the probes, segments and aberrations of two CGH files")
+	parser.add_argument('first', help='CGH file')
+	parser.add_argument('second', help='CGH file to compare it with')
+	parser.add_argument('--tolerance', type=float, default=0.001,
+		help='largest difference between two values that counts as equal (default: %(default)s)')
+	parser.add_argument('--max-report', type=int, default=20, help='differences to list (default: %(default)s)')
+	args = parser.parse_args(argv)
+
+	if filecmp.cmp(args.first, args.second, shallow=False):
+		print('The files are identical')
+		return 0
+	n = 0
+	for location, description in diff_cgh(args.first, args.second, args.tolerance):
+		if n < args.max_report:
+			print(f'{location}\t{description}')
+		n += 1
+	if n > args.max_report:
+		print(f'... and {n - args.max_report} more')
+	if n:
+		print(f'{n} differences')
+		return 1
+	print(f'The files differ but not in their records (tolerance {args.tolerance})')
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,151 @@
+"""
+Reading of plain, gzip/bgzip and tabix-indexed tab-separated inputs
+"""
+
+import gzip
+import itertools
+import logging
+import os
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+
+from .contigs import canonical_name, canonical_names
+from .intervals import IntervalIndex, overlap_mask
+from .tsv import is_gzipped, parse_regions
+
+logger = logging.getLogger(__name__)
+
+CACHE_CHUNKSIZE = 1000000
+
+
+def tabix_index(path):
+	"""Return the path of the tabix index of path, or None if there is none"""
+	for suffix in ('.tbi', '.csi'):
+		if os.path.exists(path + suffix):
+			return path + suffix
+	return None
+
+
+def read_header(path, compressed):
+	opener = gzip.open if compressed else open
+	with opener(path, 'rt') as f:
+		return f.readline().rstrip('\n').split('\t')
+
+
+def in_regions(df, regions):
+	"""Boolean mask of the rows of df (chrom, start, end in its first three columns) that overlap regions"""
+	chrom, start, end = (df.iloc[:, i] for i in range(3))
+	chrom = canonical_names(chrom.astype(str).to_numpy())
+	start, end = start.to_numpy(), end.to_numpy()
+	index = IntervalIndex.from_regions(regions)
+	mask = np.zeros(len(df), dtype=bool)
+	for region_chrom in index.intervals:
+		rows = chrom == region_chrom
+		mask[rows] = index.mask(region_chrom, start[rows], end[rows])
+	return mask
+
+
+def read_table(path, usecols=None, dtype=None, regions=None, contigs=None, chunksize=None, cache=None):
+	"""
+	Read a tab-separated table with a header line. gzip and bgzip compressed
+	files are recognized by their content, whatever their name.
+
+	regions -- list of (chrom, start, end) as returned by parse_regions
+	contigs -- contigs to fetch when there are no regions
+	cache -- ParsedCache to load the parsed table from, or to store it in
+
+	If the file is bgzip compressed and has a tabix index, only the regions
+	(or else the contigs) are read from it. Without an index, the whole file is
+	read and rows outside the regions are dropped.
+
+	Return a DataFrame, or an iterator of DataFrames of at most chunksize rows.
+	"""
+	if cache is None:
+		return _read_table(path, usecols, dtype, regions, contigs, chunksize)
+
+	key = cache.key(path, usecols=usecols, dtype=dtype, regions=regions, contigs=sorted(contigs or ()))
+	df = cache.load(key)
+	if df is not None:
+		logger.info('Read %s from the cache', path)
+		if chunksize:
+			return (df.iloc[i:i + chunksize] for i in range(0, len(df), chunksize))
+		return df
+
+	chunks = cache.store(key, _read_table(path, usecols, dtype, regions, contigs, chunksize or CACHE_CHUNKSIZE))
+	if chunksize:
+		return chunks
+	return _concat(chunks, path, usecols, dtype, is_gzipped(path))
+
+
+def _read_table(path, usecols, dtype, regions, contigs, chunksize):
+	compressed = is_gzipped(path)
+	index = tabix_index(path) if compressed else None
+	if index and (regions or contigs):
+		try:
+			import pysam
+		except ImportError:
+			logger.warning('%s is indexed, but reading only some regions requires pysam; reading the whole file', path)
+		else:
+			fetch = regions or [(contig, None, None) for contig in contigs]
+			chunks = _fetch_tabix(pysam, path, index, fetch, usecols, dtype, chunksize)
+			return chunks if chunksize else _concat(chunks, path, usecols, dtype, compressed)
+
+	reader = pd.read_csv(path, sep='\t', header=0, usecols=usecols, dtype=dtype, chunksize=chunksize,
+		compression='gzip' if compressed else None)
+	if not regions:
+		return reader
+	if chunksize:
+		return (chunk[in_regions(chunk, regions)] for chunk in reader)
+	return reader[in_regions(reader, regions)].reset_index(drop=True)
+
+
+def _fetch_tabix(pysam, path, index, regions, usecols, dtype, chunksize):
+	"""
+	Yield the rows of the regions, or of the contigs given as (contig, None,
+	None), from a tabix-indexed file. The regions are merged per contig and
+	fetched in the order of the file, so each row comes once and the rows stay
+	sorted; a row overlapping several regions belongs to the first.
+	"""
+	header = read_header(path, compressed=True)
+	tabix = pysam.TabixFile(path, index=index)
+	try:
+		# the file may name the contigs otherwise than the regions
+		available = {canonical_name(contig) or contig: contig for contig in tabix.contigs}
+		whole_contig = np.iinfo(np.int64).max
+		windows = IntervalIndex.from_regions(regions)
+		for chrom in sorted(windows.intervals, key=lambda chrom: tabix.contigs.index(available[chrom])
+				if chrom in available else -1):
+			contig = available.get(chrom)
+			if contig is None:
+				continue
+			starts, ends = windows[chrom]
+			for i, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+				# one base wider, so that rows touching the region whichever way the
+				# file counts are fetched, and then kept as in_regions() keeps them
+				lines = tabix.fetch(contig, max(start - 1, 0), end + 1) if end != whole_contig else tabix.fetch(contig)
+				while True:
+					batch = list(itertools.islice(lines, chunksize))
+					if not batch:
+						break
+					df = pd.read_csv(StringIO('\n'.join(batch)), sep='\t', header=None, names=header,
+						usecols=usecols, dtype=dtype)
+					row_starts, row_ends = df.iloc[:, 1].to_numpy(), df.iloc[:, 2].to_numpy()
+					keep = overlap_mask(starts[i:i + 1], ends[i:i + 1], row_starts, row_ends)
+					keep &= ~overlap_mask(starts[:i], ends[:i], row_starts, row_ends)
+					if keep.any():
+						yield df[keep]
+	finally:
+		tabix.close()
+
+
+def _concat(chunks, path, usecols, dtype, compressed):
+	chunks = list(chunks)
+	if len(chunks) == 1:
+		return chunks[0].reset_index(drop=True)
+	if chunks:
+		return pd.concat(chunks, ignore_index=True)
+	# Nothing in the requested regions: an empty frame with the right columns
+	header = read_header(path, compressed)
+	return pd.read_csv(StringIO('\t'.join(header) + '\n'), sep='\t', usecols=usecols, dtype=dtype)
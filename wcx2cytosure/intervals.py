@@ -0,0 +1,180 @@
+"""
+Interval arithmetic on sorted NumPy arrays
+"""
+
+import numpy as np
+
+
+def merge_intervals(starts, ends):
+	"""
+	Merge overlapping intervals. Touching intervals (one ends where the next
+	starts) are merged as well.
+
+	Return the merged (starts, ends) arrays, sorted by start.
+	"""
+	starts = np.asarray(starts, dtype=np.int64)
+	ends = np.asarray(ends, dtype=np.int64)
+	if len(starts) == 0:
+		return starts, ends
+
+	order = np.argsort(starts, kind='stable')
+	starts = starts[order]
+	reach = np.maximum.accumulate(ends[order])
+	first = np.ones(len(starts), dtype=bool)
+	first[1:] = starts[1:] > reach[:-1]
+	last = np.append(np.flatnonzero(first)[1:] - 1, len(starts) - 1)
+
+	return starts[first], reach[last]
+
+
+def complement_intervals(starts, ends, length):
+	"""
+	Return the (starts, ends) arrays of the gaps between the merged
+	intervals within [0, length). Empty gaps are left out.
+	"""
+	starts, ends = merge_intervals(starts, ends)
+	gap_starts = np.concatenate(([0], ends))
+	gap_ends = np.concatenate((starts, [length]))
+	gap_starts = np.clip(gap_starts, 0, length)
+	gap_ends = np.clip(gap_ends, 0, length)
+	keep = gap_starts < gap_ends
+
+	return gap_starts[keep], gap_ends[keep]
+
+
+def spaced_positions(starts, ends, probe_spacing):
+	"""
+	Nicely spaced positions along each interval [start, end]:
+	- start and end are always included
+	- at least three positions are included
+
+	Return the positions and, for each position, the index of the interval it
+	belongs to. Positions are ordered by interval, then by position.
+	"""
+	starts = np.asarray(starts, dtype=np.int64)
+	ends = np.asarray(ends, dtype=np.int64)
+	lengths = ends - starts
+	steps = np.maximum(lengths // probe_spacing, 2)
+	spacings = lengths / steps  # float division
+
+	# Candidate positions per interval; the ones past the end are dropped below.
+	# Short intervals (spacing < 1) repeat positions, so they need extra ones.
+	counts = np.where(lengths > 0, steps + 2 + steps // np.maximum(lengths, 1), np.where(lengths == 0, 1, 0))
+	interval = np.repeat(np.arange(len(starts)), counts)
+	offsets = np.cumsum(counts) - counts
+	i = np.arange(len(interval)) - offsets[interval]
+	positions = starts[interval] + (i * spacings[interval]).astype(np.int64)
+
+	keep = positions <= ends[interval]
+	return positions[keep], interval[keep]
+
+
+class IntervalIndex:
+	"""
+	Sorted, merged intervals per chromosome, searched by binary search.
+
+	Selecting the bins of a chromosome (sorted, not overlapping each other)
+	that overlap the index costs O(log n) per interval of the index plus the
+	size of the selection, rather than a pass over all bins.
+	"""
+
+	def __init__(self, intervals):
+		"""intervals -- (chrom, start, end) tuples, 0-based half-open, in any order"""
+		grouped = {}
+		for chrom, start, end in intervals:
+			starts, ends = grouped.setdefault(chrom, ([], []))
+			starts.append(start)
+			ends.append(end)
+		self.intervals = {chrom: merge_intervals(starts, ends) for chrom, (starts, ends) in grouped.items()}
+
+	@classmethod
+	def around(cls, events, flank, lengths):
+		"""The windows of flank bp on either side of the events, within the contig lengths"""
+		return cls((event.chrom, max(event.start - flank, 0), min(event.end + flank, lengths[event.chrom]))
+			for event in events)
+
+	@classmethod
+	def from_regions(cls, regions, lengths=None):
+		"""The regions from parse_regions(); whole contigs end at their length in lengths, if known"""
+		return cls((chrom, start or 0, end if end is not None else (lengths or {}).get(chrom, np.iinfo(np.int64).max))
+			for chrom, start, end in regions)
+
+	def __contains__(self, chrom):
+		return chrom in self.intervals
+
+	def __getitem__(self, chrom):
+		"""The merged (starts, ends) on chrom"""
+		return self.intervals.get(chrom, (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)))
+
+	def select(self, chrom, starts, ends):
+		"""
+		Return the indices of the intervals (starts[i], ends[i]) that overlap
+		the index on chrom. Both starts and ends must be sorted, as for the
+		bins of one chromosome.
+		"""
+		window_starts, window_ends = self[chrom]
+		first = np.searchsorted(ends, window_starts, side='right')
+		last = np.searchsorted(starts, window_ends, side='left')
+		ranges = [np.arange(i, j) for i, j in zip(first.tolist(), last.tolist()) if i < j]
+		if not ranges:
+			return np.empty(0, dtype=np.int64)
+		# an interval spanning the gap between two windows is in both ranges
+		return np.unique(np.concatenate(ranges))
+
+	def mask(self, chrom, starts, ends):
+		"""Boolean mask of the intervals (starts[i], ends[i]), in any order, that overlap the index on chrom"""
+		return overlap_mask(*self[chrom], starts, ends)
+
+
+def overlap_mask(window_starts, window_ends, starts, ends):
+	"""
+	Boolean mask of the intervals (starts[i], ends[i]), in any order, that
+	overlap the merged windows (as from merge_intervals)
+	"""
+	starts = np.asarray(starts, dtype=np.int64)
+	ends = np.asarray(ends, dtype=np.int64)
+	if len(window_starts) == 0:
+		return np.zeros(len(starts), dtype=bool)
+	# the last window starting before an interval ends is the only one that can overlap it
+	window = np.searchsorted(window_starts, ends, side='left') - 1
+	return (window >= 0) & (window_ends[np.maximum(window, 0)] > starts)
+
+
+class EventIndex:
+	"""
+	The events (with chrom, start and end, 0-based half-open) of each
+	chromosome sorted by start, to find the event that each of many intervals
+	overlaps by binary search: O((intervals + events) log events) in all.
+	"""
+
+	def __init__(self, events):
+		self.events = {}
+		for event in sorted(events, key=lambda event: event.start):
+			self.events.setdefault(event.chrom, []).append(event)
+		self.arrays = {}
+		for chrom, chrom_events in self.events.items():
+			starts = np.array([event.start for event in chrom_events], dtype=np.int64)
+			ends = np.array([event.end for event in chrom_events], dtype=np.int64)
+			# the furthest end among the first i events, and the event that reaches it
+			reach = np.maximum.accumulate(ends)
+			furthest = np.maximum.accumulate(np.where(ends == reach, np.arange(len(ends)), 0))
+			self.arrays[chrom] = starts, reach, furthest
+
+	def __getitem__(self, chrom):
+		"""The events on chrom, sorted by start"""
+		return self.events.get(chrom, [])
+
+	def overlapping(self, chrom, starts, ends):
+		"""
+		Return the index in self[chrom] of an event overlapping each interval
+		(starts[i], ends[i]), in any order, or -1 where none does. Where several
+		events overlap an interval, the one reaching furthest is taken.
+		"""
+		starts = np.asarray(starts, dtype=np.int64)
+		ends = np.asarray(ends, dtype=np.int64)
+		if chrom not in self.arrays:
+			return np.full(len(starts), -1, dtype=np.int64)
+		event_starts, reach, furthest = self.arrays[chrom]
+		last = np.searchsorted(event_starts, ends, side='left') - 1
+		found = (last >= 0) & (reach[np.maximum(last, 0)] > starts)
+		return np.where(found, furthest[np.maximum(last, 0)], -1)
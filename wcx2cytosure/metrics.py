@@ -0,0 +1,122 @@
+"""
+Per-stage instrumentation: wall time, CPU time, peak memory and item counts
+"""
+
+import json
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+
+def peak_rss_mb():
+	"""Peak resident set size of this process so far, in MB; 0 where it cannot be measured (Windows)"""
+	try:
+		import resource
+	except ImportError:
+		return 0.0
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# kilobytes on Linux, bytes on macOS
+	return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+class Stage:
+	__slots__ = ('wall', 'cpu', 'peak_rss_mb', 'counts', 'per_chromosome')
+
+	def __init__(self):
+		self.wall = 0.0
+		self.cpu = 0.0
+		self.peak_rss_mb = 0.0
+		self.counts = defaultdict(int)
+		self.per_chromosome = defaultdict(int)
+
+	def to_dict(self):
+		d = {
+			'wall_seconds': round(self.wall, 6),
+			'cpu_seconds': round(self.cpu, 6),
+			'peak_rss_mb': round(self.peak_rss_mb, 1),
+		}
+		d.update(self.counts)
+		if self.per_chromosome:
+			d['per_chromosome'] = dict(self.per_chromosome)
+		return d
+
+
+class Metrics:
+	"""
+	Record how long each stage of a conversion takes and how many items it
+	handles. Stages are kept in the order they are first entered; entering a
+	stage again adds to it.
+	"""
+
+	def __init__(self):
+		self.stages = {}
+
+	def _stage(self, name):
+		if name not in self.stages:
+			self.stages[name] = Stage()
+		return self.stages[name]
+
+	@contextmanager
+	def stage(self, name):
+		stage = self._stage(name)
+		wall = time.perf_counter()
+		cpu = time.process_time()
+		try:
+			yield
+		finally:
+			stage.wall += time.perf_counter() - wall
+			stage.cpu += time.process_time() - cpu
+			stage.peak_rss_mb = peak_rss_mb()
+
+	def count(self, name, key, n=1, chromosome=None):
+		"""Add n to the key counter of a stage, and to its per-chromosome total"""
+		stage = self._stage(name)
+		stage.counts[key] += n
+		if chromosome is not None:
+			stage.per_chromosome[chromosome] += n
+
+	def total(self, name, key):
+		"""Return the key counter of a stage, or 0 if it was never counted"""
+		stage = self.stages.get(name)
+		return stage.counts.get(key, 0) if stage is not None else 0
+
+	def merge(self, other):
+		"""
+		Add the stages of another Metrics, such as one filled in a worker
+		process. Times add up, so they are the total over the workers.
+		"""
+		for name, other_stage in other.stages.items():
+			stage = self._stage(name)
+			stage.wall += other_stage.wall
+			stage.cpu += other_stage.cpu
+			stage.peak_rss_mb = max(stage.peak_rss_mb, other_stage.peak_rss_mb)
+			for key, n in other_stage.counts.items():
+				stage.counts[key] += n
+			for chromosome, n in other_stage.per_chromosome.items():
+				stage.per_chromosome[chromosome] += n
+
+	def to_dict(self):
+		return {name: stage.to_dict() for name, stage in self.stages.items()}
+
+	def write_json(self, path, **extra):
+		with open(path, 'w') as f:
+			json.dump(dict(extra, stages=self.to_dict()), f, indent=1)
+
+
+class NullMetrics:
+	"""Stand-in for Metrics when instrumentation is disabled"""
+
+	_context = nullcontext()
+
+	def stage(self, name):
+		return self._context
+
+	def count(self, name, key, n=1, chromosome=None):
+		pass
+
+	def merge(self, other):
+		pass
+
+
+NULL_METRICS = NullMetrics()
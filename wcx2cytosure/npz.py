@@ -0,0 +1,162 @@
+"""
+WisecondorX results read from a .npz archive instead of bins.bed and
+aberrations.bed
+
+The archive holds the arrays that WisecondorX predict writes its BED files
+from, so neither side formats or parses any text:
+
+	binsize -- bin size in bp
+	results_r -- the log2 ratio of every bin, chromosome after chromosome in
+		the order of WisecondorX (1-22, X, Y); 0 where it has no ratio
+	chromosome_bins -- the number of bins of each chromosome in results_r
+	aberration_chr, aberration_start, aberration_end, aberration_ratio,
+	aberration_zscore, aberration_type -- the calls, as in aberrations.bed
+
+Bins come out as WisecondorX writes them to bins.bed: 1-based starts, ends at
+a multiple of binsize, and no ratio (NaN) where the ratio is 0. Members of
+an uncompressed archive (np.savez, write_npz) are memory-mapped rather than
+read, so only the ratios of the bins that are kept are copied.
+"""
+
+import logging
+import struct
+import zipfile
+
+import numpy as np
+
+from .contigs import canonical_name, contig_registry
+from .metrics import NULL_METRICS
+
+logger = logging.getLogger(__name__)
+
+# The local file header of a zip member, before its name and extra field
+LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+ABERRATION_COLUMNS = ['chr', 'start', 'end', 'ratio', 'zscore', 'type']
+
+
+def wisecondorx_name(index):
+	"""The name of the chromosome at index (0-based) in the results of WisecondorX: 1-22, then X and Y as 23 and 24"""
+	return str(index + 1)
+
+
+def member_offset(f, info):
+	"""Return the offset of the data of a stored (uncompressed) zip member in the archive file f"""
+	f.seek(info.header_offset)
+	fields = LOCAL_HEADER.unpack(f.read(LOCAL_HEADER.size))
+	name_length, extra_length = fields[-2:]
+	return info.header_offset + LOCAL_HEADER.size + name_length + extra_length
+
+
+def map_array(path, f, info):
+	"""Memory-map the .npy member info of the archive at path, or return None if it cannot be mapped"""
+	if info.compress_type != zipfile.ZIP_STORED:
+		return None
+	f.seek(member_offset(f, info))
+	version = np.lib.format.read_magic(f)
+	if version == (1, 0):
+		shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+	else:
+		shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+	if dtype.hasobject or not shape or 0 in shape:
+		return None
+	return np.memmap(path, dtype=dtype, mode='r', offset=f.tell(), shape=shape, order='F' if fortran_order else 'C')
+
+
+def load_arrays(path, mmap=True):
+	"""
+	Return the arrays of a .npz archive by name. With mmap, the members that
+	are stored uncompressed are memory-mapped instead of read.
+	"""
+	arrays = {}
+	with zipfile.ZipFile(path) as archive, open(path, 'rb') as f, np.load(path, allow_pickle=False) as npz:
+		for info in archive.infolist():
+			name = info.filename[:-len('.npy')] if info.filename.endswith('.npy') else info.filename
+			array = map_array(path, f, info) if mmap else None
+			if mmap and array is None and info.compress_type != zipfile.ZIP_STORED:
+				logger.debug('%s in %s is compressed and is read into memory', name, path)
+			arrays[name] = npz[name] if array is None else array
+	return arrays
+
+
+def write_npz(path, binsize, ratios, aberrations, compress=False):
+	"""
+	Write WisecondorX results to a .npz archive in the layout above.
+
+	ratios -- the ratio arrays of the chromosomes in the order of WisecondorX,
+		such as its results_r; 0 or NaN where there is no ratio
+	aberrations -- the columns of aberrations.bed by name (ABERRATION_COLUMNS),
+		such as a DataFrame
+	compress -- a smaller file, but the arrays cannot be memory-mapped
+	"""
+	arrays = {
+		'binsize': np.int64(binsize),
+		'results_r': np.nan_to_num(np.concatenate([np.asarray(r, dtype=np.float64) for r in ratios]), nan=0.0),
+		'chromosome_bins': np.array([len(r) for r in ratios], dtype=np.int64),
+	}
+	for column in ABERRATION_COLUMNS:
+		arrays['aberration_' + column] = np.asarray(aberrations[column]).astype(
+			str if column in ('chr', 'type') else np.float64 if column in ('ratio', 'zscore') else np.int64)
+	(np.savez_compressed if compress else np.savez)(path, **arrays)
+
+
+def read_aberrations(path, regions=None):
+	"""
+	Return the columns of the calls in the archive at path, as read_columns()
+	returns them from aberrations.bed, without the rows outside regions
+	"""
+	import pandas as pd
+	from .inputs import in_regions
+
+	arrays = load_arrays(path)
+	df = pd.DataFrame({column: np.asarray(arrays['aberration_' + column]) for column in ABERRATION_COLUMNS})
+	df['chr'] = df['chr'].astype(str)
+	if regions:
+		df = df[in_regions(df, regions)].reset_index(drop=True)
+	return df
+
+
+def read_coverages(path, CONTIG_LENGTHS, regions=None, metrics=NULL_METRICS):
+	"""
+	Return the bins in the archive at path as filter_coverages() returns
+	them from bins.bed: a DataFrame with the columns chr (canonical names),
+	start, end and ratio, without the bins that have no ratio, are on contigs
+	that are not in CONTIG_LENGTHS or are outside regions.
+	"""
+	import pandas as pd
+	from .intervals import IntervalIndex
+
+	contigs = contig_registry(CONTIG_LENGTHS)
+	arrays = load_arrays(path)
+	binsize = int(arrays['binsize'])
+	ratios = arrays['results_r']
+	bounds = np.concatenate(([0], np.cumsum(arrays['chromosome_bins'])))
+	index = IntervalIndex.from_regions(regions) if regions else None
+
+	columns = {column: [] for column in ('chr', 'start', 'end', 'ratio')}
+	n_read = without_ratio = other_contig = 0
+	for i, (first, last) in enumerate(zip(bounds[:-1].tolist(), bounds[1:].tolist())):
+		code = contigs.code(wisecondorx_name(i))
+		chrom = contigs.names[code] if code >= 0 else canonical_name(wisecondorx_name(i))
+		r = ratios[first:last]
+		bins = np.arange(len(r), dtype=np.int64)
+		if index is not None:
+			bins = bins[index.mask(chrom, bins * binsize + 1, (bins + 1) * binsize)]
+			r = r[bins]
+		has_ratio = (r != 0) & ~np.isnan(r)
+		n_read += len(r)
+		without_ratio += len(r) - int(has_ratio.sum())
+		if code < 0:
+			other_contig += int(has_ratio.sum())
+			continue
+		bins = bins[has_ratio]
+		columns['chr'].append(np.full(len(bins), chrom, dtype=object))
+		columns['start'].append(bins * binsize + 1)
+		columns['end'].append((bins + 1) * binsize)
+		columns['ratio'].append(np.asarray(r[has_ratio], dtype=np.float64))
+
+	metrics.count('read_bins', 'rows_read', n_read)
+	metrics.count('read_bins', 'rows_without_ratio', without_ratio)
+	metrics.count('read_bins', 'rows_filtered_contig', other_contig)
+	dtypes = {'chr': object, 'start': np.int64, 'end': np.int64, 'ratio': np.float64}
+	return pd.DataFrame({column: np.concatenate(values) if values else np.empty(0, dtype=dtypes[column])
+		for column, values in columns.items()})
@@ -0,0 +1,186 @@
+"""
+Streaming reader of CGH documents
+
+The document is parsed with iterparse and every element is cleared once it
+has been read, so the parse tree does not grow with the document. The probes,
+segments and aberrations come out as columns: dicts of NumPy arrays. Reading
+them in chunks (read_chunks) or one chromosome at a time (read_chromosomes)
+holds only that much; read_cgh holds the columns of the whole document, some
+60 bytes per probe.
+"""
+
+from operator import itemgetter
+
+from lxml import etree
+import numpy as np
+
+READ_CHUNKSIZE = 100000
+
+PROBE_COLUMNS = {
+	'name': str,
+	'chromosome': str,
+	'start': np.int64,
+	'stop': np.int64,
+	'normalized': np.float64,
+	'green': np.float64,
+	'original_coverage': np.float64,
+}
+SEGMENT_COLUMNS = {
+	'chrId': str,
+	'start': np.int64,
+	'stop': np.int64,
+	'average': np.float64,
+	'zscore': np.float64,
+}
+ABERRATION_COLUMNS = {
+	'chr': str,
+	'start': np.int64,
+	'stop': np.int64,
+	'gain': str,
+	'zscore': np.float64,
+	'confirmation': str,
+}
+
+
+def iterate_elements(source, tags):
+	"""
+	Yield the elements with the given tags from a CGH file (a path or a
+	binary file object) as they are completed. Each element is cleared, and
+	removed from its parent, as soon as the next one is requested.
+	"""
+	for _, element in etree.iterparse(source, events=('end',), tag=tags, huge_tree=True):
+		yield element
+		element.clear()
+		parent = element.getparent()
+		while element.getprevious() is not None:
+			del parent[0]
+
+
+probe_position = itemgetter('name', 'chromosome', 'start', 'stop', 'normalized')
+
+
+def probe_record(probe):
+	attrib = probe.attrib
+	green = probe[0].get('green', 'nan') if len(probe) else 'nan'
+	return (*probe_position(attrib), green, attrib.get('original_coverage', 'nan'))
+
+
+def segment_record(segment):
+	return tuple(segment.get(column, 'nan') for column in SEGMENT_COLUMNS)
+
+
+def aberration_record(aberration):
+	return (
+		aberration.get('chr'),
+		aberration.get('start'),
+		aberration.get('stop'),
+		aberration.get('gain'),
+		aberration.get('zscore', 'nan'),
+		aberration.findtext('confirmation', ''),
+	)
+
+
+RECORDS = {
+	'probe': (probe_record, PROBE_COLUMNS),
+	'segment': (segment_record, SEGMENT_COLUMNS),
+	'aberration': (aberration_record, ABERRATION_COLUMNS),
+}
+# The column holding the chromosome of each kind of record
+CHROMOSOME_COLUMNS = {
+	'probe': 'chromosome',
+	'segment': 'chrId',
+	'aberration': 'chr',
+}
+
+
+def to_columns(records, columns):
+	"""Turn a list of string tuples into a dict of arrays with the types in columns"""
+	values = zip(*records) if records else [()] * len(columns)
+	return {column: np.array(value, dtype=str).astype(dtype) for (column, dtype), value in zip(columns.items(), values)}
+
+
+def read_chunks(source, tags=('probe', 'segment', 'aberration'), chunksize=READ_CHUNKSIZE):
+	"""
+	Read a CGH file in one pass and yield (tag, columns) for runs of at most
+	chunksize elements of the same tag, in document order.
+	"""
+	tag = None
+	records = []
+	for element in iterate_elements(source, tags):
+		if element.tag != tag or len(records) >= chunksize:
+			if records:
+				yield tag, to_columns(records, RECORDS[tag][1])
+			tag = element.tag
+			records = []
+		records.append(RECORDS[tag][0](element))
+	if records:
+		yield tag, to_columns(records, RECORDS[tag][1])
+
+
+def read_chromosomes(source, tags=('probe', 'segment', 'aberration'), chunksize=READ_CHUNKSIZE):
+	"""
+	Read a CGH file in one pass and yield (tag, chromosome, columns) for each
+	run of consecutive elements with the same tag and chromosome
+	"""
+	run = None
+	pieces = []
+	for tag, columns in read_chunks(source, tags, chunksize):
+		chromosomes = columns[CHROMOSOME_COLUMNS[tag]]
+		bounds = [0, *(np.flatnonzero(chromosomes[1:] != chromosomes[:-1]) + 1).tolist(), len(chromosomes)]
+		for first, last in zip(bounds[:-1], bounds[1:]):
+			key = (tag, str(chromosomes[first]))
+			if key != run:
+				if pieces:
+					yield (*run, concatenate(pieces, RECORDS[run[0]][1]))
+				run = key
+				pieces = []
+			pieces.append({column: values[first:last] for column, values in columns.items()})
+	if pieces:
+		yield (*run, concatenate(pieces, RECORDS[run[0]][1]))
+
+
+def read_header(source):
+	"""
+	Return the elements of a CGH file before its probes, other than the
+	aberrations, as a list of (path, attributes, text), where path holds the
+	tags from the root down, such as 'data/cgh/submission/sample'
+	"""
+	header = []
+	texts = {}
+	for event, element in etree.iterparse(source, events=('start', 'end'), huge_tree=True):
+		if element.tag == 'probes':
+			break
+		if element.tag == 'aberration' or any(True for _ in element.iterancestors('aberration')):
+			continue
+		if event == 'start':
+			# the attributes are complete at the start, the text only at the end
+			path = '/'.join([ancestor.tag for ancestor in reversed(list(element.iterancestors()))] + [element.tag])
+			texts[element] = len(header)
+			header.append((path, dict(element.attrib), ''))
+		else:
+			i = texts.pop(element)
+			header[i] = (*header[i][:2], (element.text or '').strip())
+	return header
+
+
+def read_probes(source, chunksize=READ_CHUNKSIZE):
+	"""Yield the probes of a CGH file as columns (see PROBE_COLUMNS) of at most chunksize rows"""
+	for _, columns in read_chunks(source, ('probe',), chunksize):
+		yield columns
+
+
+def read_cgh(source):
+	"""
+	Read the probes, segments and aberrations of a CGH file. Return a dict
+	with the columns of each, by tag.
+	"""
+	chunks = {tag: [] for tag in RECORDS}
+	for tag, columns in read_chunks(source):
+		chunks[tag].append(columns)
+	return {tag: concatenate(tag_chunks, RECORDS[tag][1]) for tag, tag_chunks in chunks.items()}
+
+
+def concatenate(chunks, columns):
+	if not chunks:
+		return to_columns([], columns)
+	return {column: np.concatenate([chunk[column] for chunk in chunks]) for column in columns}
@@ -0,0 +1,289 @@
+"""
+Conversion service: a pool of warm worker processes taking jobs over HTTP,
+on localhost or on a Unix socket
+
+	POST /convert  {"wisecondorx_aberrations": ..., "wisecondorx_cov": ..., "out": ..., <options>}
+	GET /metrics   queue depth and job counts
+	GET /health
+
+Jobs carry the same options as the command line, by their argparse names.
+The response holds the output path, the numbers of items written and the
+stage metrics of the conversion.
+"""
+
+import argparse
+import http.client
+import importlib
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import wcx2cytosure
+from .metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8765
+DEFAULT_TIMEOUT = 600
+# A job runs in one worker of the service, so it does not start processes of its own
+JOB_OPTIONS = frozenset(vars(wcx2cytosure.default_args())) - {'metrics_json', 'profile', 'workers', 'pipeline'}
+
+
+class JobTimeout(Exception):
+	pass
+
+
+def _raise_timeout(signum, frame):
+	raise JobTimeout()
+
+
+def _interrupt(signum, frame):
+	raise KeyboardInterrupt()
+
+
+def warm_up():
+	"""Import what a conversion needs once per worker process rather than per job"""
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	for module in ('numpy', 'pandas', 'lxml.etree', 'wcx2cytosure.inputs', 'wcx2cytosure.intervals'):
+		importlib.import_module(module)
+	from . import cgh
+	from .constants import CGH_TEMPLATE_37, CGH_TEMPLATE_38
+	cgh.skeleton(CGH_TEMPLATE_37)
+	cgh.skeleton(CGH_TEMPLATE_38)
+
+
+def convert_job(options, timeout=None):
+	"""
+	Convert one sample in a worker process. The conversion is interrupted
+	after timeout seconds. The output only replaces the file at out if the
+	conversion succeeds (see replace_on_success). Errors are reported in the
+	returned response instead of being raised.
+	"""
+	started = time.perf_counter()
+	metrics = Metrics()
+	args = wcx2cytosure.default_args(**options)
+	response = {'sample': None, 'out': args.out}
+	try:
+		if timeout:
+			signal.signal(signal.SIGALRM, _raise_timeout)
+			signal.setitimer(signal.ITIMER_REAL, timeout)
+		result = wcx2cytosure.run(args, metrics)
+	except JobTimeout:
+		response.update(status='timeout', error=f'Conversion took longer than {timeout} s')
+	except Exception as e:
+		response.update(status='failed', error=f'{type(e).__name__}: {e}')
+	else:
+		response.update(result, status='ok')
+	finally:
+		if timeout:
+			signal.setitimer(signal.ITIMER_REAL, 0)
+	response['seconds'] = round(time.perf_counter() - started, 3)
+	response['metrics'] = metrics.to_dict()
+	return response
+
+
+class ConversionService:
+	"""
+	Run jobs in a pool of worker processes, at most one per worker at a time.
+	Jobs wait in a queue of at most max_queue for a free worker; beyond that
+	they are rejected. If a worker process dies, its job fails and the pool
+	is started anew for the next jobs.
+	"""
+
+	def __init__(self, workers=1, max_queue=100, timeout=DEFAULT_TIMEOUT):
+		self.workers = workers
+		self.max_queue = max_queue
+		self.timeout = timeout
+		self.executor = ProcessPoolExecutor(max_workers=workers, initializer=warm_up)
+		self.slots = threading.BoundedSemaphore(workers)
+		self.lock = threading.Lock()
+		self.waiting = 0
+		self.running = 0
+		self.counts = Counter()
+		self.started = time.time()
+
+	def submit(self, options):
+		"""Run a job and return its response, or None if the queue is full"""
+		with self.lock:
+			if self.waiting >= self.max_queue:
+				self.counts['rejected'] += 1
+				return None
+			self.waiting += 1
+		self.slots.acquire()
+		with self.lock:
+			self.waiting -= 1
+			self.running += 1
+		executor = self.executor
+		try:
+			response = executor.submit(convert_job, options, self.timeout).result()
+		except BrokenProcessPool as e:
+			response = {'sample': None, 'out': options.get('out'), 'status': 'failed',
+				'error': f'{type(e).__name__}: {e}'}
+			self.restart(executor)
+		finally:
+			self.slots.release()
+			with self.lock:
+				self.running -= 1
+		with self.lock:
+			self.counts[response['status']] += 1
+		return response
+
+	def restart(self, broken):
+		"""Replace the pool broken by a dead worker, unless another job already did"""
+		with self.lock:
+			if self.executor is not broken:
+				return
+			logger.error('A worker process died; starting a new pool')
+			self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_up)
+		broken.shutdown(wait=False)
+
+	def metrics(self):
+		with self.lock:
+			return dict(self.counts, queue_depth=self.waiting, running=self.running, workers=self.workers,
+				max_queue=self.max_queue, uptime_seconds=round(time.time() - self.started, 1))
+
+	def shutdown(self):
+		self.executor.shutdown(wait=True)
+
+
+STATUS_CODES = {'ok': 200, 'failed': 500, 'timeout': 504}
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+	server_version = 'wcx2cytosure/' + wcx2cytosure.__version__
+
+	def do_GET(self):
+		if self.path == '/metrics':
+			self.send_json(200, self.server.service.metrics())
+		elif self.path == '/health':
+			self.send_json(200, {'status': 'ok'})
+		else:
+			self.send_json(404, {'error': f'Unknown path {self.path}'})
+
+	def do_POST(self):
+		if self.path != '/convert':
+			self.send_json(404, {'error': f'Unknown path {self.path}'})
+			return
+		try:
+			options = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+			if not isinstance(options, dict) or not options.get('wisecondorx_aberrations'):
+				raise ValueError('A job is a JSON object with at least wisecondorx_aberrations')
+			unknown = set(options) - JOB_OPTIONS
+			if unknown:
+				raise ValueError('Unknown options: ' + ', '.join(sorted(unknown)))
+		except ValueError as e:
+			self.send_json(400, {'error': str(e)})
+			return
+		response = self.server.service.submit(options)
+		if response is None:
+			self.send_json(503, {'error': 'The job queue is full'})
+		else:
+			self.send_json(STATUS_CODES[response['status']], response)
+
+	def send_json(self, code, body):
+		data = json.dumps(body).encode()
+		self.send_response(code)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def address_string(self):
+		# Unix socket clients have no address
+		return self.client_address[0] if self.client_address else 'unix'
+
+	def log_message(self, format, *args):
+		logger.debug('%s %s', self.address_string(), format % args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+
+
+def make_server(service, address):
+	"""
+	Create the HTTP server for address: a path for a Unix socket (anything
+	with a '/'), or host:port
+	"""
+	if '/' in address:
+		if os.path.exists(address):
+			os.remove(address)
+		server = UnixHTTPServer(address, RequestHandler)
+	else:
+		host, _, port = address.rpartition(':')
+		server = ThreadingHTTPServer((host or '127.0.0.1', int(port)), RequestHandler)
+		server.daemon_threads = True
+	server.service = service
+	return server
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+	def __init__(self, path, timeout=None):
+		super().__init__('localhost', timeout=timeout)
+		self.path = path
+
+	def connect(self):
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.sock.settimeout(self.timeout)
+		self.sock.connect(self.path)
+
+
+def request(address, method, path, body=None, timeout=None):
+	"""Send a request to a service at address (as for make_server); return the status code and the JSON body"""
+	if '/' in address:
+		connection = UnixHTTPConnection(address, timeout=timeout)
+	else:
+		host, _, port = address.rpartition(':')
+		connection = http.client.HTTPConnection(host or '127.0.0.1', int(port), timeout=timeout)
+	try:
+		data = json.dumps(body).encode() if body is not None else None
+		connection.request(method, path, body=data, headers={'Content-Type': 'application/json'})
+		reply = connection.getresponse()
+		return reply.status, json.loads(reply.read())
+	finally:
+		connection.close()
+
+
+def main(argv=None):
+	logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+	parser = argparse.ArgumentParser("wcx2cytosure serve - convert samples sent over HTTP with warm worker processes")
+	listen = parser.add_mutually_exclusive_group()
+	listen.add_argument('--port', type=int, default=DEFAULT_PORT, help='localhost port to listen on (default: %(default)s)')
+	listen.add_argument('--socket', metavar='PATH', help='Unix socket to listen on instead of a port')
+	parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes (default: all CPUs)')
+	parser.add_argument('--max-queue', type=int, default=100,
+		help='jobs that may wait for a worker; more are rejected with 503 (default: %(default)s)')
+	parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+		help='seconds after which a conversion is stopped (default: %(default)s)')
+	args = parser.parse_args(argv)
+
+	address = args.socket or f'127.0.0.1:{args.port}'
+	service = ConversionService(args.workers, args.max_queue, args.timeout)
+	server = make_server(service, address)
+	logger.info('Listening on %s with %d workers', address, args.workers)
+	signal.signal(signal.SIGTERM, _interrupt)
+	signal.signal(signal.SIGINT, _interrupt)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		service.shutdown()
+		if args.socket and os.path.exists(args.socket):
+			os.remove(args.socket)
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
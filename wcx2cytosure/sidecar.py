@@ -0,0 +1,94 @@
+"""
+Sidecar file with the serialized coverage probes of a conversion
+
+Re-exporting a sample with other aberrations or another --wcx_size leaves the
+coverage probes unchanged. They are kept next to the output as one block of
+serialized probes per chromosome, followed by a JSON trailer with the key
+of the inputs and options they were made from, the offset, length and
+probe count of each block, the sex inferred from the TIDDIT coverage and
+the merged intervals covered by bins, for --drop-covered-event-probes.
+The last 8 bytes hold the length of the trailer.
+"""
+
+import json
+import logging
+import os
+import struct
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+SIDECAR_VERSION = 2
+TRAILER_LENGTH = struct.Struct('<Q')
+
+
+class CoverageSidecar:
+	"""Read or write the coverage sidecar at path for the inputs identified by key"""
+
+	def __init__(self, path, key):
+		self.path = path
+		self.key = key
+		self.meta = None
+		self._file = None
+		self._blocks = {}
+
+	def load(self):
+		"""Return the stored metadata if the sidecar exists and matches the key, or None"""
+		try:
+			with open(self.path, 'rb') as f:
+				f.seek(-TRAILER_LENGTH.size, os.SEEK_END)
+				length, = TRAILER_LENGTH.unpack(f.read(TRAILER_LENGTH.size))
+				f.seek(-TRAILER_LENGTH.size - length, os.SEEK_END)
+				meta = json.loads(f.read(length))
+		except (OSError, ValueError, struct.error) as e:
+			logger.debug('No usable coverage sidecar %s: %s', self.path, e)
+			return None
+		if meta.get('version') != SIDECAR_VERSION or meta.get('key') != self.key:
+			logger.debug('Coverage sidecar %s is for other inputs', self.path)
+			return None
+		self.meta = meta
+		return meta
+
+	def read_block(self, chromosome):
+		"""Return the serialized probes of a chromosome and their number"""
+		offset, length, n = self.meta['blocks'].get(chromosome, (0, 0, 0))
+		if not length:
+			return b'', n
+		with open(self.path, 'rb') as f:
+			f.seek(offset)
+			return f.read(length), n
+
+	def _open(self):
+		if self._file is None:
+			self._file = tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(self.path)),
+				prefix='.' + os.path.basename(self.path), delete=False)
+		return self._file
+
+	def add_block(self, chromosome, data, n):
+		"""Append the serialized probes of a chromosome to a new sidecar"""
+		f = self._open()
+		self._blocks[chromosome] = (f.tell(), len(data), n)
+		f.write(data)
+
+	def commit(self, **meta):
+		"""Write the trailer with meta and replace the sidecar with the new one"""
+		f = self._open()
+		trailer = json.dumps(dict(meta, version=SIDECAR_VERSION, key=self.key, blocks=self._blocks)).encode()
+		try:
+			f.write(trailer)
+			f.write(TRAILER_LENGTH.pack(len(trailer)))
+			f.close()
+			os.replace(f.name, self.path)
+		except OSError as e:
+			logger.warning('Could not write the coverage sidecar %s: %s', self.path, e)
+			self.discard()
+		self._file = None
+
+	def discard(self):
+		if self._file is not None:
+			self._file.close()
+			try:
+				os.unlink(self._file.name)
+			except OSError:
+				pass
+			self._file = None
@@ -0,0 +1,82 @@
+"""
+Reading of small tab-separated inputs with the standard library only
+
+The aberrations.bed file from WisecondorX has a few rows at most, so it is
+read without pandas to keep the start-up of the command line tool short.
+"""
+
+import csv
+import gzip
+import re
+
+from .contigs import canonical_name
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZIP_MAGIC = b'PK\x03\x04'
+REGION_PATTERN = re.compile(r'^([^:]+)(?::(\d+)-(\d+))?$')
+
+
+def parse_regions(text):
+	"""
+	Parse a comma-separated list of regions such as "1,2:1000000-2000000,X".
+	Coordinates are 1-based and inclusive, as in samtools/tabix. Chromosomes
+	may be named in any convention ("1", "chr1"; see contigs.py).
+
+	Return a list of (chrom, start, end) with a 0-based half-open start/end, or
+	None for both if the whole contig was given. Return None for no regions.
+	"""
+	if not text:
+		return None
+	regions = []
+	for region in re.split(r'[,\s]+', text.strip()):
+		match = REGION_PATTERN.match(region)
+		if not match:
+			raise ValueError(f'Invalid region: {region}')
+		chrom, start, end = match.groups()
+		chrom = canonical_name(chrom) or chrom
+		if start is None:
+			regions.append((chrom, None, None))
+		else:
+			regions.append((chrom, int(start) - 1, int(end)))
+	return regions
+
+
+def is_gzipped(path):
+	with open(path, 'rb') as f:
+		return f.read(2) == GZIP_MAGIC
+
+
+def is_npz(path):
+	"""Whether path is a .npz (zip) archive, such as the results of WisecondorX (see npz.py)"""
+	with open(path, 'rb') as f:
+		return f.read(4) == ZIP_MAGIC
+
+
+def open_text(path):
+	"""Open a plain or gzip/bgzip compressed text file for reading"""
+	if is_gzipped(path):
+		return gzip.open(path, 'rt', newline='')
+	return open(path, newline='')
+
+
+def overlaps(chrom, start, end, regions):
+	chrom = canonical_name(chrom) or chrom
+	for region_chrom, region_start, region_end in regions:
+		if chrom == region_chrom and (region_start is None or (end > region_start and start < region_end)):
+			return True
+	return False
+
+
+def read_columns(path, regions=None):
+	"""
+	Read a tab-separated table with a header line into a dict of column name
+	to list of strings. With regions (see parse_regions), only the rows whose
+	chrom, start and end in the first three columns overlap them are kept.
+	"""
+	with open_text(path) as f:
+		reader = csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE)
+		header = next(reader, [])
+		rows = [row for row in reader if row]
+	if regions:
+		rows = [row for row in rows if overlaps(row[0], int(row[1]), int(row[2]), regions)]
+	return {name: [row[i] for row in rows] for i, name in enumerate(header)}
@@ -4,15 +4,21 @@ Convert structural variants in a WCX output to CGH (CytoSure) format
 """
 
 import argparse
-import pandas as pd
+import importlib
 import logging
+import math
 import os
-from collections import namedtuple, defaultdict
-from io import StringIO
-from lxml import etree
-import numpy as np
+import sys
+import time
+from collections import deque, namedtuple, defaultdict
+from contextlib import contextmanager
 
+# numpy, pandas and lxml are imported by the functions that use them, so that
+# the command line tool starts quickly (see test_cli_startup_is_light).
 from .constants import *
+from .contigs import BUILDS, canonical_names, contig_registry, load_contigs
+from .metrics import Metrics, NULL_METRICS
+from .tsv import is_npz, parse_regions, read_columns
 
 from .__version__ import __version__
 
@@ -20,69 +26,221 @@ logger = logging.getLogger(__name__)
 
 Event = namedtuple('Event', ['chrom', 'start', 'end', 'type', 'zscore', 'info'])
 
-def wisecondorx_events(args, CONTIG_LENGTHS):
 
-	variants  = pd.read_csv(args.wisecondorx_aberrations, sep="\t", header = 0)
-	skipped = 0
-	
-	for _, variant in variants.iterrows():
-		chrom = str(variant["chr"])
-		if (chrom) not in CONTIG_LENGTHS:
-			continue
+def input_cache(args):
+	"""
+	Return the ParsedCache selected by --cache-dir (or the WCX2CYTOSURE_CACHE_DIR
+	environment variable), or None if caching is off.
+	"""
+	directory = args.cache_dir or os.environ.get('WCX2CYTOSURE_CACHE_DIR')
+	if args.no_cache or not directory:
+		return None
+	from .cache import ParsedCache
+	return ParsedCache(directory, max_bytes=args.cache_max_size * 1024 ** 3, max_age_days=args.cache_max_age)
+
+
+ABERRATION_DTYPES = {
+	'chr': str,
+	'start': 'int64',
+	'end': 'int64',
+	'type': str,
+	'zscore': 'float64',
+}
+
+
+def wisecondorx_events(args, CONTIG_LENGTHS, metrics=NULL_METRICS):
+	"""
+	Read the aberrations.bed file, or the .npz results (see npz.py), from
+	WisecondorX and yield its calls as Events (see aberration_events).
+	"""
+	columns = read_aberrations(args.wisecondorx_aberrations, regions=parse_regions(args.regions))
+	return aberration_events(columns, CONTIG_LENGTHS, args.wcx_size, metrics)
+
+
+def read_aberrations(path, regions=None):
+	"""Return the columns of the calls in aberrations.bed, or in the .npz results of WisecondorX"""
+	if is_npz(path):
+		from .npz import read_aberrations
+		return read_aberrations(path, regions)
+	return read_columns(path, regions=regions)
+
+
+def aberration_events(columns, CONTIG_LENGTHS, wcx_size=None, metrics=NULL_METRICS):
+	"""
+	Yield the WisecondorX calls as Events of type DEL (loss) or DUP (gain),
+	with the canonical contig name (see contigs.py). Calls on contigs that are
+	not in CONTIG_LENGTHS, and with wcx_size calls no longer than it, are
+	dropped.
+
+	columns -- the columns of aberrations.bed (see ABERRATION_DTYPES) by name,
+		such as from read_columns() or a DataFrame
+	"""
+	import numpy as np
+
+	contigs = contig_registry(CONTIG_LENGTHS)
+	codes = contigs.encode(columns["chr"])
+	chrom = np.array(columns["chr"], dtype=object)
+	start = np.array(columns["start"], dtype=np.int64)
+	end = np.array(columns["end"], dtype=np.int64)
+	sv_type = np.array(columns["type"], dtype=object)
+	zscore = np.array(columns["zscore"], dtype=np.float64)
+
+	sv_type[sv_type == 'loss'] = 'DEL'
+	sv_type[sv_type == 'gain'] = 'DUP'
+	on_contig = codes >= 0
+	too_short = on_contig & (end - start <= wcx_size) if wcx_size else np.zeros(len(chrom), dtype=bool)
+	keep = on_contig & ~too_short
+
+	metrics.count('read_aberrations', 'rows_read', len(chrom))
+	metrics.count('read_aberrations', 'rows_filtered_contig', int((~on_contig).sum()))
+	metrics.count('read_aberrations', 'rows_filtered_size', int(too_short.sum()))
+	if too_short.any():
+		logger.info('skipped %d variants for being too short', too_short.sum())
+	if logger.isEnabledFor(logging.DEBUG):
+		for i in np.flatnonzero(too_short):
+			logger.debug('skipped %s at %s:%s-%s for being too short (%s bp)', sv_type[i], chrom[i], start[i] + 1, end[i],
+				end[i] - start[i])
+		for i in np.flatnonzero(keep):
+			logger.debug('%s at %s:%s-%s (%s bp)', sv_type[i], chrom[i], start[i] + 1, end[i], end[i] - start[i])
+
+	for values in zip(contigs.decode(codes[keep]).tolist(), start[keep].tolist(), end[keep].tolist(), sv_type[keep].tolist(),
+			zscore[keep].tolist()):
+		yield Event(*values, info={})
+
+
+TIDDIT_DTYPES = {
+	'#CHR': str,
+	'start': 'int64',
+	'end': 'int64',
+	'coverage': 'float64',
+	'quality': 'float64',
+}
+
+
+class TidditCoverage:
+	"""
+	Summary of a TIDDIT coverage table: per-chromosome coverage sums and bin
+	counts over the bins passing the quality filter, and the bins on Y as
+	arrays (start, end and coverage relative to the autosome mean).
+	"""
+
+	def __init__(self, sums, counts, y_start, y_end, y_coverage):
+		self.sums = sums
+		self.counts = counts
+		self.y_start = y_start
+		self.y_end = y_end
+		self.y_coverage = y_coverage
+
+	def mean(self, chromosomes):
+		total = sum(self.sums.get(chrom, 0.0) for chrom in chromosomes)
+		n = sum(self.counts.get(chrom, 0) for chrom in chromosomes)
+		return total / n if n else float('nan')
+
+	@property
+	def autosomes_mean(self):
+		return self.mean(AUTOSOMES)
+
+	@property
+	def x_mean(self):
+		return self.mean(['X'])
+
+	@property
+	def y_mean(self):
+		return self.mean(['Y'])
+
+	def y_log2_ratios(self):
+		"""
+		The log2 ratio of the coverage of every Y bin to the coverage expected
+		in a male (MALE_Y_DOSAGE), so that a normal male is near 0 as in the
+		WisecondorX ratios. Bins without coverage get -inf.
+		"""
+		import numpy as np
+
+		with np.errstate(divide='ignore'):
+			return np.log2(np.asarray(self.y_coverage, dtype=np.float64) / MALE_Y_DOSAGE)
+
+	def is_male(self):
+		"""
+		Infer the sex from the Y coverage relative to the autosomes. Return
+		None if there are no usable bins to decide from.
+		"""
+		autosomes_mean = self.autosomes_mean
+		if not autosomes_mean > 0:
+			return None
+		ratio = self.y_mean / autosomes_mean
+		if math.isnan(ratio):
+			return None
+		return bool(ratio >= MALE_Y_COVERAGE_RATIO)
+
+
+def parse_tiddit_coverage(args, chunksize=TIDDIT_CHUNKSIZE, metrics=NULL_METRICS):
+	"""
+	Read the TIDDIT coverage table in chunks of chunksize rows so that memory
+	use is bounded, and summarize it in one pass into a TidditCoverage.
+
+	The whole table is read even with args.regions: the autosome mean that
+	the Y coverage is scaled by, and the sex inference, do not depend on the
+	regions. Only the Y bins are restricted to them.
+	"""
+	from .inputs import read_table
+
+	regions = parse_regions(args.regions)
+	reader = read_table(args.tiddit_cov, usecols=list(TIDDIT_DTYPES), dtype=TIDDIT_DTYPES,
+		contigs=AUTOSOMES + ["X", "Y"], chunksize=chunksize, cache=input_cache(args))
+	return summarize_tiddit_coverage(reader, regions, metrics)
+
+
+def summarize_tiddit_coverage(chunks, regions=None, metrics=NULL_METRICS):
+	"""
+	Summarize DataFrames with the TIDDIT_DTYPES columns into a TidditCoverage.
+	With regions, the Y bins are restricted to them.
+	"""
+	import pandas as pd
+	from .inputs import in_regions
+
+	sums = defaultdict(float)
+	counts = defaultdict(int)
+	y_bins = [pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in TIDDIT_DTYPES.items()})]
+
+	for chunk in chunks:
+		metrics.count('read_tiddit', 'rows_read', len(chunk))
+		passed = ~(chunk["quality"].to_numpy() < TIDDIT_MIN_QUALITY)
+		metrics.count('read_tiddit', 'rows_filtered_quality', len(chunk) - int(passed.sum()))
+		chunk = chunk[passed]
+		chroms = canonical_names(chunk["#CHR"])
+		stats = chunk["coverage"].groupby(chroms, sort=False).agg(['sum', 'count'])
+		for chrom, total, n in zip(stats.index, stats['sum'].tolist(), stats['count'].tolist()):
+			sums[chrom] += total
+			counts[chrom] += n
+		y_chunk = chunk[chroms == "Y"]
+		if regions:
+			y_chunk = y_chunk[in_regions(y_chunk, regions)]
+		y_bins.append(y_chunk)
+
+	y_bins = pd.concat(y_bins)
+	coverage = TidditCoverage(dict(sums), dict(counts), y_bins["start"].to_numpy(), y_bins["end"].to_numpy(), None)
+	if not coverage.autosomes_mean > 0:
+		# nothing to scale the Y coverage by
+		if len(y_bins):
+			logger.warning('The TIDDIT coverage has no autosome coverage; no probes are made on Y')
+		y_bins = y_bins.iloc[:0]
+		coverage.y_start, coverage.y_end = y_bins["start"].to_numpy(), y_bins["end"].to_numpy()
+	coverage.y_coverage = y_bins["coverage"].to_numpy() / coverage.autosomes_mean
+
+	return coverage
+
+
+def new_element(parent, tag):
+	"""Create a child of parent, or a standalone element if parent is None"""
+	from lxml import etree
+	if parent is None:
+		return etree.Element(tag)
+	return etree.SubElement(parent, tag)
+
 
-		start = int(variant["start"])
-		end = int(variant["end"])
-		sv_type =str(variant["type"])
-		zscore =float(variant["zscore"])		
-
-		if sv_type=='loss':
-			sv_type='DEL'
-		elif sv_type=='gain':
-			sv_type='DUP'
-
-		if args.wcx_size:
-			variant_size = (end-start)
-			if variant_size <= args.wcx_size:
-				#Too short
-				skipped += 1
-				logger.debug(f'skipped variant start={start},end={end},type= {sv_type} for being too short. Size of skipped variant={variant_size}bp')
-				logger.info(f'skipped {skipped} variants for being too short') 
-				continue		
-				
-		logger.debug('%s at %s:%s-%s (%s bp), Total skipped due to size: %s', sv_type, chrom, start+1, end, end - start, skipped)
-		yield Event(chrom=chrom, start=start, end=end, type=sv_type, zscore=zscore, info={})
-
-def parse_tiddit_coverage(args, AUTOSOMES):
-	
-	tiddit_coverage = pd.read_csv(args.tiddit_cov, sep="\t", header = 0)
-	autosomes_coverage = []
-	y_coverage_records = []
-
-	for _, bin in tiddit_coverage.iterrows():
-		if bin["quality"] < 20:
-			continue	
-		
-		chrom = str(bin["#CHR"])
-
-		if chrom in AUTOSOMES:
-			autosomes_coverage.append(bin["coverage"])			
-		elif chrom == "Y":
-			y_coverage_records.append(bin)	
-
-
-	autosomes_mean = np.mean(autosomes_coverage)
-
-	for bin in y_coverage_records:
-		start = int(bin["start"])
-		end = int(bin["end"])
-		Y_cov =float(bin["coverage"])
-		coverage = Y_cov / autosomes_mean
-		
-				
-		yield CoverageRecord("Y", start, end, coverage)
-			
 def make_probe(parent, chromosome, start, end, height, text, original_coverage=None):
-	probe = etree.SubElement(parent, 'probe')
+	from lxml import etree
+	probe = new_element(parent, 'probe')
 	probe.attrib.update({
 		'name': text,
 		'chromosome': CHROM_RENAME.get(chromosome, chromosome),
@@ -115,7 +273,7 @@ def make_probe(parent, chromosome, start, end, height, text, original_coverage=N
 
 
 def make_segment(parent, chromosome, start, end, height, zscore):
-	segment = etree.SubElement(parent, 'segment')
+	segment = new_element(parent, 'segment')
 	segment.attrib.update({
 		'chrId': CHROM_RENAME.get(chromosome, chromosome),
 		'numProbes': '100',
@@ -134,12 +292,14 @@ def make_aberration(parent, chromosome, start, end, zscore, comment=None, method
 	method -- short string
 	confirmation -- string
 	"""
+	from lxml import etree
+
 	# Set gain to false for dels
 	is_gain = 'true'
 	if (confirmation == "DEL"):
 		is_gain = 'false'
 
-	aberration = etree.SubElement(parent, 'aberration')
+	aberration = new_element(parent, 'aberration')
 	aberration.attrib.update(dict(
 		chr=CHROM_RENAME.get(chromosome, chromosome),
 		start=str(start + 1),
@@ -175,23 +335,6 @@ def make_aberration(parent, chromosome, start, end, zscore, comment=None, method
 	return aberration
 
 
-def spaced_probes(start, end, probe_spacing=PROBE_SPACING):
-	"""
-	Yield nicely spaced positions along the interval (start, end).
-	- start and end are always included
-	- at least three positions are included
-	"""
-	l = end - start
-	n = l // probe_spacing
-	spacing = l / max(n, 2)  # float division
-	i = 0
-	pos = start
-	while pos <= end:
-		yield pos
-		i += 1
-		pos = start + int(i * spacing)
-
-
 def format_comment(info):
 	comment = ''
 	for k, v in sorted(info.items()):
@@ -201,128 +344,520 @@ def format_comment(info):
 	return comment
 
 
-def merge_intervals(intervals):
-	"""Merge overlapping intervals into a single one"""
-	events = [(coord[0], 'START') for coord in intervals]
-	events.extend((coord[1], 'STOP') for coord in intervals)
-	events.sort()
-	active = 0
-	start = 0
-	for pos, what in events:
-		# Note adjacent 'touching' events are merged because 'START' < 'STOP'
-		if what == 'START':
-			if active == 0:
-				start = pos
-			active += 1
-		else:
-			active -= 1
-			if active == 0:
-				yield (start, pos)
-
+def add_probes_between_events(writer, chr_intervals, CONTIG_LENGTHS, windows=None):
+	"""Write probes at height 0 between the events; with windows (an IntervalIndex), only inside these"""
+	import numpy as np
+	from .cgh import format_probes
+	from .intervals import complement_intervals, spaced_positions
 
-def add_probes_between_events(probes, chr_intervals, CONTIG_LENGTHS):
 	for chrom, intervals in chr_intervals.items():
 		if chrom not in CONTIG_LENGTHS:
 			continue
-		intervals = merge_intervals(intervals)
-		for start, end in complement_intervals(intervals, CONTIG_LENGTHS[chrom]):
-			for pos in spaced_probes(start, end, probe_spacing=200000):
-				# CytoSure does not display probes at height=0.0
-				make_probe(probes, chrom, pos, pos + 60, 0.01, 'between events')
+		starts, ends = np.array(intervals, dtype=np.int64).reshape(-1, 2).T
+		gap_starts, gap_ends = complement_intervals(starts, ends, CONTIG_LENGTHS[chrom])
+		positions, _ = spaced_positions(gap_starts, gap_ends, probe_spacing=200000)
+		if windows is not None:
+			positions = positions[windows.mask(chrom, positions, positions + 60)]
+		# CytoSure does not display probes at height=0.0
+		heights = np.full(len(positions), 0.01)
+		writer.write_serialized(format_probes(chrom, positions, positions + 60, heights, 'between events'), len(positions))
 
 
-class CoverageRecord:
-	__slots__ = ('chrom', 'start', 'end', 'coverage')
+WISECONDORX_BINS_DTYPES = {
+	'chr': str,
+	'start': 'int64',
+	'end': 'int64',
+	'ratio': 'float64',
+}
 
-	def __init__(self, chrom, start, end, coverage):
-		self.chrom = chrom
-		self.start = start
-		self.end = end
-		self.coverage = coverage
 
-def parse_wisecondorx_coverages(args):
-	df = pd.read_csv(args.wisecondorx_cov, sep="\t", header=0)
-	
-	for _, row in df.iterrows():
+def parse_wisecondorx_coverages(args, CONTIG_LENGTHS, metrics=NULL_METRICS):
+	"""
+	Read the bins.bed file, or the .npz results (see npz.py), from WisecondorX
+	into a DataFrame with the columns chr, start, end and ratio. Bins without a
+	ratio and bins on contigs that are not in CONTIG_LENGTHS are dropped.
+	"""
+	from .inputs import read_table
 
-		chrom = row["chr"]
-		start = int(row["start"])
-		end = int(row["end"])
-		coverage =float(row["ratio"])
-		
-		if pd.isna(coverage):
-			continue	
+	if is_npz(args.wisecondorx_cov):
+		from .npz import read_coverages
+		return read_coverages(args.wisecondorx_cov, CONTIG_LENGTHS, parse_regions(args.regions), metrics)
 
-		yield CoverageRecord(chrom, start, end, coverage)
+	df = read_table(args.wisecondorx_cov, usecols=list(WISECONDORX_BINS_DTYPES), dtype=WISECONDORX_BINS_DTYPES,
+		regions=parse_regions(args.regions), contigs=CONTIG_LENGTHS, cache=input_cache(args))
+	return filter_coverages(df, CONTIG_LENGTHS, metrics)
 
 
-def group_by_chromosome(records):
+def filter_coverages(df, CONTIG_LENGTHS, metrics=NULL_METRICS):
 	"""
-	Group records by their .chrom attribute.
+	Drop the bins without a ratio and the bins on contigs that are not in
+	CONTIG_LENGTHS. The chr column of the result holds canonical names.
+	"""
+	contigs = contig_registry(CONTIG_LENGTHS)
+	codes = contigs.encode(df["chr"])
+	has_ratio = df["ratio"].notna().to_numpy()
+	on_contig = codes >= 0
+	keep = has_ratio & on_contig
+	metrics.count('read_bins', 'rows_read', len(df))
+	metrics.count('read_bins', 'rows_without_ratio', len(df) - int(has_ratio.sum()))
+	metrics.count('read_bins', 'rows_filtered_contig', int((has_ratio & ~on_contig).sum()))
+
+	df = df[keep].reset_index(drop=True)
+	df["chr"] = contigs.decode(codes[keep])
+	return df
 
-	Yield pairs (chromosome, list_of_records) where list_of_records
-	are the consecutive records sharing the same chromosome.
+
+def normalize_coverages(coverages, args, CONTIG_LENGTHS, metrics=NULL_METRICS):
+	"""Express the ratios relative to the cohort with --normalization-profile (see cohort.py)"""
+	if not args.normalization_profile:
+		return coverages
+	from .cohort import normalize_coverages
+	return normalize_coverages(coverages, args.normalization_profile, CONTIG_LENGTHS, input_cache(args), metrics)
+
+
+def group_by_chromosome(df):
 	"""
-	prev_chrom = None
-	chromosome_records = []
-	for record in records:
-		if record.chrom != prev_chrom:
-			if chromosome_records:
-				yield prev_chrom, chromosome_records
-				chromosome_records = []
-		chromosome_records.append(record)
-		prev_chrom = record.chrom
-	if chromosome_records:
-		yield prev_chrom, chromosome_records
+	Group rows by their chr column.
 
+	Yield pairs (chromosome, sub_frame) where sub_frame holds the
+	consecutive rows sharing the same chromosome.
+	"""
+	import numpy as np
+	import pandas as pd
 
-def add_coverage_probes(probes, args, CONTIG_LENGTHS, sample_id):
+	chroms = df["chr"].to_numpy()
+	if len(chroms) == 0:
+		return
+	codes, _ = pd.factorize(chroms)
+	breaks = np.flatnonzero(codes[1:] != codes[:-1]) + 1
+	bounds = np.concatenate(([0], breaks, [len(chroms)]))
+	for start, end in zip(bounds[:-1], bounds[1:]):
+		yield chroms[start], df.iloc[start:end]
+
+
+def coverage_heights(ratios):
+	"""
+	Scale WisecondorX ratios to probe heights, clipped to
+	[MIN_HEIGHT, MAX_HEIGHT].
+	"""
+	import numpy as np
+
+	heights = np.clip(np.asarray(ratios, dtype=np.float64) * 10, MIN_HEIGHT, MAX_HEIGHT)
+	# CytoSure does not display probes at height=0.0
+	heights[heights == 0.0] = 0.01
+	return heights
+
+
+def aggregate_bins(block, resolution, method='mean', breakpoints=()):
 	"""
-	probes -- <probes> element
-	path -- path to tab-separated file with coverages
+	Merge adjacent bins of one chromosome into windows of resolution bp.
+
+	block -- DataFrame with start, end and ratio columns, sorted by start
+	method -- how the ratios of a window are combined: 'mean', 'median' or
+		'weighted' (mean weighted by bin length)
+	breakpoints -- positions that no window may span, such as the start and
+		end coordinates of the aberrations on this chromosome
+
+	Return a DataFrame with the same columns and one row per window.
 	"""
-	coverages = [r for r in parse_wisecondorx_coverages(args) if r.chrom in CONTIG_LENGTHS]
-	Y_coverages = parse_tiddit_coverage(args, AUTOSOMES)
+	import numpy as np
+	import pandas as pd
+
+	starts = block["start"].to_numpy()
+	ends = block["end"].to_numpy()
+	ratios = block["ratio"].to_numpy()
+	if len(starts) == 0:
+		return block
+
+	window = starts // resolution
+	segment = np.searchsorted(np.unique(np.asarray(breakpoints, dtype=np.int64)), starts, side='right')
+	new_group = np.ones(len(starts), dtype=bool)
+	new_group[1:] = (window[1:] != window[:-1]) | (segment[1:] != segment[:-1])
+	first = np.flatnonzero(new_group)
+	last = np.append(first[1:], len(starts)) - 1
+	sizes = last - first + 1
+
+	if method == 'mean':
+		merged = np.add.reduceat(ratios, first) / sizes
+	elif method == 'weighted':
+		lengths = (ends - starts).astype(np.float64)
+		merged = np.add.reduceat(ratios * lengths, first) / np.add.reduceat(lengths, first)
+	elif method == 'median':
+		group = np.cumsum(new_group) - 1
+		ordered = ratios[np.lexsort((ratios, group))]
+		merged = (ordered[first + (sizes - 1) // 2] + ordered[first + sizes // 2]) / 2
+	else:
+		raise ValueError(f'Unknown aggregation method: {method}')
 
-	n = 0
-	for chromosome, records in group_by_chromosome(coverages):
-		coverage_factor = 1
-				
-		for record in records:	
-			height = record.coverage
-			adjusted_height = (record.coverage*10)
-#			adjusted_height=(((2**height)-1)* 100) / 10
+	return pd.DataFrame({
+		"chr": block["chr"].to_numpy()[first],
+		"start": starts[first],
+		"end": ends[last],
+		"ratio": merged,
+	})
 
-			adjusted_height = min(MAX_HEIGHT, adjusted_height)
-			adjusted_height = max(MIN_HEIGHT, adjusted_height)
-			
-			if adjusted_height == 0.0:
-				adjusted_height = 0.01			
-				
-			make_probe(probes, record.chrom, record.start, record.end, adjusted_height, 'coverage', record.coverage)
 
-			n += 1
-	logger.info('Added %s coverage probes for %s', n, sample_id)
+def export_windows(args, CONTIG_LENGTHS, events):
+	"""
+	Return the IntervalIndex of the windows to export: FLANK bp around every
+	event with --around-events, else the --regions. Return None to export the
+	whole genome.
+	"""
+	from .intervals import IntervalIndex
 
-	Y_n = 0
+	if args.around_events is not None:
+		return IntervalIndex.around(events, args.around_events, CONTIG_LENGTHS)
+	regions = parse_regions(args.regions)
+	if regions:
+		return IntervalIndex.from_regions(regions, CONTIG_LENGTHS)
+	return None
 
-	for Y_record in Y_coverages:
-	
-		coverage_factor = 1
 
-		height = record.coverage
-		adjusted_height = (record.coverage*10)
+def select_windows(windows, coverages=None, tiddit_coverage=None, metrics=NULL_METRICS):
+	"""
+	Keep the bins (as from filter_coverages, sorted by start on each
+	chromosome) and the TIDDIT bins on Y that overlap the windows, an
+	IntervalIndex. The bins are found by binary search on each chromosome.
+	"""
+	import numpy as np
+
+	if coverages is not None:
+		rows = []
+		offset = 0
+		for chromosome, block in group_by_chromosome(coverages):
+			rows.append(offset + windows.select(chromosome, block["start"].to_numpy(), block["end"].to_numpy()))
+			offset += len(block)
+		rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+		metrics.count('select_windows', 'bins', len(rows))
+		coverages = coverages.iloc[rows].reset_index(drop=True)
+	if tiddit_coverage is not None:
+		keep = windows.mask("Y", tiddit_coverage.y_start, tiddit_coverage.y_end)
+		tiddit_coverage = TidditCoverage(tiddit_coverage.sums, tiddit_coverage.counts, tiddit_coverage.y_start[keep],
+			tiddit_coverage.y_end[keep], tiddit_coverage.y_coverage[keep])
+	return coverages, tiddit_coverage
+
+
+def add_event_probes(writer, events, metrics=NULL_METRICS, covered=None):
+	"""
+	Write probes spaced PROBE_SPACING apart over each event, at the height of
+	its type. With covered, the merged (starts, ends) of the bins of the
+	chromosome, the probes where there are bins are left out.
+	"""
+	import numpy as np
+	from .cgh import format_probes
+	from .intervals import overlap_mask, spaced_positions
+
+	positions, index = spaced_positions([event.start for event in events], [event.end - 1 for event in events],
+		probe_spacing=PROBE_SPACING)
+	bounds = np.searchsorted(index, np.arange(len(events) + 1))
+	for event, first, last in zip(events, bounds[:-1], bounds[1:]):
+		height = ABERRATION_HEIGHTS[event.type]
+		# show probes at slightly different height than segments
+		event_positions = positions[first:last]
+		if covered is not None:
+			on_bins = overlap_mask(*covered, event_positions, event_positions + 60)
+			metrics.count('event_probes', 'probes_dropped', int(on_bins.sum()), chromosome=event.chrom)
+			event_positions = event_positions[~on_bins]
+		writer.write_serialized(format_probes(event.chrom, event_positions, event_positions + 60,
+			np.full(len(event_positions), height), event.type), len(event_positions))
+		metrics.count('event_probes', 'probes', len(event_positions), chromosome=event.chrom)
 
-		adjusted_height = min(MAX_HEIGHT, adjusted_height)
-		adjusted_height = max(MIN_HEIGHT, adjusted_height)
 
-		if adjusted_height == 0.0:
-			adjusted_height = 0.01
+def format_coverage_probes(chromosome, starts, ends, values, event_index=None, metrics=NULL_METRICS, heights=None):
+	"""
+	Serialize coverage probes with the heights of their values, or the
+	heights given. With event_index, an EventIndex, each probe overlapping an
+	event gets its type and z-score as the event_type and event_zscore
+	attributes.
+	"""
+	import numpy as np
+	from .cgh import format_probes
+
+	heights = coverage_heights(values) if heights is None else heights
+	if event_index is None or len(starts) == 0:
+		return format_probes(chromosome, starts, ends, heights, 'coverage', values)
+	overlapping = event_index.overlapping(chromosome, starts, ends)
+	metrics.count('coverage_probes', 'probes_tagged', int((overlapping >= 0).sum()), chromosome=chromosome)
+	# runs of probes overlapping the same event (or none) share their attributes
+	bounds = [0, *(np.flatnonzero(np.diff(overlapping)) + 1).tolist(), len(overlapping)]
+	events = event_index[chromosome]
+	chunks = []
+	for first, last in zip(bounds[:-1], bounds[1:]):
+		event = events[overlapping[first]] if overlapping[first] >= 0 else None
+		attributes = {'event_type': event.type, 'event_zscore': event.zscore} if event else None
+		chunks.append(format_probes(chromosome, starts[first:last], ends[first:last], heights[first:last], 'coverage',
+			values[first:last], attributes))
+	return b''.join(chunks)
+
+
+def add_coverage_probes(writer, chromosome, blocks, args, breakpoints=(), metrics=NULL_METRICS, event_index=None):
+	"""
+	Write the coverage probes of one chromosome.
+
+	blocks -- DataFrames of consecutive bins on the chromosome, as from
+		group_by_chromosome()
+	args -- arguments holding the probe resolution and aggregation
+	breakpoints -- with args.probe_resolution, bins are not merged across
+		these positions, such as the aberration boundaries
+	event_index -- EventIndex to tag the probes with (see format_coverage_probes)
+	"""
+	for block in blocks:
+		if args.probe_resolution:
+			block = aggregate_bins(block, args.probe_resolution, args.probe_aggregation, breakpoints)
+		writer.write_serialized(format_coverage_probes(chromosome, block["start"].to_numpy(), block["end"].to_numpy(),
+			block["ratio"].to_numpy(), event_index, metrics), len(block))
+		metrics.count('coverage_probes', 'probes', len(block), chromosome=chromosome)
 
-		make_probe(probes, Y_record.chrom, Y_record.start, Y_record.end, adjusted_height, 'coverage', Y_record.coverage)
 
-		Y_n += 1
-	logger.info('Added %s coverage probes on Y for %s', Y_n, sample_id)
+def add_y_probes(writer, tiddit_coverage, metrics=NULL_METRICS, event_index=None):
+	"""
+	Write the coverage probes on Y from the TIDDIT coverage, at the height of
+	their log2 ratio to the male dosage and with their coverage relative to the
+	autosomes as original_coverage
+	"""
+	Y_n = len(tiddit_coverage.y_coverage)
+	writer.write_serialized(format_coverage_probes("Y", tiddit_coverage.y_start, tiddit_coverage.y_end,
+		tiddit_coverage.y_coverage, event_index, metrics, coverage_heights(tiddit_coverage.y_log2_ratios())), Y_n)
+	metrics.count('y_probes', 'probes', Y_n, chromosome="Y")
+
+
+def covered_intervals(coverages):
+	"""Return the merged (starts, ends) of the bins (as from filter_coverages) on each chromosome"""
+	import numpy as np
+	from .intervals import merge_intervals
+
+	chr_blocks = defaultdict(list)
+	for chromosome, block in group_by_chromosome(coverages):
+		chr_blocks[chromosome].append(block)
+	return {chromosome: merge_intervals(np.concatenate([block["start"].to_numpy() for block in blocks]),
+		np.concatenate([block["end"].to_numpy() for block in blocks])) for chromosome, blocks in chr_blocks.items()}
+
+
+def chromosome_jobs(args, CONTIG_LENGTHS, events, coverages=None, tiddit_coverage=None, cached=(), windows=None,
+		covered=None):
+	"""
+	Split the probe and segment generation into one job per chromosome, in
+	the order of CONTIG_LENGTHS (1-22, X, Y).
+
+	events -- Events, sorted by chromosome
+	coverages -- bins from parse_wisecondorx_coverages(), or None to place
+		probes between the events instead
+	cached -- chromosomes whose coverage probes come from the sidecar; with
+		these, coverages and tiddit_coverage are None
+	windows -- IntervalIndex that the probes between events are kept to
+	covered -- merged (starts, ends) of the bins by chromosome (see
+		covered_intervals) where the event probes are left out
+	"""
+	chr_events = defaultdict(list)
+	for event in events:
+		chr_events[event.chrom].append(event)
+	chr_blocks = defaultdict(list)
+	if coverages is not None:
+		for chromosome, block in group_by_chromosome(coverages):
+			chr_blocks[chromosome].append(block)
+
+	for chromosome in CONTIG_LENGTHS:
+		job = {
+			'args': args,
+			'chromosome': chromosome,
+			'length': CONTIG_LENGTHS[chromosome],
+			'events': chr_events.get(chromosome, []),
+			'bins': chr_blocks.get(chromosome, []) if coverages is not None else None,
+			'tiddit_coverage': tiddit_coverage if chromosome == "Y" and coverages is not None else None,
+			'cached': bool(cached),
+			'windows': windows,
+			'covered': covered.get(chromosome) if covered is not None else None,
+		}
+		if job['events'] or job['bins'] or job['tiddit_coverage'] is not None or chromosome in cached:
+			yield job
+
+
+@contextmanager
+def worker_map(workers):
+	"""
+	Provide a map() that runs in a pool of worker processes, or the builtin
+	map() for a single worker. Either way the results come in input order.
+	The pool takes jobs from the input as results are consumed, with at most
+	workers + PIPELINE_DEPTH of them submitted and not yet consumed, so the
+	pickled jobs and their results do not all pile up at once.
+	"""
+	if not workers or workers <= 1:
+		yield map
+		return
+	from concurrent.futures import ProcessPoolExecutor
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		yield lambda fn, iterable: bounded_map(executor, workers + PIPELINE_DEPTH, fn, iterable)
+
+
+def bounded_map(executor, size, fn, iterable):
+	"""Like executor.map(fn, iterable), but with at most size futures in flight"""
+	pending = deque()
+	try:
+		for item in iterable:
+			if len(pending) >= size:
+				yield pending.popleft().result()
+			pending.append(executor.submit(fn, item))
+		while pending:
+			yield pending.popleft().result()
+	finally:
+		for future in pending:
+			future.cancel()
+
+
+def prefetch(iterable, size, metrics=NULL_METRICS):
+	"""
+	Run iterable in a background thread, at most size items ahead of the
+	consumer, and yield its items in order. The pipeline stage records how
+	long the producer was busy and how much of that the consumer did not
+	have to wait for.
+	"""
+	import queue
+	import threading
+
+	items = queue.Queue(maxsize=size)
+	stop = threading.Event()
+	done = object()
+	busy = 0.0
+
+	def put(item):
+		while not stop.is_set():
+			try:
+				items.put(item, timeout=0.1)
+				return
+			except queue.Full:
+				pass
+
+	def produce():
+		nonlocal busy
+		iterator = iter(iterable)
+		try:
+			while not stop.is_set():
+				started = time.perf_counter()
+				try:
+					item = next(iterator)
+				except StopIteration:
+					break
+				finally:
+					busy += time.perf_counter() - started
+				put((item, None))
+		except Exception as e:
+			put((None, e))
+		put((done, None))
+
+	thread = threading.Thread(target=produce, name='wcx2cytosure-prefetch', daemon=True)
+	thread.start()
+	waited = 0.0
+	try:
+		while True:
+			started = time.perf_counter()
+			item, error = items.get()
+			waited += time.perf_counter() - started
+			if error is not None:
+				raise error
+			if item is done:
+				break
+			yield item
+	finally:
+		stop.set()
+		thread.join()
+		metrics.count('pipeline', 'generate_seconds', round(busy, 6))
+		metrics.count('pipeline', 'generate_seconds_saved', round(busy - waited, 6))
+
+
+def chromosome_fragments(job):
+	"""
+	Serialize the probes and the segments of one job from chromosome_jobs().
+	This is what runs in the worker processes with --workers.
+
+	Return the chromosome, the event probes, the other probes (coverage or
+	between events) and the segments as Fragments, and the Metrics of the work.
+	"""
+	from .cgh import Fragment
+	from .intervals import EventIndex
+
+	metrics = Metrics()
+	args, chromosome, events = job['args'], job['chromosome'], job['events']
+	probes = Fragment()
+	coverage = Fragment()
+	segments = Fragment()
+
+	event_index = EventIndex(events) if args.tag_coverage_probes else None
+	with metrics.stage('event_probes'):
+		add_event_probes(probes, events, metrics, job['covered'])
+	if job['bins'] is not None:
+		with metrics.stage('coverage_probes'):
+			breakpoints = [pos for event in events for pos in (event.start, event.end)]
+			add_coverage_probes(coverage, chromosome, job['bins'], args, breakpoints, metrics, event_index)
+	elif events and not job['cached']:
+		with metrics.stage('between_event_probes'):
+			add_probes_between_events(coverage, {chromosome: [(event.start, event.end) for event in events]},
+				{chromosome: job['length']}, job['windows'])
+	if job['tiddit_coverage'] is not None:
+		with metrics.stage('y_probes'):
+			add_y_probes(coverage, job['tiddit_coverage'], metrics, event_index)
+
+	with metrics.stage('segments'):
+		for event in events:
+			height = ABERRATION_HEIGHTS[event.type]
+			segments.write(make_segment(None, event.chrom, event.start, event.end, height, event.zscore))
+	return chromosome, probes, coverage, segments, metrics
+
+
+def coverage_key(args, CONTIG_LENGTHS, events):
+	"""
+	Identify the coverage probes that a run makes: the content of the bins
+	and TIDDIT inputs, the genome build, the options and the constants that
+	change the probes. With --probe-resolution, the bins are not merged across
+	the aberration boundaries, with --around-events only the bins near the
+	aberrations are kept, and with --tag-coverage-probes the probes carry the
+	type and z-score of the aberrations, so these are part of the key too.
+	"""
+	import hashlib
+	import json
+	from .cache import file_digest
+	from .cgh import PROBE_TEMPLATE
+
+	key = {
+		'version': __version__,
+		'bins': file_digest(args.wisecondorx_cov),
+		'tiddit': file_digest(args.tiddit_cov) if args.tiddit_cov else None,
+		'contigs': CONTIG_LENGTHS,
+		'regions': parse_regions(args.regions),
+		'probe_resolution': args.probe_resolution,
+		'probe_aggregation': args.probe_aggregation,
+		'around_events': args.around_events,
+		'normalization_profile': file_digest(args.normalization_profile) if args.normalization_profile else None,
+		'constants': [MIN_HEIGHT, MAX_HEIGHT, TIDDIT_MIN_QUALITY, MALE_Y_COVERAGE_RATIO, MALE_Y_DOSAGE, PROBE_TEMPLATE],
+	}
+	if args.probe_resolution or args.around_events is not None:
+		key['breakpoints'] = [(event.chrom, event.start, event.end) for event in events]
+	if args.tag_coverage_probes:
+		key['tags'] = [(event.chrom, event.start, event.end, event.type, event.zscore) for event in events]
+	text = json.dumps(key, sort_keys=True)
+	return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+@contextmanager
+def replace_on_success(path):
+	"""
+	Open a new file next to path for writing, and move it to path when the
+	block succeeds. On failure it is removed, and a file already at path is
+	left as it was.
+	"""
+	import threading
+
+	directory, name = os.path.split(os.path.abspath(path))
+	partial = os.path.join(directory, f'.{name}.{os.getpid()}-{threading.get_ident()}.partial')
+	try:
+		with open(partial, 'xb') as f:
+			yield f
+		os.replace(partial, path)
+	except BaseException:
+		try:
+			os.unlink(partial)
+		except OSError:
+			pass
+		raise
 
 
 #retrieve the sample id, assuming single sample vcf
@@ -331,78 +866,431 @@ def retrieve_sample_id(input_path):
     
 	return sample
 
-def main():
-	logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
-	parser = argparse.ArgumentParser("WCX2cytosure - convert WisecondorX files to cytosure format")
+def build_parser():
+	parser = argparse.ArgumentParser("WCX2cytosure - convert WisecondorX files to cytosure format",
+		epilog='Run "wcx2cytosure batch --help" to convert many samples at once, '
+		'"wcx2cytosure serve --help" to keep a conversion service running, '
+		'"wcx2cytosure cohort --help" to make a normalization profile, '
+		'or "wcx2cytosure diff --help" to compare two CGH files.')
 
 	group = parser.add_argument_group('Input')
 	group.add_argument('--genome',required=False, default=37, help='Human genome version. Use 37 for GRCh37/hg19, 38 for GRCh38 template.')
-	group.add_argument('--wisecondorx_aberrations', type=str, required=False,help='path to aberrations.bed file from WisecondorX')
-	group.add_argument('--wisecondorx_cov', type=str, help='path to bins.bed file')
+	group.add_argument('--contigs', metavar='PATH',
+		help='take the chromosome lengths from this .fai or .dict file instead of the built-in table of --genome')
+	group.add_argument('--wisecondorx_aberrations', type=str, required=False,help='path to aberrations.bed file from WisecondorX, or its .npz results')
+	group.add_argument('--wisecondorx_cov', type=str, help='path to bins.bed file, or the .npz results of WisecondorX')
 	group.add_argument('--out',help='output file (default = the prefix of the input bed)')
 	group.add_argument('--wcx_size',type=int,help='Variants smaller than this size will be filtered out')
 	group.add_argument('--tiddit_cov', type=str, required=False, help='path to tiddit coverage file')
+	group.add_argument('--around-events', type=int, metavar='FLANK',
+		help='only export the coverage probes, segments and aberrations within FLANK bp of the aberrations, '
+		'for a small file to review')
+	group.add_argument('--regions', metavar='REGIONS',
+		help='only convert these regions, e.g. "1,2:1000000-2000000,X" (1-based, inclusive). '
+		'Inputs may be gzip or bgzip compressed; bgzip files with a tabix index are read by region.')
+
+	group = parser.add_argument_group('Probes')
+	group.add_argument('--probe-resolution', type=int, metavar='BP',
+		help='merge adjacent WisecondorX bins into coverage probes of about this size (never across aberration boundaries)')
+	group.add_argument('--probe-aggregation', choices=('mean', 'median', 'weighted'), default='mean',
+		help='how the ratios of merged bins are combined; weighted is the mean weighted by bin length (default: %(default)s)')
+
+	group.add_argument('--tag-coverage-probes', action='store_true',
+		help='give the coverage probes that overlap an aberration its type and z-score, as the event_type and '
+		'event_zscore attributes')
+	group.add_argument('--drop-covered-event-probes', action='store_true',
+		help='leave out the event probes where there are coverage probes from the bins, rather than draw both')
+
+	group.add_argument('--normalization-profile', metavar='PATH',
+		help='express the ratio of every bin relative to the median and MAD of a cohort, from a profile made with '
+		'"wcx2cytosure cohort"')
+
+	group.add_argument('--workers', '--threads', type=int, default=1, metavar='N',
+		help='generate the probes of different chromosomes in N processes; the output is the same (default: %(default)s)')
+	group.add_argument('--pipeline', action='store_true',
+		help='read the inputs at the same time, and write the probes of each chromosome while the next ones are made')
+
+	group = parser.add_argument_group('Cache')
+	group.add_argument('--cache-dir', metavar='DIR',
+		help='keep parsed inputs in this directory and reuse them when the same file is converted again '
+		'(default: $WCX2CYTOSURE_CACHE_DIR, or no cache)')
+	group.add_argument('--cache-max-size', type=float, default=10, metavar='GB',
+		help='remove the least recently used entries when the cache is larger than this (default: %(default)s)')
+	group.add_argument('--cache-max-age', type=float, default=30, metavar='DAYS',
+		help='remove entries not used for this many days (default: %(default)s)')
+	group.add_argument('--no-cache', action='store_true', help='neither read nor write the cache')
+	group.add_argument('--incremental', action='store_true',
+		help='keep the coverage probes in <out>.coverage and reuse them while the bins, TIDDIT coverage and probe '
+		'options are unchanged, so that only the aberrations, event probes and segments are made again')
+
+	group = parser.add_argument_group('Diagnostics')
+	group.add_argument('--metrics-json', metavar='PATH',
+		help='write wall time, CPU time, peak memory and item counts per stage to this JSON file')
+	group.add_argument('--profile', metavar='PATH', help='write cProfile statistics of the conversion to this file')
 
 	group.add_argument('-V','--version',action='version',version="%(prog)s "+__version__ ,
 			   help='Print program version and exit.')
 	# parser.add_argument('xml', help='CytoSure design file')
-	args= parser.parse_args()
+	return parser
 
-	logger.info('wcx2cytosure %s', __version__)
 
-	if not args.wisecondorx_aberrations:
-		print("Provide variant file. --wisecondorx_aberrations. See -help")
-		quit()	
+def default_args(**kwargs):
+	"""
+	Return the command line defaults as a Namespace, updated with kwargs.
+	Use this to call run() without parsing a command line.
+	"""
+	args = build_parser().parse_args([])
+	vars(args).update(kwargs)
+	return args
 
-	if int(args.genome) == 38:
-		CGH_TEMPLATE = CGH_TEMPLATE_38
-		CONTIG_LENGTHS = CONTIG_LENGTHS_38
-	else:
-		CGH_TEMPLATE = CGH_TEMPLATE_37
-		CONTIG_LENGTHS = CONTIG_LENGTHS_37
+
+def run(args, metrics=NULL_METRICS):
+	"""
+	Convert one sample described by args (see build_parser) to a CGH file.
+	Pass a Metrics instance to record the time and item counts per stage.
+
+	Return a dict with the sample id, the output path and the number of
+	aberrations, probes and segments written.
+	"""
+	with metrics.stage('total'):
+		result = _run(args, metrics)
+	metrics.count('total', 'bytes_written', result['bytes'])
+	return result
+
+
+def read_input(name, args, CONTIG_LENGTHS, metrics=NULL_METRICS):
+	"""
+	Read one input of a conversion in its stage: 'aberrations' (a list of
+	Events), 'tiddit' (TidditCoverage) or 'bins' (as from filter_coverages)
+	"""
+	with metrics.stage('read_' + name):
+		if name == 'aberrations':
+			return list(wisecondorx_events(args, CONTIG_LENGTHS, metrics))
+		if name == 'tiddit':
+			return parse_tiddit_coverage(args, metrics=metrics)
+		coverages = parse_wisecondorx_coverages(args, CONTIG_LENGTHS, metrics)
+		return normalize_coverages(coverages, args, CONTIG_LENGTHS, metrics)
+
+
+def read_inputs(names, args, CONTIG_LENGTHS, metrics=NULL_METRICS):
+	"""
+	Read the named inputs (see read_input) and return a dict of name to
+	result. With --pipeline they are read at the same time in threads. The
+	pipeline stage then records the sum of the read times less the time they
+	took together: the time saved as long as the reads wait on storage rather
+	than on a free CPU.
+	"""
+	if not args.pipeline or len(names) < 2:
+		return {name: read_input(name, args, CONTIG_LENGTHS, metrics) for name in names}
+
+	from concurrent.futures import ThreadPoolExecutor
+
+	read_metrics = {name: Metrics() for name in names}
+	started = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=len(names)) as executor:
+		futures = {name: executor.submit(read_input, name, args, CONTIG_LENGTHS, read_metrics[name]) for name in names}
+		results = {name: future.result() for name, future in futures.items()}
+	wall = time.perf_counter() - started
+	one_by_one = sum(read_metrics[name].stages['read_' + name].wall for name in names)
+	for name in names:
+		metrics.merge(read_metrics[name])
+	metrics.count('pipeline', 'read_seconds', round(wall, 6))
+	metrics.count('pipeline', 'read_seconds_saved', round(one_by_one - wall, 6))
+	return results
+
+
+def genome_build(genome, contigs=None):
+	"""
+	Return the CGH template of GRCh37 or GRCh38 and its ContigRegistry, or
+	the registry read from contigs, a .fai or .dict file, if given
+	"""
+	template = CGH_TEMPLATE_38 if int(genome) == 38 else CGH_TEMPLATE_37
+	if contigs:
+		return template, load_contigs(contigs)
+	return template, BUILDS[38 if int(genome) == 38 else 37]
+
+
+def infer_sex(tiddit_coverage):
+	"""Return True if the sample is male, False if female, None if unknown"""
+	male = tiddit_coverage.is_male()
+	logger.info('Mean coverage: autosomes %.2f, X %.2f, Y %.2f; inferred sex: %s',
+		tiddit_coverage.autosomes_mean, tiddit_coverage.x_mean, tiddit_coverage.y_mean,
+		{True: 'male', False: 'female', None: 'unknown'}[male])
+	return male
+
+
+def _run(args, metrics):
+	CGH_TEMPLATE, CONTIG_LENGTHS = genome_build(args.genome, args.contigs)
 
 	if not args.out:
-		prefix = os.path.basename(args.wisecondorx_aberrations).rsplit(".aberrations.bed", 1)[0]
+		prefix = os.path.basename(args.wisecondorx_aberrations)
+		prefix = prefix[:-len(".npz")] if prefix.endswith(".npz") else prefix.rsplit(".aberrations.bed", 1)[0]
 		args.out = f"{prefix}.cgh"
-	parser = etree.XMLParser(remove_blank_text=True)
-
-	sex_male = "false"
-	promega_sex = 'Female'
 
 	sample_id=retrieve_sample_id(args.wisecondorx_aberrations)
 
-	tree = etree.parse(StringIO(CGH_TEMPLATE.format(sample_id,sample_id,sample_id,sample_id,sex_male,promega_sex,sex_male)), parser)
+	inputs = ['aberrations'] + [name for name, path in (('tiddit', args.tiddit_cov), ('bins', args.wisecondorx_cov))
+		if path]
+	# Events are few compared to probes; keep them so that each section of
+	# the document can be written in order.
+	events = None
+	sidecar = cached = None
+	if args.incremental and args.wisecondorx_cov:
+		# The sidecar key depends on the events, and the other inputs are only
+		# needed if the sidecar is out of date.
+		events = read_inputs(['aberrations'], args, CONTIG_LENGTHS, metrics)['aberrations']
+		from .sidecar import CoverageSidecar
+		sidecar = CoverageSidecar(args.out + '.coverage', coverage_key(args, CONTIG_LENGTHS, events))
+		cached = sidecar.load()
+		metrics.count('coverage_sidecar', 'hits' if cached else 'misses')
+		inputs = [] if cached else inputs[1:]
+
+	results = read_inputs(inputs, args, CONTIG_LENGTHS, metrics)
+	events = results.get('aberrations', events)
+	tiddit_coverage = results.get('tiddit')
+	coverages = results.get('bins')
+
+	male = None
+	if cached:
+		male = cached['male']
+		logger.info('Reusing the coverage probes in %s; inferred sex: %s', sidecar.path,
+			{True: 'male', False: 'female', None: 'unknown'}[male])
+	elif tiddit_coverage is not None:
+		male = infer_sex(tiddit_coverage)
+
+	try:
+		with replace_on_success(args.out) as f:
+			counts = write_cgh(f, args, sample_id, events, coverages, tiddit_coverage, male, metrics, sidecar, cached)
+	finally:
+		if sidecar:
+			# removes the unfinished new sidecar if the conversion failed
+			sidecar.discard()
+
+	size = os.path.getsize(args.out)
+	logger.info('Wrote %d probes to %s (%.1f MB)', counts['probes'], args.out, size / 1e6)
+	return dict(sample=sample_id, out=args.out, bytes=size, **counts)
+
+
+def write_cgh(stream, args, sample_id, events, coverages=None, tiddit_coverage=None, male=None, metrics=NULL_METRICS,
+		sidecar=None, cached=None):
+	"""
+	Write the CGH document of a sample to a binary stream.
+
+	args -- options (see build_parser) for the genome build and the probes
+	events -- Events, as from aberration_events()
+	coverages -- bins as from filter_coverages(), or None to place probes
+		between the events instead
+	tiddit_coverage -- TidditCoverage for the probes on Y, if available
+	male -- the inferred sex, True, False or None for unknown
+	sidecar -- CoverageSidecar to store the coverage probes in, or with
+		cached (its loaded metadata) to take them from
+
+	Return a dict with the numbers of aberrations, probes and segments.
+	"""
+	import numpy as np
+	from .cgh import CGHWriter
+
+	CGH_TEMPLATE, CONTIG_LENGTHS = genome_build(args.genome, args.contigs)
+	events = sorted(events, key=lambda event: CONTIG_LENGTHS.code(event.chrom))
+	windows = export_windows(args, CONTIG_LENGTHS, events)
+	if windows is not None:
+		with metrics.stage('select_windows'):
+			coverages, tiddit_coverage = select_windows(windows, coverages, tiddit_coverage, metrics)
+	covered = None
+	if cached:
+		covered = {chromosome: tuple(np.array(bounds, dtype=np.int64) for bounds in chr_covered)
+			for chromosome, chr_covered in cached['covered'].items()}
+	elif coverages is not None and (sidecar or args.drop_covered_event_probes):
+		covered = covered_intervals(coverages)
+	jobs = chromosome_jobs(args, CONTIG_LENGTHS, events, coverages, tiddit_coverage,
+		cached=cached['blocks'] if cached else (), windows=windows,
+		covered=covered if args.drop_covered_event_probes else None)
+
+	with CGHWriter(stream, CGH_TEMPLATE, sample_id, 'true' if male else 'false', 'Male' if male else 'Female') as writer:
+		with metrics.stage('aberrations'):
+			writer.open_section('submission')
+			for event in events:
+				writer.write(make_aberration(None, event.chrom, event.start, event.end, event.zscore, confirmation=event.type,
+					comment=str(event.zscore)))
+
+		writer.open_section('probes')
+		segments = []
+		probe_metrics = Metrics()
+		with metrics.stage('probes'), worker_map(args.workers) as map_jobs:
+			fragments = map_jobs(chromosome_fragments, jobs)
+			if args.pipeline:
+				# the next chromosomes are made while this one is written
+				fragments = prefetch(fragments, PIPELINE_DEPTH, metrics)
+			# Fragments come back in chromosome order; the probes are written
+			# as they arrive and the (few) segments once all probes are out.
+			for chromosome, probes, coverage, chr_segments, chr_metrics in fragments:
+				writer.write_serialized(probes.getvalue(), probes.n)
+				if cached:
+					writer.write_serialized(*sidecar.read_block(chromosome))
+				else:
+					data = coverage.getvalue()
+					writer.write_serialized(data, coverage.n)
+					if sidecar:
+						sidecar.add_block(chromosome, data, coverage.n)
+				segments.append(chr_segments)
+				probe_metrics.merge(chr_metrics)
+		metrics.merge(probe_metrics)
+		if sidecar and not cached:
+			sidecar.commit(male=male, bins=len(coverages), coverage_probes=probe_metrics.total('coverage_probes', 'probes'),
+				y_probes=probe_metrics.total('y_probes', 'probes'),
+				covered={chromosome: [starts.tolist(), ends.tolist()] for chromosome, (starts, ends) in covered.items()})
+
+		writer.open_section('segmentation')
+		for chr_segments in segments:
+			writer.write_serialized(chr_segments.getvalue(), chr_segments.n)
+
+	if cached:
+		logger.info('Added %s cached coverage probes and %s on Y for %s', cached['coverage_probes'], cached['y_probes'],
+			sample_id)
+	elif coverages is not None:
+		coverage_n = probe_metrics.total('coverage_probes', 'probes')
+		if args.probe_resolution:
+			logger.info('Aggregated %s bins into %s coverage probes for %s', len(coverages), coverage_n, sample_id)
+		else:
+			logger.info('Added %s coverage probes for %s', coverage_n, sample_id)
+		if tiddit_coverage is not None:
+			logger.info('Added %s coverage probes on Y for %s', probe_metrics.total('y_probes', 'probes'), sample_id)
+	logger.info('Wrote %d variants to CGH for %s', len(events), sample_id)
 
-	segmentation = tree.xpath('/data/cgh/segmentation')[0]
-	probes = tree.xpath('/data/cgh/probes')[0]
-	submission = tree.xpath('/data/cgh/submission')[0]
-		
+	return {
+		'aberrations': writer.counts['submission'],
+		'probes': writer.counts['probes'],
+		'segments': writer.counts['segmentation'],
+	}
 
-	chr_intervals = defaultdict(list)
-	n = 0
 
-	for event in wisecondorx_events(args, CONTIG_LENGTHS):
-		end = event.end
-		height = ABERRATION_HEIGHTS[event.type]
-		make_segment(segmentation, event.chrom, event.start, end, height, event.zscore)
+PATH_TYPES = (str, os.PathLike)
 
-		comment = format_comment(event.info)
 
-		make_aberration(submission, event.chrom, event.start, end, event.zscore, confirmation=event.type,
-			comment=str(event.zscore))		
+def memory_table(table, dtypes, regions=None):
+	"""
+	Return the dtypes columns of a DataFrame or dict of arrays as a DataFrame,
+	without the rows outside regions (by the first three columns of dtypes)
+	"""
+	import pandas as pd
+	from .inputs import in_regions
 
-		chr_intervals[event.chrom].append((event.start, event.end))
-		# show probes at slightly different height than segments
-		for pos in spaced_probes(event.start, event.end - 1):
-			make_probe(probes, event.chrom, pos, pos + 60, height, event.type)
-		n += 1
-	if args.wisecondorx_cov:
-		add_coverage_probes(probes, args, CONTIG_LENGTHS, sample_id)
+	df = pd.DataFrame(table)[list(dtypes)].astype(dtypes)
+	if regions:
+		df = df[in_regions(df, regions)].reset_index(drop=True)
+	return df
+
+
+# Command line options that convert() takes as arguments or does not use
+NOT_CONVERT_OPTIONS = frozenset({'genome', 'wisecondorx_aberrations', 'wisecondorx_cov', 'tiddit_cov', 'out', 'cache_dir',
+	'cache_max_size', 'cache_max_age', 'no_cache', 'incremental', 'metrics_json', 'profile'})
+
+
+def convert(aberrations, bins=None, tiddit=None, out=None, genome=37, sample_id=None, metrics=NULL_METRICS,
+		**options):
+	"""
+	Convert one sample to CGH in this process, from files or from tables in
+	memory.
+
+	aberrations -- path to the aberrations.bed file from WisecondorX or to its
+		.npz results, or a DataFrame or dict of arrays with the columns of
+		aberrations.bed (see ABERRATION_DTYPES)
+	bins -- path to the bins.bed file or the .npz results, or a DataFrame or
+		dict of arrays with its chr, start, end and ratio columns
+	tiddit -- path to the TIDDIT coverage, or a DataFrame or dict of arrays
+		with its columns (see TIDDIT_DTYPES)
+	out -- binary stream to write to, or None to return the document
+	genome -- 37 or 38
+	sample_id -- default: the prefix of the aberrations file, or 'sample'
+	options -- command line options by their argparse name, such as wcx_size,
+		probe_resolution, regions or workers; not the input, output, cache or
+		diagnostics options, which the arguments above and metrics replace
+
+	Return the CGH document as bytes if out is None, else a dict with the
+	numbers of aberrations, probes and segments written. Raise TypeError for
+	options that convert() does not take.
+	"""
+	from io import BytesIO
+
+	unknown = set(options) - (set(vars(default_args())) - NOT_CONVERT_OPTIONS)
+	if unknown:
+		raise TypeError('convert() got unknown options: ' + ', '.join(sorted(unknown)))
+	args = default_args(genome=genome, **options)
+	_, CONTIG_LENGTHS = genome_build(genome, args.contigs)
+	regions = parse_regions(args.regions)
+
+	with metrics.stage('total'):
+		with metrics.stage('read_aberrations'):
+			if isinstance(aberrations, PATH_TYPES):
+				sample_id = sample_id or retrieve_sample_id(os.fspath(aberrations))
+				columns = read_aberrations(os.fspath(aberrations), regions=regions)
+			else:
+				columns = memory_table(aberrations, ABERRATION_DTYPES, regions)
+			events = list(aberration_events(columns, CONTIG_LENGTHS, args.wcx_size, metrics))
+
+		tiddit_coverage = male = None
+		if tiddit is not None:
+			with metrics.stage('read_tiddit'):
+				if isinstance(tiddit, PATH_TYPES):
+					args.tiddit_cov = os.fspath(tiddit)
+					tiddit_coverage = parse_tiddit_coverage(args, metrics=metrics)
+				else:
+					chunks = [memory_table(tiddit, TIDDIT_DTYPES)]
+					tiddit_coverage = summarize_tiddit_coverage(chunks, regions, metrics)
+			male = infer_sex(tiddit_coverage)
+
+		coverages = None
+		if bins is not None:
+			with metrics.stage('read_bins'):
+				if isinstance(bins, PATH_TYPES):
+					args.wisecondorx_cov = os.fspath(bins)
+					coverages = parse_wisecondorx_coverages(args, CONTIG_LENGTHS, metrics)
+				else:
+					coverages = filter_coverages(memory_table(bins, WISECONDORX_BINS_DTYPES, regions), CONTIG_LENGTHS,
+						metrics)
+				coverages = normalize_coverages(coverages, args, CONTIG_LENGTHS, metrics)
+
+		stream = BytesIO() if out is None else out
+		counts = write_cgh(stream, args, sample_id or 'sample', events, coverages, tiddit_coverage, male, metrics)
+	return stream.getvalue() if out is None else counts
+
+
+SUBCOMMANDS = {
+	'batch': 'wcx2cytosure.batch',
+	'cohort': 'wcx2cytosure.cohort',
+	'diff': 'wcx2cytosure.diff',
+	'serve': 'wcx2cytosure.serve',
+}
+
+
+def main(argv=None):
+	if argv is None:
+		argv = sys.argv[1:]
+	if argv and argv[0] in SUBCOMMANDS:
+		return importlib.import_module(SUBCOMMANDS[argv[0]]).main(argv[1:])
+
+	logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+	args = build_parser().parse_args(argv)
+
+	logger.info('wcx2cytosure %s', __version__)
+
+	if not args.wisecondorx_aberrations:
+		print("Provide variant file. --wisecondorx_aberrations. See -help")
+		quit()	
+
+	metrics = Metrics() if args.metrics_json else NULL_METRICS
+	if args.profile:
+		import cProfile
+		profiler = cProfile.Profile()
+		result = profiler.runcall(run, args, metrics)
+		profiler.dump_stats(args.profile)
+		logger.info('Wrote profile to %s', args.profile)
 	else:
-		add_probes_between_events(probes, chr_intervals, CONTIG_LENGTHS)
+		result = run(args, metrics)
 
-	tree.write(args.out, pretty_print=True)
-	logger.info('Wrote %d variants to CGH for %s', n, sample_id)
+	if args.metrics_json:
+		metrics.write_json(args.metrics_json, version=__version__, **result)
+		logger.info('Wrote stage metrics to %s', args.metrics_json)
 
 
 if __name__ == '__main__':